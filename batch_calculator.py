@@ -0,0 +1,197 @@
+import numpy as np
+
+from retirement_age_calculator import Series
+
+def _per_scenario_changes(manual_changes, num_scenarios):
+    """
+    Normalizes a manual change argument (None, one dictionary shared by every scenario, or a sequence of
+     dictionaries) into a list with one dictionary per scenario
+    """
+    if manual_changes is None:
+        return [{}] * num_scenarios
+    if isinstance(manual_changes, dict):
+        return [manual_changes] * num_scenarios
+    manual_changes = [changes if changes is not None else {} for changes in manual_changes]
+    if len(manual_changes) != num_scenarios:
+        raise ValueError("Got %s manual change dictionaries for %s scenarios" % (len(manual_changes), num_scenarios))
+    return manual_changes
+
+def _flatten_changes(changes_per_scenario, description, years_to_live):
+    """
+    Flattens a list of {year: change} dictionaries (one per scenario) into parallel scenario, year, and change arrays,
+     raising a ValueError if any year is outside [0, years_to_live)
+    """
+    scenarios = []
+    years = []
+    changes = []
+    for scenario, scenario_changes in enumerate(changes_per_scenario):
+        if scenario_changes:
+            scenarios.extend([scenario] * len(scenario_changes))
+            years.extend(scenario_changes.keys())
+            changes.extend(scenario_changes.values())
+    scenarios = np.array(scenarios, dtype=int)
+    years = np.array(years, dtype=int)
+    invalid = (years < 0) | (years >= years_to_live)
+    if invalid.any():
+        raise ValueError("Invalid %s change year '%s'; must be in range [0,%s)" % (description, years[invalid.argmax()], years_to_live))
+    return scenarios, years, np.array(changes, dtype=float)
+
+def _forward_fill(initial_values, scenarios, years, changes, years_to_live):
+    """
+    Builds a (year x scenario) array holding the value in effect at each year, along with the year that value took effect
+
+    Args:
+        initial_values: array of the value in effect at year 0 for each scenario (unless overridden by a change at year 0)
+        scenarios, years, changes: flattened changes, as returned by _flatten_changes
+        years_to_live: number of years in the model
+    """
+    num_scenarios = len(initial_values)
+    if len(scenarios) == 0:
+        return np.broadcast_to(initial_values, (years_to_live, num_scenarios)), 0
+
+    values = np.zeros((years_to_live, num_scenarios))
+    is_change = np.zeros((years_to_live, num_scenarios), dtype=bool)
+    values[0] = initial_values
+    is_change[0] = True
+    values[years, scenarios] = changes
+    is_change[years, scenarios] = True
+
+    change_year = np.maximum.accumulate(np.where(is_change, np.arange(years_to_live)[:, None], 0), axis=0)
+    return np.take_along_axis(values, change_year, axis=0), change_year
+
+class BatchRetirementAgeCalculator:
+    """
+    Vectorized equivalent of RetirementAgeCalculator, modelling many scenarios at once as (scenario x year) arrays.
+     All scenarios share the same years_to_live; every other input may vary per scenario.
+    """
+    def __init__(self,
+            current_retirement_savings,
+            annual_contribution,
+            annual_contribution_increase_rate,
+            pre_retirement_growth_rate,
+            post_retirement_growth_rate,
+            inflation_rate,
+            years_to_live,
+            desired_net_retirement_income_todays_dollars,
+            retirement_tax_rate,
+            manual_contrib_changes=None,
+            manual_net_worth_changes=None,
+            manual_retirement_income_changes=None):
+        """
+        Takes the same arguments as RetirementAgeCalculator, except that each scalar (other than years_to_live) may instead
+         be an array with one entry per scenario, and each manual change argument may instead be a sequence with one
+         dictionary per scenario.
+        """
+        scalar_args = [np.atleast_1d(np.asarray(arg, dtype=float)) for arg in (
+            current_retirement_savings,
+            annual_contribution,
+            annual_contribution_increase_rate,
+            pre_retirement_growth_rate,
+            post_retirement_growth_rate,
+            inflation_rate,
+            desired_net_retirement_income_todays_dollars,
+            retirement_tax_rate)]
+        shapes = [arg.shape for arg in scalar_args]
+        for manual_changes in (manual_contrib_changes, manual_net_worth_changes, manual_retirement_income_changes):
+            if manual_changes is not None and not isinstance(manual_changes, dict):
+                shapes.append((len(manual_changes),))
+        num_scenarios, = np.broadcast_shapes(*shapes)
+        (current_retirement_savings,
+            annual_contribution,
+            annual_contribution_increase_rate,
+            pre_retirement_growth_rate,
+            post_retirement_growth_rate,
+            inflation_rate,
+            desired_net_retirement_income_todays_dollars,
+            retirement_tax_rate) = [np.broadcast_to(arg, (num_scenarios,)) for arg in scalar_args]
+
+        if years_to_live < 1:
+            raise ValueError("Years to live must be >= 1")
+        contrib_scenarios, contrib_years, contrib_changes = _flatten_changes(
+            _per_scenario_changes(manual_contrib_changes, num_scenarios), "contrib", years_to_live)
+        contrib_changes = contrib_changes.reshape(-1, 2)
+        net_worth_scenarios, net_worth_years, net_worth_changes = _flatten_changes(
+            _per_scenario_changes(manual_net_worth_changes, num_scenarios), "net worth", years_to_live)
+        income_scenarios, income_years, income_changes = _flatten_changes(
+            _per_scenario_changes(manual_retirement_income_changes, num_scenarios), "retirement income", years_to_live)
+
+        # Everything is computed as (year x scenario) so each step of the year-by-year recurrences touches contiguous
+        #  memory, and then exposed as (scenario x year) views. Compounding uses np.power, like the scalar calculator's **,
+        #  so a rate of -100% gives 0 ** 0 == 1 in the year it takes effect rather than exp(0 * log(0)) == NaN.
+        years = np.arange(years_to_live)[:, None]
+        pre_growth = 1 + pre_retirement_growth_rate
+        post_growth = 1 + post_retirement_growth_rate
+
+        # Same as RetirementWithdrawalsFunction
+        net_income, _ = _forward_fill(desired_net_retirement_income_todays_dollars, income_scenarios, income_years, income_changes, years_to_live)
+        gross_income = net_income / (1.0 - retirement_tax_rate)
+        all_withdrawals = gross_income * np.power(1 + inflation_rate, years)
+
+        # Same as RetirementMinWorthFunction, walking backwards from the last year
+        min_worth = np.empty((years_to_live, num_scenarios))
+        min_worth[-1] = all_withdrawals[-1]
+        for i in range(years_to_live - 2, -1, -1):
+            min_worth[i] = all_withdrawals[i] + min_worth[i + 1] / post_growth
+
+        # Same as ContributionFunction
+        if len(contrib_scenarios) == 0:
+            contributions = annual_contribution * np.power(1 + annual_contribution_increase_rate, years)
+        else:
+            base_contribs, change_years = _forward_fill(annual_contribution, contrib_scenarios, contrib_years, contrib_changes[:, 0], years_to_live)
+            contrib_rates, _ = _forward_fill(annual_contribution_increase_rate, contrib_scenarios, contrib_years, contrib_changes[:, 1], years_to_live)
+            contributions = base_contribs * np.power(1 + contrib_rates, years - change_years)
+
+        # Same as NoRetirementNetWorthFunction
+        net_worth_change_by_year = np.zeros((years_to_live, num_scenarios))
+        net_worth_change_by_year[net_worth_years, net_worth_scenarios] = net_worth_changes
+        no_retirement = np.empty((years_to_live, num_scenarios))
+        no_retirement[0] = np.maximum(0, current_retirement_savings + net_worth_change_by_year[0])
+        for i in range(1, years_to_live):
+            no_retirement[i] = np.maximum(0, no_retirement[i - 1] * pre_growth + contributions[i - 1] + net_worth_change_by_year[i])
+
+        # Earliest crossover, or -1 if the scenario never gets to retire
+        can_retire = no_retirement >= min_worth
+        has_retirement = can_retire.any(axis=0)
+        self.years_to_retirement = np.where(has_retirement, can_retire.argmax(axis=0), -1)
+
+        # Same as ActualWithdrawalsFunction and AccountValueFunction; columns for scenarios that can't retire are all NaN
+        retirement = np.where(has_retirement, self.years_to_retirement, years_to_live)
+        actual_withdrawals = np.where(years < retirement, 0.0, all_withdrawals)
+        account_value = no_retirement.copy()
+        for i in range(max(1, retirement.min() + 1), years_to_live):
+            after_retirement = (account_value[i - 1] - all_withdrawals[i - 1]) * post_growth
+            np.maximum(0, after_retirement, out=after_retirement)
+            np.copyto(account_value[i], after_retirement, where=i > retirement)
+        actual_withdrawals[:, ~has_retirement] = np.nan
+        account_value[:, ~has_retirement] = np.nan
+
+        self.waste = account_value[-1] - actual_withdrawals[-1]
+
+        self.series_data = {
+            Series.ALL_WITHDRAWALS: all_withdrawals.T,
+            Series.MIN_RETIREMENT_WORTH: min_worth.T,
+            Series.CONTRIBUTIONS: contributions.T,
+            Series.NO_RETIREMENT: no_retirement.T,
+            Series.ACCOUNT_VALUE: account_value.T,
+            Series.ACTUAL_WITHDRAWALS: actual_withdrawals.T,
+        }
+        for series_data in self.series_data.values():
+            series_data.flags.writeable = False
+
+    def get_earliest_retirement(self):
+        """
+        Get an integer array with the smallest number of years after which each scenario can retire, or -1 where not possible
+        """
+        return self.years_to_retirement
+
+    def get_waste(self):
+        """
+        Get an array with the dollars each scenario would die with, or NaN where the scenario never gets to retire
+        """
+        return self.waste
+
+    def get_series_data(self, series):
+        """
+        Get a read-only (scenario x year) view of the given series
+        """
+        return self.series_data[series]
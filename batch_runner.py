@@ -0,0 +1,69 @@
+import csv
+import json
+
+from retirement_age_calculator import ScenarioCache
+from scenario import evaluate_scenario
+
+# Optional input field that gets echoed back on the matching result, so callers can line results up with their inputs
+ID_KEY = 'id'
+LINE_KEY = 'line'
+ERROR_KEY = 'error'
+
+def read_jsonl_rows(input_file):
+    """
+    Yields (line number, fields) for each non-blank line of JSONL input, with fields set to a ValueError if the line isn't a JSON object
+    """
+    for line_num, line in enumerate(input_file, start=1):
+        if not line.strip():
+            continue
+        try:
+            fields = json.loads(line)
+        except ValueError as e:
+            yield line_num, ValueError("Invalid JSON: %s" % e)
+            continue
+        if not isinstance(fields, dict):
+            yield line_num, ValueError("Expected a JSON object")
+            continue
+        yield line_num, fields
+
+def read_csv_rows(input_file):
+    """
+    Yields (line number, fields) for each row of CSV input with a header row
+    """
+    reader = csv.DictReader(input_file)
+    for fields in reader:
+        yield reader.line_num, fields
+
+def run_batch(rows, output_file, include_series=False, cache=None):
+    """
+    Evaluates each scenario as it's read and writes one JSON result per line, so memory use stays constant no matter how
+     much input there is. Invalid scenarios get a result with an error message rather than stopping the batch.
+
+    Args:
+        rows: iterable of (line number, fields) as yielded by read_jsonl_rows or read_csv_rows
+        output_file: file object to write JSONL results to
+        include_series: whether to include every series in each result
+        cache: ScenarioCache shared across rows (a new one is created if None)
+
+    Returns:
+        (number of scenarios evaluated, number of errors)
+    """
+    cache = cache if cache is not None else ScenarioCache()
+    num_rows = 0
+    num_errors = 0
+    for line_num, fields in rows:
+        num_rows = num_rows + 1
+        result = {}
+        if isinstance(fields, dict) and fields.get(ID_KEY) not in (None, ''):
+            result[ID_KEY] = fields[ID_KEY]
+        try:
+            if isinstance(fields, Exception):
+                raise fields
+            result.update(evaluate_scenario(fields, include_series=include_series, cache=cache))
+        except (ValueError, ArithmeticError) as e:
+            num_errors = num_errors + 1
+            result[LINE_KEY] = line_num
+            result[ERROR_KEY] = str(e)
+        output_file.write(json.dumps(result))
+        output_file.write('\n')
+    return num_rows, num_errors
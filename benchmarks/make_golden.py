@@ -0,0 +1,122 @@
+"""
+Regenerates golden.json, the reference outputs that run_benchmarks.py checks the calculator against, by running the
+ scenarios below through retirement_age_calculator.py as of the given git revision (by default the original scalar
+ implementation, so faster engines are always validated against it rather than against themselves).
+
+Usage: python benchmarks/make_golden.py [revision]
+"""
+import importlib.util
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+GOLDEN_PATH = os.path.join(BENCHMARKS_DIR, 'golden.json')
+
+# The original scalar implementation
+DEFAULT_REVISION = '9307d9a'
+
+# Series are only recorded for horizons up to this many years, to keep the file a reasonable size
+MAX_SERIES_YEARS = 100
+
+def build_scenarios():
+    """
+    Get the golden scenarios as dictionaries of {'args': [positional args], 'contrib_changes': [[year, contrib, rate]],
+     'net_worth_changes': [[year, change]], 'retirement_income_changes': [[year, income]]}
+    """
+    scenarios = [
+        # The README examples
+        {'args': [1000000, 10000, 0, 0.06, 0.06, 0.04, 10, 100000, 0.3]},
+        {'args': [1000000, 10000, 0, 0.06, 0.06, 0.04, 10, 100000, 0.3], 'contrib_changes': [[1, 20000, 0.01]], 'net_worth_changes': [[2, 5000]], 'retirement_income_changes': [[5, 50000]]},
+        {'args': [300000, 30000, 0.02, 0.07, 0.04, 0.03, 60, 50000, 0.2]},
+        # Can retire right away, and never
+        {'args': [5000000, 0, 0, 0.05, 0.04, 0.03, 40, 40000, 0.2]},
+        {'args': [0, 1000, 0, 0.01, 0.01, 0.03, 30, 100000, 0.3]},
+        # A change every year, including negative net worth changes that break up the search
+        {
+            'args': [300000, 30000, 0.02, 0.07, 0.04, 0.03, 60, 50000, 0.2],
+            'contrib_changes': [[year, 30000 + 100 * year, 0.02] for year in range(0, 60)],
+            'net_worth_changes': [[year, 1000 if year % 2 == 0 else -500] for year in range(0, 60)],
+            'retirement_income_changes': [[year, 50000 + 10 * year] for year in range(0, 60)],
+        },
+        # Long horizons
+        {'args': [300000, 30000, 0.02, 0.07, 0.04, 0.03, 1000, 50000, 0.2]},
+        {
+            'args': [300000, 30000, 0.0, 0.05, 0.04, 0.03, 1000, 50000, 0.2],
+            'contrib_changes': [[year, 30000 + 10 * year, 0.0] for year in range(0, 1000)],
+            'net_worth_changes': [[year, 100] for year in range(0, 1000)],
+            'retirement_income_changes': [[year, 50000 + year] for year in range(0, 1000)],
+        },
+    ]
+
+    rng = random.Random(0)
+    for _ in range(0, 24):
+        years_to_live = rng.randint(1, 90)
+        scenarios.append({
+            'args': [
+                rng.randint(0, 2000000),
+                rng.randint(0, 60000),
+                round(rng.uniform(0, 0.05), 4),
+                round(rng.uniform(-0.02, 0.09), 4),
+                round(rng.uniform(-0.02, 0.06), 4),
+                round(rng.uniform(0, 0.05), 4),
+                years_to_live,
+                rng.randint(1000, 120000),
+                round(rng.uniform(0, 0.5), 4),
+            ],
+            'contrib_changes': [[year, rng.randint(0, 50000), round(rng.uniform(-0.02, 0.06), 4)] for year in sorted(rng.sample(range(years_to_live), min(years_to_live, rng.randint(0, 4))))],
+            'net_worth_changes': [[year, rng.randint(-50000, 100000)] for year in sorted(rng.sample(range(years_to_live), min(years_to_live, rng.randint(0, 3))))],
+            'retirement_income_changes': [[year, rng.randint(0, 90000)] for year in sorted(rng.sample(range(years_to_live), min(years_to_live, rng.randint(0, 4))))],
+        })
+    return scenarios
+
+def load_calculator_module(revision):
+    """
+    Imports retirement_age_calculator.py as of the given git revision
+    """
+    source = subprocess.run(['git', 'show', '%s:retirement_age_calculator.py' % revision], cwd=REPO_DIR, check=True, capture_output=True).stdout
+    with tempfile.TemporaryDirectory() as temp_dir:
+        module_path = os.path.join(temp_dir, 'golden_retirement_age_calculator.py')
+        with open(module_path, 'wb') as module_file:
+            module_file.write(source)
+        spec = importlib.util.spec_from_file_location('golden_retirement_age_calculator', module_path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    return module
+
+def main():
+    revision = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_REVISION
+    calculator_module = load_calculator_module(revision)
+
+    golden = []
+    for scenario in build_scenarios():
+        calculator = calculator_module.RetirementAgeCalculator(
+            *scenario['args'],
+            manual_contrib_changes={year: (contrib, rate) for year, contrib, rate in scenario.get('contrib_changes', [])},
+            manual_net_worth_changes={year: change for year, change in scenario.get('net_worth_changes', [])},
+            manual_retirement_income_changes={year: income for year, income in scenario.get('retirement_income_changes', [])})
+        years_to_retirement = calculator.get_earliest_retirement()
+        entry = dict(scenario)
+        entry['years_to_retirement'] = years_to_retirement
+        entry['waste'] = calculator.get_waste()
+        if scenario['args'][6] <= MAX_SERIES_YEARS:
+            entry['series'] = {}
+            for series in calculator_module.Series:
+                # The original implementation has no account value or actual withdrawals if you never retire
+                if years_to_retirement is None and series.name in ('ACCOUNT_VALUE', 'ACTUAL_WITHDRAWALS'):
+                    entry['series'][series.name] = None
+                else:
+                    entry['series'][series.name] = [float(value) for value in calculator.get_series_data(series)]
+        golden.append(entry)
+
+    with open(GOLDEN_PATH, 'w') as golden_file:
+        json.dump({'revision': revision, 'scenarios': golden}, golden_file)
+        golden_file.write('\n')
+    print("Wrote %s golden scenarios from revision %s to %s" % (len(golden), revision, GOLDEN_PATH))
+
+if __name__ == '__main__':
+    main()
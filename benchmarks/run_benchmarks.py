@@ -0,0 +1,442 @@
+"""
+Benchmarks the calculator's hot paths and the CLI, after checking the calculator still matches the golden outputs from
+ the original scalar implementation (see make_golden.py), that the CLI's parser-free fast path gives the same args as
+ its parser, and that RetirementModel matches a fresh calculator over random scenarios and edits.
+
+Results are compared against baseline.json, and the run fails if any benchmark is more than --threshold slower than its
+ baseline, a --no-table CLI run takes more than --startup-target milliseconds longer than starting a bare interpreter,
+ or any golden output or model check doesn't match.
+
+Usage: python benchmarks/run_benchmarks.py [--update-baseline] [--threshold 0.5] [--startup-target 10] [--output results.json] [--filter name]
+"""
+import argparse
+import importlib.util
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+BASELINE_PATH = os.path.join(BENCHMARKS_DIR, 'baseline.json')
+GOLDEN_PATH = os.path.join(BENCHMARKS_DIR, 'golden.json')
+CLI_PATH = os.path.join(REPO_DIR, 'early-retirement-cli.py')
+
+sys.path.insert(0, REPO_DIR)
+from retirement_age_calculator import RetirementAgeCalculator, RetirementModel, ScenarioCache, Series
+
+# Golden outputs must match to within this relative (or, for values near 0, absolute) difference
+RELATIVE_TOLERANCE = 1e-8
+ABSOLUTE_TOLERANCE = 1e-6
+
+# Number of random scenarios the RetirementModel check runs, and the edits it makes to each
+MODEL_CHECK_SCENARIOS = 2000
+MODEL_CHECK_EDITS = 3
+
+# The benchmarks the startup target compares
+INTERPRETER_STARTUP = 'interpreter_startup'
+CLI_NO_TABLE = 'cli_no_table'
+
+# =============== Golden outputs ====================================
+def _changes(scenario):
+    return (
+        {year: (contrib, rate) for year, contrib, rate in scenario.get('contrib_changes', [])},
+        {year: change for year, change in scenario.get('net_worth_changes', [])},
+        {year: income for year, income in scenario.get('retirement_income_changes', [])})
+
+def _is_close(expected, actual):
+    if expected is None or actual is None:
+        return expected is None and actual is None
+    if math.isnan(actual):
+        return False
+    return abs(expected - actual) <= max(ABSOLUTE_TOLERANCE, RELATIVE_TOLERANCE * abs(expected))
+
+def _compare(description, expected, actual, mismatches):
+    if not _is_close(expected, actual):
+        mismatches.append("%s: expected %s, got %s" % (description, expected, actual))
+
+def _golden_engines(scenario, cache):
+    """
+    Get (name, calculator-like object) for each scalar engine that should reproduce a golden scenario: the calculator, the
+     calculator with periods_per_year=1 passed explicitly, a calculator built twice through a shared ScenarioCache (so the
+     second one reuses cached functions), and a RetirementModel, both freshly built and after an edit that's undone
+    """
+    contrib_changes, net_worth_changes, retirement_income_changes = _changes(scenario)
+    kwargs = {
+        'manual_contrib_changes': contrib_changes,
+        'manual_net_worth_changes': net_worth_changes,
+        'manual_retirement_income_changes': retirement_income_changes,
+    }
+    RetirementAgeCalculator(*scenario['args'], cache=cache, **kwargs)
+    edited_model = RetirementModel(*scenario['args'], **kwargs)
+    edited_model.get_series_block()
+    edited_model.set_pre_retirement_growth_rate(scenario['args'][3] + 0.01)
+    edited_model.set_desired_net_retirement_income_todays_dollars(scenario['args'][7] + 1000)
+    edited_model.get_waste()
+    edited_model.set_pre_retirement_growth_rate(scenario['args'][3])
+    edited_model.set_desired_net_retirement_income_todays_dollars(scenario['args'][7])
+    return [
+        ('calculator', RetirementAgeCalculator(*scenario['args'], **kwargs)),
+        ('periods_per_year=1', RetirementAgeCalculator(*scenario['args'], periods_per_year=1, **kwargs)),
+        ('cached', RetirementAgeCalculator(*scenario['args'], cache=cache, **kwargs)),
+        ('model', RetirementModel(*scenario['args'], **kwargs)),
+        ('edited model', edited_model),
+    ]
+
+def _check_golden_engine(description, scenario, calculator, mismatches):
+    if calculator.get_earliest_retirement() != scenario['years_to_retirement']:
+        mismatches.append("%s years to retirement: expected %s, got %s" % (description, scenario['years_to_retirement'], calculator.get_earliest_retirement()))
+        return
+    _compare("%s waste" % description, scenario['waste'], calculator.get_waste(), mismatches)
+    for series_name, expected_data in scenario.get('series', {}).items():
+        actual_data = calculator.get_series_data(Series[series_name])
+        if expected_data is None or actual_data is None:
+            _compare("%s %s" % (description, series_name), expected_data, actual_data, mismatches)
+            continue
+        for year, (expected, actual) in enumerate(zip(expected_data, actual_data)):
+            _compare("%s %s year %s" % (description, series_name, year), expected, actual, mismatches)
+
+def check_golden():
+    """
+    Checks every scalar engine (see _golden_engines), and the NumPy batch engine if NumPy is installed, against every
+     golden scenario
+
+    Returns:
+        list of mismatch descriptions, empty if everything matches
+    """
+    with open(GOLDEN_PATH) as golden_file:
+        golden = json.load(golden_file)
+    try:
+        import batch_calculator
+    except ImportError:
+        batch_calculator = None
+
+    mismatches = []
+    cache = ScenarioCache()
+    for idx, scenario in enumerate(golden['scenarios']):
+        for engine_name, calculator in _golden_engines(scenario, cache):
+            _check_golden_engine("scenario %s %s" % (idx, engine_name), scenario, calculator, mismatches)
+
+        if batch_calculator is not None:
+            contrib_changes, net_worth_changes, retirement_income_changes = _changes(scenario)
+            batch = batch_calculator.BatchRetirementAgeCalculator(
+                *scenario['args'],
+                manual_contrib_changes=contrib_changes,
+                manual_net_worth_changes=net_worth_changes,
+                manual_retirement_income_changes=retirement_income_changes)
+            batch_years = int(batch.get_earliest_retirement()[0])
+            if batch_years != (scenario['years_to_retirement'] if scenario['years_to_retirement'] is not None else -1):
+                mismatches.append("scenario %s batch years to retirement: expected %s, got %s" % (idx, scenario['years_to_retirement'], batch_years))
+                continue
+            if scenario['waste'] is not None:
+                _compare("scenario %s batch waste" % idx, scenario['waste'], float(batch.get_waste()[0]), mismatches)
+    return mismatches
+
+# =============== CLI fast path check ====================================
+def check_cli_fast_path():
+    """
+    Checks that the CLI's parser-free fast path (parse_simple_args) gives exactly the args build_parser() would, so code
+     reading any option works the same whichever path parsed the args
+
+    Returns:
+        list of mismatch descriptions, empty if everything matches
+    """
+    spec = importlib.util.spec_from_file_location('early_retirement_cli', CLI_PATH)
+    cli = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(cli)
+
+    mismatches = []
+    for cli_args in (CLI_ARGS, CLI_ARGS + ['--no-table']):
+        fast_args = cli.parse_simple_args(cli_args)
+        parser_args = vars(cli.build_parser().parse_args(cli_args))
+        if fast_args is None:
+            mismatches.append("%s: fast path didn't handle the args" % ' '.join(cli_args))
+            continue
+        for key in sorted(set(fast_args) | set(parser_args)):
+            if key not in fast_args or key not in parser_args or fast_args[key] != parser_args[key]:
+                mismatches.append("%s: %s is %s on the fast path but %s from the parser" % (' '.join(cli_args), key, fast_args.get(key, 'missing'), parser_args.get(key, 'missing')))
+    return mismatches
+
+# =============== Model check ====================================
+def _random_rate(rng):
+    return round(rng.uniform(-0.3, 0.1), 4)
+
+def _random_tax_rate(rng):
+    # Includes rates above 1, which make withdrawals negative, but not exactly 1
+    return rng.choice([0.0, 0.2, 0.517, 0.9, 1.2])
+
+def _random_changes(rng, years_to_live, make_change):
+    return {year: make_change() for year in rng.sample(range(years_to_live), min(years_to_live, rng.randint(0, 4)))}
+
+def _random_model_edit(rng, model):
+    """
+    Makes one random edit to the model
+    """
+    years_to_live = model.years_to_live
+    edit = rng.randrange(9)
+    if edit == 0:
+        model.set_current_retirement_savings(rng.randint(0, 2000000))
+    elif edit == 1:
+        model.set_annual_contribution(rng.randint(-20000, 60000))
+    elif edit == 2:
+        model.set_pre_retirement_growth_rate(_random_rate(rng))
+    elif edit == 3:
+        model.set_post_retirement_growth_rate(_random_rate(rng))
+    elif edit == 4:
+        model.set_inflation_rate(_random_rate(rng))
+    elif edit == 5:
+        model.set_retirement_tax_rate(_random_tax_rate(rng))
+    elif edit == 6:
+        model.set_contrib_change(rng.randrange(years_to_live), rng.randint(0, 50000), _random_rate(rng))
+    elif edit == 7:
+        model.set_net_worth_change(rng.randrange(years_to_live), rng.randint(-150000, 250000))
+    else:
+        model.set_retirement_income_change(rng.randrange(years_to_live), rng.randint(-1000, 90000))
+
+def _compare_model(description, model, mismatches):
+    """
+    Compares the model's results against a RetirementAgeCalculator freshly built from the model's current inputs
+    """
+    calculator = RetirementAgeCalculator(
+        model.current_retirement_savings,
+        model.annual_contribution,
+        model.annual_contribution_increase_rate,
+        model.pre_retirement_growth_rate,
+        model.post_retirement_growth_rate,
+        model.inflation_rate,
+        model.years_to_live,
+        model.desired_net_retirement_income_todays_dollars,
+        model.retirement_tax_rate,
+        manual_contrib_changes=model.manual_contrib_changes,
+        manual_net_worth_changes=model.manual_net_worth_changes,
+        manual_retirement_income_changes=model.manual_retirement_income_changes,
+        periods_per_year=model.periods_per_year)
+    if model.get_earliest_retirement() != calculator.get_earliest_retirement():
+        mismatches.append("%s years to retirement: expected %s, got %s" % (description, calculator.get_earliest_retirement(), model.get_earliest_retirement()))
+        return
+    _compare("%s waste" % description, calculator.get_waste(), model.get_waste(), mismatches)
+    for series in Series:
+        expected_data = calculator.get_series_data(series)
+        actual_data = model.get_series_data(series)
+        if expected_data is None or actual_data is None:
+            _compare("%s %s" % (description, series.name), expected_data, actual_data, mismatches)
+            continue
+        for year, (expected, actual) in enumerate(zip(expected_data, actual_data)):
+            _compare("%s %s year %s" % (description, series.name, year), expected, actual, mismatches)
+
+def check_model(num_scenarios=MODEL_CHECK_SCENARIOS, seed=0):
+    """
+    Checks RetirementModel against a fresh RetirementAgeCalculator over random scenarios, after building each one and
+     after each of a few random edits. The scenarios include negative growth, contributions, and incomes and tax rates
+     above 1, where the account can hit the 0 floor and the closed forms don't apply.
+
+    Returns:
+        list of mismatch descriptions, empty if everything matches
+    """
+    rng = random.Random(seed)
+    mismatches = []
+    for idx in range(0, num_scenarios):
+        years_to_live = rng.randint(1, 90)
+        model = RetirementModel(
+            rng.randint(0, 2000000),
+            rng.randint(-20000, 60000),
+            _random_rate(rng),
+            _random_rate(rng),
+            _random_rate(rng),
+            _random_rate(rng),
+            years_to_live,
+            rng.randint(-1000, 120000),
+            _random_tax_rate(rng),
+            manual_contrib_changes=_random_changes(rng, years_to_live, lambda: (rng.randint(0, 50000), _random_rate(rng))),
+            manual_net_worth_changes=_random_changes(rng, years_to_live, lambda: rng.randint(-150000, 250000)),
+            manual_retirement_income_changes=_random_changes(rng, years_to_live, lambda: rng.randint(-1000, 90000)))
+        _compare_model("model %s" % idx, model, mismatches)
+        for edit_idx in range(0, MODEL_CHECK_EDITS):
+            _random_model_edit(rng, model)
+            _compare_model("model %s edit %s" % (idx, edit_idx), model, mismatches)
+    return mismatches
+
+# =============== Benchmarks ====================================
+def _scenario_args(years_to_live, change_every_year=False, periods_per_year=1):
+    """
+    Get the (args, kwargs) for a RetirementAgeCalculator with the given horizon and periods per year, optionally with every
+     kind of manual change in every year
+    """
+    args = (300000, 30000, 0.02, 0.07, 0.04, 0.03, years_to_live, 50000, 0.2)
+    kwargs = {'periods_per_year': periods_per_year}
+    if change_every_year:
+        kwargs = {
+            'periods_per_year': periods_per_year,
+            'manual_contrib_changes': {year: (30000 + 100 * year, 0.02) for year in range(0, years_to_live)},
+            'manual_net_worth_changes': {year: 1000 if year % 2 == 0 else -500 for year in range(0, years_to_live)},
+            'manual_retirement_income_changes': {year: 50000 + 10 * year for year in range(0, years_to_live)},
+        }
+    return args, kwargs
+
+def _construct(years_to_live, change_every_year=False, periods_per_year=1):
+    args, kwargs = _scenario_args(years_to_live, change_every_year, periods_per_year)
+    return lambda: RetirementAgeCalculator(*args, **kwargs)
+
+def _construct_and_get_series(years_to_live, change_every_year=False, periods_per_year=1):
+    args, kwargs = _scenario_args(years_to_live, change_every_year, periods_per_year)
+    def run():
+        calculator = RetirementAgeCalculator(*args, **kwargs)
+        for series in Series:
+            calculator.get_series_data(series)
+    return run
+
+def _run_cli(cli_args, hide_tabulate):
+    """
+    Runs the CLI in a fresh interpreter, optionally making 'import tabulate' fail as if it weren't installed
+    """
+    if hide_tabulate:
+        command = [sys.executable, '-c', "import runpy, sys; sys.modules['tabulate'] = None; sys.argv = sys.argv[1:]; runpy.run_path(sys.argv[0], run_name='__main__')", CLI_PATH] + cli_args
+    else:
+        command = [sys.executable, CLI_PATH] + cli_args
+    return lambda: subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+
+def _run_interpreter():
+    """
+    Starts and exits a bare interpreter, to measure how much of the CLI's time is the interpreter's own startup
+    """
+    return lambda: subprocess.run([sys.executable, '-c', 'pass'], check=True, stdout=subprocess.DEVNULL)
+
+def _has_tabulate():
+    try:
+        import tabulate
+        return True
+    except ImportError:
+        return False
+
+CLI_ARGS = ['300000', '30000', '0.02', '0.07', '0.04', '0.03', '60', '50000', '0.2']
+
+def build_benchmarks():
+    """
+    Get a list of (name, function to time, number of calls per repeat)
+    """
+    benchmarks = []
+    for years_to_live in (10, 60, 1000):
+        benchmarks.append(('construct_%sy' % years_to_live, _construct(years_to_live), 2000 if years_to_live < 1000 else 500))
+    for years_to_live in (60, 1000):
+        benchmarks.append(('construct_%sy_change_every_year' % years_to_live, _construct(years_to_live, True), 200 if years_to_live < 1000 else 10))
+    for years_to_live in (60, 1000):
+        benchmarks.append(('construct_and_get_all_series_%sy' % years_to_live, _construct_and_get_series(years_to_live), 500 if years_to_live < 1000 else 20))
+    # Monthly runs, to compare against the annual 60 year ones
+    benchmarks.append(('construct_60y_monthly', _construct(60, periods_per_year=12), 2000))
+    benchmarks.append(('construct_and_get_all_series_60y_monthly', _construct_and_get_series(60, periods_per_year=12), 200))
+    benchmarks.append((INTERPRETER_STARTUP, _run_interpreter(), 3))
+    benchmarks.append((CLI_NO_TABLE, _run_cli(CLI_ARGS + ['--no-table'], hide_tabulate=False), 3))
+    benchmarks.append(('cli_table_without_tabulate', _run_cli(CLI_ARGS, hide_tabulate=True), 3))
+    if _has_tabulate():
+        benchmarks.append(('cli_table_with_tabulate', _run_cli(CLI_ARGS, hide_tabulate=False), 3))
+    return benchmarks
+
+def time_benchmark(function, number, repeat):
+    """
+    Get the best average seconds per call of the function over the repeats
+    """
+    # Warm up caches (and the OS's file cache, for the CLI) before timing
+    function()
+    best = math.inf
+    for _ in range(0, repeat):
+        start = time.perf_counter()
+        for _ in range(0, number):
+            function()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the calculator against the golden outputs and benchmark its hot paths against the baseline.')
+    parser.add_argument('--update-baseline', default=False, action='store_true', help='Overwrite the baseline with the results of this run instead of comparing against it')
+    parser.add_argument('--threshold', type=float, default=0.5, help='Fail if a benchmark is more than this fraction slower than its baseline (default: 0.5)')
+    parser.add_argument('--startup-target', type=float, default=10.0, help='Fail if a --no-table CLI run takes more than this many milliseconds longer than starting a bare interpreter (default: 10)')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of times to run each benchmark, keeping the best (default: 5)')
+    parser.add_argument('--filter', default=None, help='Only run benchmarks whose name contains this')
+    parser.add_argument('--output', metavar='file', default=None, help='Also write the results of this run to this JSON file')
+    parser.add_argument('--skip-golden', default=False, action='store_true', help="Don't check the golden outputs or the model")
+    args = parser.parse_args()
+
+    failed = False
+    if not args.skip_golden:
+        mismatches = check_golden()
+        for mismatch in mismatches[:20]:
+            print("GOLDEN MISMATCH: %s" % mismatch)
+        if mismatches:
+            print("%s golden outputs don't match" % len(mismatches))
+            failed = True
+        else:
+            print("Golden outputs match")
+        mismatches = check_cli_fast_path()
+        for mismatch in mismatches:
+            print("CLI FAST PATH MISMATCH: %s" % mismatch)
+        if mismatches:
+            failed = True
+        else:
+            print("CLI fast path matches the parser")
+        mismatches = check_model()
+        for mismatch in mismatches[:20]:
+            print("MODEL MISMATCH: %s" % mismatch)
+        if mismatches:
+            print("%s model outputs don't match a fresh calculator" % len(mismatches))
+            failed = True
+        else:
+            print("Model matches a fresh calculator")
+
+    baseline = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+
+    results = {}
+    print("%-40s %14s %14s %8s" % ('benchmark', 'baseline (us)', 'current (us)', 'ratio'))
+    for name, function, number in build_benchmarks():
+        if args.filter is not None and args.filter not in name:
+            continue
+        seconds = time_benchmark(function, number, args.repeat)
+        results[name] = seconds
+        status = ''
+        baseline_seconds = baseline.get(name)
+        if baseline_seconds is None:
+            ratio_str = '-'
+        else:
+            ratio = seconds / baseline_seconds
+            ratio_str = '%.2f' % ratio
+            if not args.update_baseline and ratio > 1 + args.threshold:
+                status = 'REGRESSION'
+                failed = True
+        print("%-40s %14s %14.1f %8s %s" % (name, '-' if baseline_seconds is None else '%.1f' % (baseline_seconds * 1e6), seconds * 1e6, ratio_str, status))
+
+    if INTERPRETER_STARTUP in results and CLI_NO_TABLE in results:
+        startup_ms = (results[CLI_NO_TABLE] - results[INTERPRETER_STARTUP]) * 1e3
+        status = ''
+        if startup_ms > args.startup_target:
+            status = 'OVER TARGET'
+            failed = True
+        print("CLI startup over a bare interpreter: %.1f ms (target: %.1f ms) %s" % (startup_ms, args.startup_target, status))
+
+    run = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+    if args.output is not None:
+        with open(args.output, 'w') as output_file:
+            json.dump(run, output_file, indent=2, sort_keys=True)
+            output_file.write('\n')
+    if args.update_baseline:
+        # Keep the baselines of any benchmarks that were filtered out
+        run['results'] = {**baseline, **results}
+        with open(BASELINE_PATH, 'w') as baseline_file:
+            json.dump(run, baseline_file, indent=2, sort_keys=True)
+            baseline_file.write('\n')
+        print("Updated %s" % BASELINE_PATH)
+
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -1,136 +1,481 @@
+import math
+import os
 import sys
-import argparse
+import time
 from retirement_age_calculator import RetirementAgeCalculator, Series
-
-try:
-    import tabulate
-    have_tabulate = True
-except ImportError:
-    have_tabulate = False
+from scenario import (
+    CURRENT_SAVINGS_KEY,
+    ANNUAL_CONTRIB_KEY,
+    ANNUAL_CONTRIB_INCREASE_RATE_KEY,
+    PRE_GROWTH_RATE_KEY,
+    POST_GROWTH_RATE_KEY,
+    INFLATION_RATE_KEY,
+    YEARS_TO_LIVE_KEY,
+    NET_RETIREMENT_INCOME_KEY,
+    RETIREMENT_TAX_RATE_KEY,
+    NET_WORTH_CHANGE_KEY,
+    CONTRIB_CHANGE_KEY,
+    RETIREMENT_INCOME_CHANGE_KEY,
+    SCENARIO_FIELDS,
+    SCENARIO_KEYS,
+    add_change_arguments,
+    parse_changes,
+    parse_period,
+)
 
 # ========================== Arg Parsing ===========================================================
 
-CURRENT_SAVINGS_KEY = 'current_savings'
-ANNUAL_CONTRIB_KEY = 'annual_contribution'
-ANNUAL_CONTRIB_INCREASE_RATE_KEY = 'annual_contrib_increase_rate'
-PRE_GROWTH_RATE_KEY = 'pre_growth_rate'
-POST_GROWTH_RATE_KEY = 'post_growth_rate'
-INFLATION_RATE_KEY = 'inflation_rate'
-YEARS_TO_LIVE_KEY = 'years_to_live'
-NET_RETIREMENT_INCOME_KEY = 'net_retirement_income'
-RETIREMENT_TAX_RATE_KEY = 'retirement_tax_rate'
 SHOW_TABLE_KEY = 'show_table'
+PERIODS_PER_YEAR_KEY = 'periods_per_year'
+SOLVE_FOR_KEY = 'solve_for'
+TARGET_YEARS_KEY = 'target_years'
+PROFILE_KEY = 'profile'
+PROFILE_OUTPUT_KEY = 'profile_output'
 
-NET_WORTH_CHANGE_KEY = 'net_worth_change'
-CONTRIB_CHANGE_KEY = 'contrib_change'
-RETIREMENT_INCOME_CHANGE_KEY = 'retirement_income_change'
-
-parser = argparse.ArgumentParser(description='Calculate the earliest retirement is available based on the given parameters.')
-parser.add_argument(CURRENT_SAVINGS_KEY, type=int, help='Current retirement savings right now, in dollars')
-parser.add_argument(ANNUAL_CONTRIB_KEY, type=int, help='Annual contribution, in dollars')
-parser.add_argument(ANNUAL_CONTRIB_INCREASE_RATE_KEY, type=float, help='Annual contribution, in dollars')
-parser.add_argument(PRE_GROWTH_RATE_KEY, type=float, help='Market growth rate before retirement, in the form 0.XX')
-parser.add_argument(POST_GROWTH_RATE_KEY, type=float, help='Market growth rate during retirement, in the form 0.XX')
-parser.add_argument(INFLATION_RATE_KEY, type=float, help='Inflation rate, in the form 0.XX')
-parser.add_argument(YEARS_TO_LIVE_KEY, type=int, help="How many more years you estimate you'll live")
-parser.add_argument(NET_RETIREMENT_INCOME_KEY, type=int, help="Desired net income in retirement, in *today's* dollars")
-parser.add_argument(RETIREMENT_TAX_RATE_KEY, type=float, help='Estimated tax rate in retirement, in the form 0.XX')
-parser.add_argument('-w', '--change-worth', dest=NET_WORTH_CHANGE_KEY, action='append', nargs=2, metavar=('years_out','value'), default=[], help='Indicate a one-off change in net worth at the start of year X (useful to represent a big cash in/outflux - e.g. selling equity). This option can be specified multiple times.')
-parser.add_argument('-c', '--change-contrib', dest=CONTRIB_CHANGE_KEY, action='append', nargs=3, metavar=('years_out','contrib', 'contrib_rate'), default=[], help='Indicate a change in annual contribution amount/rate at the start of year X (useful to represent changing life situation - e.g. a new job). This option can be specified multiple times.')
-parser.add_argument('-i', '--change-retirement-income', dest=RETIREMENT_INCOME_CHANGE_KEY, action='append', nargs=2, metavar=('years_out','net_income'), default=[], help="Indicate a change in annual net retirement income, denominated in today's dollars,  at the start of year X (useful to represent changing life situation - e.g. children moving out of home). This option can be specified multiple times.")
-parser.add_argument('--no-table', dest=SHOW_TABLE_KEY, default=True, action='store_false', help="Don't show the table, just the number of years to retirement")
-parsed_args = vars(parser.parse_args())
-
-current_retirement_savings = parsed_args[CURRENT_SAVINGS_KEY]
-annual_contribution = parsed_args[ANNUAL_CONTRIB_KEY]
-annual_contribution_increase_rate = parsed_args[ANNUAL_CONTRIB_INCREASE_RATE_KEY]
-
-#  NOTE: this is the growth rate you expect BEFORE retirement! In retirement, we switch to more conservative securities that only get inflation rate
-pre_retirement_growth_rate = parsed_args[PRE_GROWTH_RATE_KEY]
-post_retirement_growth_rate = parsed_args[POST_GROWTH_RATE_KEY]
-inflation_rate = parsed_args[INFLATION_RATE_KEY]
-
-years_to_live = parsed_args[YEARS_TO_LIVE_KEY]
-if years_to_live < 1:
-    print("ERROR: Invalid years to live; are you expecting to die today??")
-    sys.exit(1)
-
-desired_net_retirement_income_todays_dollars = parsed_args[NET_RETIREMENT_INCOME_KEY]
-retirement_tax_rate = parsed_args[RETIREMENT_TAX_RATE_KEY]
-
-# Validate no duplicates, for sanity
-net_worth_changes = {}
-for years_out_str, change_str in parsed_args[NET_WORTH_CHANGE_KEY]:
-    years_out = int(years_out_str)
-    change = int(change_str)
-    if years_out in net_worth_changes:
-        print("ERROR: Two net worth changes defined with the same year '%s'" % years_out)
-        sys.exit(1)
-    if years_out < 0 or years_out >= years_to_live:
-        print("ERROR: Invalid net worth change year '%s'; must be between [0,%s)" % years_out, years_to_live)
-        sys.exit(1)
-    net_worth_changes[years_out] = change
-
-contrib_changes = {}
-for years_out_str, contrib_str, contrib_rate_str in parsed_args[CONTRIB_CHANGE_KEY]:
-    years_out = int(years_out_str)
-    contrib = int(contrib_str)
-    contrib_rate = float(contrib_rate_str)
-    if years_out in contrib_changes:
-        print("ERROR: Two contrib changes defined with the same year '%s'" % years_out)
-        sys.exit(1)
-    if years_out < 0 or years_out >= years_to_live:
-        print("ERROR: Invalid contrib change year '%s'; must be between [0,%s)" % years_out, years_to_live)
-        sys.exit(1)
-    contrib_changes[years_out] = (contrib, contrib_rate)
-
-retirement_income_changes = {}
-for years_out_str, net_income_str in parsed_args[RETIREMENT_INCOME_CHANGE_KEY]:
-    years_out = int(years_out_str)
-    net_income = int(net_income_str)
-    if years_out in retirement_income_changes:
-        print("ERROR: Two retirement income changes defined with the same year '%s'" % years_out)
-        sys.exit(1)
-    if years_out < 0 or years_out >= years_to_live:
-        print("ERROR: Invalid retirement income change year '%s'; must be between [0,%s)" % years_out, years_to_live)
-        sys.exit(1)
-    retirement_income_changes[years_out] = net_income
-
-show_table = parsed_args[SHOW_TABLE_KEY]
+# The positional args --solve-for can solve for
+SOLVABLE_KEYS = (CURRENT_SAVINGS_KEY, ANNUAL_CONTRIB_KEY, NET_RETIREMENT_INCOME_KEY, PRE_GROWTH_RATE_KEY, POST_GROWTH_RATE_KEY)
 
-# =============== Main Code ====================================
-retirement_calculator = RetirementAgeCalculator(
-    current_retirement_savings,
-    annual_contribution,
-    annual_contribution_increase_rate,
-    pre_retirement_growth_rate,
-    post_retirement_growth_rate,
-    inflation_rate,
-    years_to_live,
-    desired_net_retirement_income_todays_dollars,
-    retirement_tax_rate,
-    manual_contrib_changes=contrib_changes,
-    manual_net_worth_changes=net_worth_changes,
-    manual_retirement_income_changes=retirement_income_changes)
-
-years_to_retirement = retirement_calculator.get_earliest_retirement()
-if years_to_retirement is None:
-    print("You can't retire with the current parameters!")
-    sys.exit(1)
-else:
-    print(" > YEARS TO RETIREMENT: %s" % years_to_retirement)
-    print(" > WASTE: %s (dollars at death)" % '{:,}'.format(int(retirement_calculator.get_waste())))
+MONTE_CARLO_PATHS_KEY = 'monte_carlo_paths'
+SEED_KEY = 'seed'
+RETURN_VOLATILITY_KEY = 'return_volatility'
+INFLATION_VOLATILITY_KEY = 'inflation_volatility'
+DISTRIBUTION_KEY = 'distribution'
+HISTORICAL_RETURNS_KEY = 'historical_returns'
+BACKTEST_KEY = 'backtest'
+ROWS_PER_YEAR_KEY = 'rows_per_year'
+WITHDRAWAL_STRATEGIES_KEY = 'withdrawal_strategies'
+
+SWEEP_COMMAND = 'sweep'
+WORKERS_KEY = 'workers'
+CHUNK_SIZE_KEY = 'chunk_size'
+OUTPUT_KEY = 'output'
+FORMAT_KEY = 'format'
+
+SERVE_COMMAND = 'serve'
+PORT_KEY = 'port'
+BATCH_WINDOW_KEY = 'batch_window_ms'
+MAX_BATCH_SIZE_KEY = 'max_batch_size'
+MAX_PENDING_KEY = 'max_pending'
+
+BATCH_FLAG = '--batch'
+BATCH_INPUT_KEY = 'batch_input'
+INPUT_FORMAT_KEY = 'input_format'
+INCLUDE_SERIES_KEY = 'include_series'
+
+# The values of everything other than the positional args when they're all that's given, as build_parser() would default them.
+#  Every option build_parser() defines needs an entry; benchmarks/run_benchmarks.py checks that parse_simple_args matches it.
+SIMPLE_ARGS_DEFAULTS = {
+    NET_WORTH_CHANGE_KEY: [],
+    CONTRIB_CHANGE_KEY: [],
+    RETIREMENT_INCOME_CHANGE_KEY: [],
+    SHOW_TABLE_KEY: True,
+    PERIODS_PER_YEAR_KEY: 1,
+    SOLVE_FOR_KEY: None,
+    TARGET_YEARS_KEY: None,
+    PROFILE_KEY: False,
+    PROFILE_OUTPUT_KEY: None,
+    MONTE_CARLO_PATHS_KEY: None,
+    SEED_KEY: None,
+    RETURN_VOLATILITY_KEY: 0.15,
+    INFLATION_VOLATILITY_KEY: 0.01,
+    DISTRIBUTION_KEY: 'normal',
+    HISTORICAL_RETURNS_KEY: None,
+    BACKTEST_KEY: False,
+    ROWS_PER_YEAR_KEY: 1,
+    WITHDRAWAL_STRATEGIES_KEY: None,
+}
+
+def build_parser():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Calculate the earliest retirement is available based on the given parameters.', epilog="Run '%(prog)s " + SWEEP_COMMAND + " -h' to see how to evaluate a grid of parameter values at once, '%(prog)s " + BATCH_FLAG + " -h' to see how to evaluate a stream of scenarios, or '%(prog)s " + SERVE_COMMAND + " -h' to see how to serve scenario evaluations over HTTP.")
+    for key, value_type, help_text in SCENARIO_FIELDS:
+        parser.add_argument(key, type=value_type, help=help_text)
+    add_change_arguments(parser)
+    parser.add_argument('--no-table', dest=SHOW_TABLE_KEY, default=True, action='store_false', help="Don't show the table, just the number of years to retirement")
+    parser.add_argument('--periods-per-year', dest=PERIODS_PER_YEAR_KEY, type=int, default=1, help="Number of periods to step the model in each year, e.g. 12 to model contributions, growth, and withdrawals monthly; the years_out of -w, -c, and -i can then be fractional (e.g. 2.5), and the table shows one row per period (default: 1)")
+    parser.add_argument('--solve-for', dest=SOLVE_FOR_KEY, choices=SOLVABLE_KEYS, default=None, help="Instead of using the value given for this positional arg (which is then only a starting guess), find the smallest value of it (or the largest, for net_retirement_income) that lets you retire within --target-years, and show the results for that value")
+    parser.add_argument('--target-years', dest=TARGET_YEARS_KEY, metavar='years', default=None, help='Number of years you want to be able to retire within, for --solve-for')
+    parser.add_argument('--profile', dest=PROFILE_KEY, default=False, action='store_true', help="Print how long each stage of the calculation took, and how many memory blocks it allocated, to stderr")
+    parser.add_argument('--profile-output', dest=PROFILE_OUTPUT_KEY, metavar='file', default=None, help="Run under cProfile and write the stats to this file, for viewing with 'python -m pstats file' or snakeviz")
+    parser.add_argument('--monte-carlo', dest=MONTE_CARLO_PATHS_KEY, type=int, metavar='num_paths', default=None, help="Instead of assuming constant rates, simulate this many paths of randomly-drawn yearly returns and inflation (with the given rates as the means) and show the distribution of outcomes. Requires numpy.")
+    parser.add_argument('--seed', dest=SEED_KEY, type=int, default=None, help='Random seed for --monte-carlo, to make runs reproducible')
+    parser.add_argument('--return-volatility', dest=RETURN_VOLATILITY_KEY, type=float, default=0.15, help='Standard deviation of yearly market returns for --monte-carlo, in the form 0.XX (default: 0.15)')
+    parser.add_argument('--inflation-volatility', dest=INFLATION_VOLATILITY_KEY, type=float, default=0.01, help='Standard deviation of yearly inflation for --monte-carlo, in the form 0.XX (default: 0.01)')
+    parser.add_argument('--distribution', dest=DISTRIBUTION_KEY, choices=('normal', 'lognormal'), default='normal', help='Distribution to draw yearly returns and inflation from for --monte-carlo (default: normal)')
+    parser.add_argument('--historical-returns', dest=HISTORICAL_RETURNS_KEY, metavar='csv_file', default=None, help="For --monte-carlo, bootstrap each year's returns and inflation from a randomly-chosen row of this CSV file (with 'return' and 'inflation' columns in the form 0.XX) instead of drawing them from a distribution; for --backtest, the history to backtest against")
+    parser.add_argument('--backtest', dest=BACKTEST_KEY, default=False, action='store_true', help="Instead of assuming constant rates, run the plan through every rolling window of the --historical-returns file's returns and inflation (with the given rates used to work out the balance needed to retire) and show the success rate, worst case, and distribution of outcomes. Requires numpy.")
+    parser.add_argument('--rows-per-year', dest=ROWS_PER_YEAR_KEY, type=int, default=1, help='For --backtest, number of rows of the --historical-returns file making up a year, e.g. 12 for monthly returns and inflation; windows then start at every row (default: 1)')
+    parser.add_argument('--withdrawal-strategies', dest=WITHDRAWAL_STRATEGIES_KEY, metavar='name,...', default=None, help="For --monte-carlo or --backtest, comma-separated withdrawal strategies to compare over the same paths once retired, out of fixed (the inflation-adjusted retirement income every year), constant-percentage, vpw, guardrails, and floor-and-ceiling (default: fixed)")
+    return parser
+
+def build_sweep_parser():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog='%s %s' % (os.path.basename(sys.argv[0]), SWEEP_COMMAND),
+        description='Calculate years to retirement and waste for every combination of the given parameter values, in parallel, writing one row per combination. Each positional arg may be a single value, a comma-separated list of values (e.g. 0.04,0.05,0.06), or an inclusive start:stop:step range (e.g. 100000:1000000:50000).')
+    for key, _, help_text in SCENARIO_FIELDS:
+        parser.add_argument(key, help=help_text)
+    add_change_arguments(parser)
+    parser.add_argument('--workers', dest=WORKERS_KEY, type=int, default=os.cpu_count(), help='Number of worker processes (default: number of CPUs)')
+    parser.add_argument('--chunk-size', dest=CHUNK_SIZE_KEY, type=int, default=None, help='Number of combinations each worker evaluates at a time')
+    parser.add_argument('-o', '--output', dest=OUTPUT_KEY, metavar='file', default=None, help='File to write results to (default: stdout)')
+    parser.add_argument('--format', dest=FORMAT_KEY, choices=('csv', 'parquet'), default='csv', help='Output format; parquet requires pyarrow and --output (default: csv)')
+    return parser
+
+def build_batch_parser():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog='%s %s' % (os.path.basename(sys.argv[0]), BATCH_FLAG),
+        description="Calculate years to retirement and waste for a stream of scenarios, one per line of JSONL or CSV input, writing one JSON result per line. Each scenario has the same fields as the positional args (" + ", ".join(SCENARIO_KEYS) + "), plus optional '" + NET_WORTH_CHANGE_KEY + "', '" + CONTRIB_CHANGE_KEY + "', and '" + RETIREMENT_INCOME_CHANGE_KEY + "' fields with the -w, -c, and -i changes, either as JSON lists (e.g. [[5, 10000]]) or as ';'-separated strings (e.g. \"5 10000; 8 -2000\"). An optional 'id' field is echoed back on the result. Invalid scenarios produce a result with an 'error' field instead of stopping the batch.")
+    parser.add_argument(BATCH_FLAG, dest=BATCH_INPUT_KEY, nargs='?', const='-', metavar='input_file', required=True, help='File to read scenarios from (default: stdin)')
+    parser.add_argument('--input-format', dest=INPUT_FORMAT_KEY, choices=('jsonl', 'csv'), default=None, help="Format of the input (default: csv if the input file ends in '.csv', otherwise jsonl)")
+    parser.add_argument('--include-series', dest=INCLUDE_SERIES_KEY, default=False, action='store_true', help="Include every series (the columns of the table) in each result")
+    parser.add_argument('-o', '--output', dest=OUTPUT_KEY, metavar='file', default=None, help='File to write results to (default: stdout)')
+    return parser
+
+def build_serve_parser():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog='%s %s' % (os.path.basename(sys.argv[0]), SERVE_COMMAND),
+        description="Serve scenario evaluations over HTTP on localhost. POST a JSON scenario (with the same fields as in " + BATCH_FLAG + " mode, plus an optional '" + INCLUDE_SERIES_KEY + "': true) to /evaluate to get its years to retirement and waste back; GET /metrics for request counts, batch sizes, throughput, and latency percentiles. Concurrent requests are evaluated together in batches.")
+    parser.add_argument('--port', dest=PORT_KEY, type=int, default=8080, help='Port to listen on, or 0 to pick a free one (default: 8080)')
+    parser.add_argument('--batch-window-ms', dest=BATCH_WINDOW_KEY, type=float, default=2.0, help='Milliseconds to wait after a request arrives for more to evaluate with it (default: 2)')
+    parser.add_argument('--max-batch-size', dest=MAX_BATCH_SIZE_KEY, type=int, default=256, help='Number of waiting requests that get evaluated right away without waiting out the window (default: 256)')
+    parser.add_argument('--max-pending', dest=MAX_PENDING_KEY, type=int, default=1024, help='Number of requests being evaluated at once beyond which new ones are rejected with a 503 (default: 1024)')
+    parser.add_argument('--workers', dest=WORKERS_KEY, type=int, default=1, help='Number of threads evaluating batches (default: 1)')
+    return parser
+
+def parse_simple_args(argv):
+    """
+    Parses the common case of just the positional args, optionally with --no-table, without importing argparse or
+     building the full parser (which takes longer than the calculation itself for a single run)
+
+    Returns:
+        the parsed args, as vars(build_parser().parse_args(argv)) would return them, or None if there's anything else
+         (including invalid or negative values) so build_parser() can handle it and report any errors
+    """
+    parsed_args = dict(SIMPLE_ARGS_DEFAULTS)
+    positionals = []
+    for arg in argv:
+        if arg == '--no-table':
+            parsed_args[SHOW_TABLE_KEY] = False
+        elif arg.startswith('-'):
+            return None
+        else:
+            positionals.append(arg)
+    if len(positionals) != len(SCENARIO_FIELDS):
+        return None
+    for (key, value_type, _), value in zip(SCENARIO_FIELDS, positionals):
+        try:
+            parsed_args[key] = value_type(value)
+        except ValueError:
+            return None
+    return parsed_args
+
+def parse_change_args(parsed_args, years_to_live, periods_per_year=1):
+    """
+    Parses the -w, -c, and -i args, exiting with an error if any are invalid
+    """
+    try:
+        return parse_changes(parsed_args[NET_WORTH_CHANGE_KEY], parsed_args[CONTRIB_CHANGE_KEY], parsed_args[RETIREMENT_INCOME_CHANGE_KEY], years_to_live, periods_per_year)
+    except ValueError as e:
+        print("ERROR: %s" % e)
+        sys.exit(1)
+
+# =============== Solver ====================================
+def run_solver(parsed_args, periods_per_year, net_worth_changes, contrib_changes, retirement_income_changes):
+    """
+    Solves for the --solve-for arg and replaces its value in parsed_args with the solution, exiting if there isn't one
+    """
+    import inverse_solver
+
+    solve_for = parsed_args[SOLVE_FOR_KEY]
+    target_years = parsed_args[TARGET_YEARS_KEY]
+    if target_years is None:
+        print("ERROR: --solve-for requires --target-years")
+        sys.exit(1)
+    try:
+        target_period = parse_period(target_years, "target", parsed_args[YEARS_TO_LIVE_KEY], periods_per_year)
+    except ValueError as e:
+        print("ERROR: %s" % e)
+        sys.exit(1)
+
+    input_name = {
+        CURRENT_SAVINGS_KEY: inverse_solver.CURRENT_RETIREMENT_SAVINGS,
+        ANNUAL_CONTRIB_KEY: inverse_solver.ANNUAL_CONTRIBUTION,
+        NET_RETIREMENT_INCOME_KEY: inverse_solver.DESIRED_NET_RETIREMENT_INCOME,
+        PRE_GROWTH_RATE_KEY: inverse_solver.PRE_RETIREMENT_GROWTH_RATE,
+        POST_GROWTH_RATE_KEY: inverse_solver.POST_RETIREMENT_GROWTH_RATE,
+    }[solve_for]
+    solver = inverse_solver.InverseSolver(
+        parsed_args[CURRENT_SAVINGS_KEY],
+        parsed_args[ANNUAL_CONTRIB_KEY],
+        parsed_args[ANNUAL_CONTRIB_INCREASE_RATE_KEY],
+        parsed_args[PRE_GROWTH_RATE_KEY],
+        parsed_args[POST_GROWTH_RATE_KEY],
+        parsed_args[INFLATION_RATE_KEY],
+        parsed_args[YEARS_TO_LIVE_KEY],
+        parsed_args[NET_RETIREMENT_INCOME_KEY],
+        parsed_args[RETIREMENT_TAX_RATE_KEY],
+        manual_contrib_changes=contrib_changes,
+        manual_net_worth_changes=net_worth_changes,
+        manual_retirement_income_changes=retirement_income_changes,
+        periods_per_year=periods_per_year)
+    value, _ = solver.solve(input_name, target_period)
+
+    label = solve_for.replace('_', ' ')
+    if value is None:
+        print("You can't retire within %s years by changing %s alone!" % (target_years, label))
+        sys.exit(1)
+    if value == math.inf:
+        print(" > Any %s lets you retire within %s years" % (label, target_years))
+        sys.exit(0)
+
+    # Round towards the safe side so the rounded value still lets you retire in time
+    is_minimum = inverse_solver.SOLVABLE_INPUTS[input_name][0]
+    value_type = {key: value_type for key, value_type, _ in SCENARIO_FIELDS}[solve_for]
+    if value_type is int:
+        value = math.ceil(value) if is_minimum else math.floor(value)
+        value_str = '{:,}'.format(value)
+    else:
+        value = math.ceil(value * 10000) / 10000
+        value_str = '%.4f' % value
+    print(" > %s %s TO RETIRE WITHIN %s YEARS: %s" % ("MINIMUM" if is_minimum else "MAXIMUM", label.upper(), target_years, value_str))
+    parsed_args[solve_for] = value
+
+# =============== Sweep ====================================
+def run_sweep(argv):
+    import parameter_sweep
+
+    parsed_args = vars(build_sweep_parser().parse_args(argv))
+    axes = []
+    for key, value_type, _ in SCENARIO_FIELDS:
+        try:
+            axes.append(parameter_sweep.parse_axis(parsed_args[key], value_type))
+        except ValueError as e:
+            print("ERROR: Invalid value for %s: %s" % (key, e))
+            sys.exit(1)
+    years_to_live_axis = axes[[key for key, _, _ in SCENARIO_FIELDS].index(YEARS_TO_LIVE_KEY)]
+    if min(years_to_live_axis) < 1:
+        print("ERROR: Invalid years to live; are you expecting to die today??")
+        sys.exit(1)
+    # The changes have to be valid for every years to live in the sweep
+    net_worth_changes, contrib_changes, retirement_income_changes = parse_change_args(parsed_args, min(years_to_live_axis))
+
+    workers = parsed_args[WORKERS_KEY]
+    if workers < 1:
+        print("ERROR: Number of workers must be >= 1")
+        sys.exit(1)
+    rows = parameter_sweep.sweep(axes, net_worth_changes, contrib_changes, retirement_income_changes, workers=workers, chunk_size=parsed_args[CHUNK_SIZE_KEY])
 
-# Double-check the user hasn't added any networth changes AFTER retirement, as we don't handle these
-for key in net_worth_changes.keys():
-    if key > years_to_retirement:
-        print("ERROR: You've set a net worth change that happens AFTER projected retirement - this script currently can't handle this")
+    output = parsed_args[OUTPUT_KEY]
+    if parsed_args[FORMAT_KEY] == 'parquet':
+        if output is None:
+            print("ERROR: Parquet output requires --output")
+            sys.exit(1)
+        try:
+            import pyarrow
+        except ImportError:
+            print("ERROR: Parquet output requires pyarrow; run 'pip install pyarrow'")
+            sys.exit(1)
+        parameter_sweep.write_parquet(rows, output)
+    elif output is None:
+        parameter_sweep.write_csv(rows, sys.stdout)
+    else:
+        with open(output, 'w', newline='') as output_file:
+            parameter_sweep.write_csv(rows, output_file)
+
+# =============== Batch ====================================
+def run_batch(argv):
+    import batch_runner
+
+    parsed_args = vars(build_batch_parser().parse_args(argv))
+    batch_input = parsed_args[BATCH_INPUT_KEY]
+    input_format = parsed_args[INPUT_FORMAT_KEY]
+    if input_format is None:
+        input_format = 'csv' if batch_input.endswith('.csv') else 'jsonl'
+
+    try:
+        input_file = sys.stdin if batch_input == '-' else open(batch_input, newline='')
+        output_file = sys.stdout if parsed_args[OUTPUT_KEY] is None else open(parsed_args[OUTPUT_KEY], 'w')
+    except OSError as e:
+        print("ERROR: %s" % e)
         sys.exit(1)
-for key in contrib_changes.keys():
-    if key >= years_to_retirement:
-        print("WARN: You've set a contribution change that happens on or after projected retirement - this will be ignored for retirement calculations")
+    with input_file, output_file:
+        rows = batch_runner.read_csv_rows(input_file) if input_format == 'csv' else batch_runner.read_jsonl_rows(input_file)
+        num_rows, num_errors = batch_runner.run_batch(rows, output_file, include_series=parsed_args[INCLUDE_SERIES_KEY])
+    print("Evaluated %s scenarios (%s errors)" % (num_rows, num_errors), file=sys.stderr)
+
+# =============== Serve ====================================
+def run_serve(argv):
+    import asyncio
+    import scenario_server
+
+    parsed_args = vars(build_serve_parser().parse_args(argv))
+    try:
+        server = scenario_server.ScenarioServer(
+            port=parsed_args[PORT_KEY],
+            batch_window=parsed_args[BATCH_WINDOW_KEY] / 1000.0,
+            max_batch_size=parsed_args[MAX_BATCH_SIZE_KEY],
+            max_pending=parsed_args[MAX_PENDING_KEY],
+            workers=parsed_args[WORKERS_KEY])
+    except ValueError as e:
+        print("ERROR: %s" % e)
+        sys.exit(1)
+
+    async def serve():
+        await server.start()
+        print("Serving on http://%s:%s (POST %s, GET %s); press Ctrl-C to stop" % (scenario_server.HOST, server.port, scenario_server.EVALUATE_PATH, scenario_server.METRICS_PATH), file=sys.stderr)
+        await server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except OSError as e:
+        print("ERROR: %s" % e)
+        sys.exit(1)
+    except KeyboardInterrupt:
+        pass
+
+# =============== Monte Carlo ====================================
+def parse_withdrawal_strategies(parsed_args):
+    """
+    Get the (names, withdrawal_strategies.WithdrawalStrategy list) given by --withdrawal-strategies, or (None, None) if it
+     wasn't given. Requires numpy.
+    """
+    if parsed_args[WITHDRAWAL_STRATEGIES_KEY] is None:
+        return None, None
+    import withdrawal_strategies
 
-if show_table:
+    names = [name.strip() for name in parsed_args[WITHDRAWAL_STRATEGIES_KEY].split(',') if name.strip()]
+    if len(names) == 0:
+        raise ValueError("--withdrawal-strategies needs at least one strategy")
+    return names, [withdrawal_strategies.build_strategy(name) for name in names]
+
+def run_monte_carlo(parsed_args, net_worth_changes, contrib_changes, retirement_income_changes):
+    try:
+        import monte_carlo
+    except ImportError:
+        print("ERROR: --monte-carlo requires numpy; run 'pip install numpy'")
+        sys.exit(1)
+
+    monte_carlo_paths = parsed_args[MONTE_CARLO_PATHS_KEY]
+    try:
+        historical_returns = None
+        if parsed_args[HISTORICAL_RETURNS_KEY] is not None:
+            historical_returns = monte_carlo.load_historical_returns(parsed_args[HISTORICAL_RETURNS_KEY])
+        strategy_names, strategies = parse_withdrawal_strategies(parsed_args)
+        simulation = monte_carlo.MonteCarloSimulation(
+            parsed_args[CURRENT_SAVINGS_KEY],
+            parsed_args[ANNUAL_CONTRIB_KEY],
+            parsed_args[ANNUAL_CONTRIB_INCREASE_RATE_KEY],
+            parsed_args[PRE_GROWTH_RATE_KEY],
+            parsed_args[POST_GROWTH_RATE_KEY],
+            parsed_args[INFLATION_RATE_KEY],
+            parsed_args[YEARS_TO_LIVE_KEY],
+            parsed_args[NET_RETIREMENT_INCOME_KEY],
+            parsed_args[RETIREMENT_TAX_RATE_KEY],
+            monte_carlo_paths,
+            manual_contrib_changes=contrib_changes,
+            manual_net_worth_changes=net_worth_changes,
+            manual_retirement_income_changes=retirement_income_changes,
+            return_volatility=parsed_args[RETURN_VOLATILITY_KEY],
+            inflation_volatility=parsed_args[INFLATION_VOLATILITY_KEY],
+            distribution=parsed_args[DISTRIBUTION_KEY],
+            historical_returns=historical_returns,
+            seed=parsed_args[SEED_KEY],
+            withdrawal_strategies=strategies)
+    except (OSError, ValueError) as e:
+        print("ERROR: %s" % e)
+        sys.exit(1)
+
+    print(" > MONTE CARLO PATHS: %s" % '{:,}'.format(monte_carlo_paths))
+    print_path_outcomes(simulation, "path", strategy_names)
+
+# =============== Backtest ====================================
+def run_backtest(parsed_args, net_worth_changes, contrib_changes, retirement_income_changes):
+    if parsed_args[HISTORICAL_RETURNS_KEY] is None:
+        print("ERROR: --backtest requires --historical-returns")
+        sys.exit(1)
+    try:
+        import monte_carlo
+        import historical_backtest
+    except ImportError:
+        print("ERROR: --backtest requires numpy; run 'pip install numpy'")
+        sys.exit(1)
+
+    rows_per_year = parsed_args[ROWS_PER_YEAR_KEY]
+    try:
+        strategy_names, strategies = parse_withdrawal_strategies(parsed_args)
+        backtest = historical_backtest.HistoricalBacktest(
+            parsed_args[CURRENT_SAVINGS_KEY],
+            parsed_args[ANNUAL_CONTRIB_KEY],
+            parsed_args[ANNUAL_CONTRIB_INCREASE_RATE_KEY],
+            parsed_args[PRE_GROWTH_RATE_KEY],
+            parsed_args[POST_GROWTH_RATE_KEY],
+            parsed_args[INFLATION_RATE_KEY],
+            parsed_args[YEARS_TO_LIVE_KEY],
+            parsed_args[NET_RETIREMENT_INCOME_KEY],
+            parsed_args[RETIREMENT_TAX_RATE_KEY],
+            monte_carlo.load_historical_returns(parsed_args[HISTORICAL_RETURNS_KEY]),
+            manual_contrib_changes=contrib_changes,
+            manual_net_worth_changes=net_worth_changes,
+            manual_retirement_income_changes=retirement_income_changes,
+            rows_per_year=rows_per_year,
+            withdrawal_strategies=strategies)
+    except (OSError, ValueError) as e:
+        print("ERROR: %s" % e)
+        sys.exit(1)
+
+    print(" > BACKTEST WINDOWS: %s (starting at each of rows 1 to %s of the file)" % ('{:,}'.format(backtest.num_paths), '{:,}'.format(backtest.num_paths)))
+    if strategy_names is None:
+        print(" > SUCCESS RATE (retire and never run out of money): {:.1%}".format(backtest.get_success_rate()))
+    worst_years, worst_start_row = backtest.get_worst_years_to_retirement()
+    if worst_years is None:
+        print(" > WORST CASE: never retire (window starting at row %s)" % (worst_start_row + 1))
+    else:
+        print(" > WORST CASE YEARS TO RETIREMENT: %s (window starting at row %s)" % (worst_years, worst_start_row + 1))
+    print_path_outcomes(backtest, "window", strategy_names)
+
+def print_path_outcomes(outcomes, path_name, strategy_names=None):
+    """
+    Prints the chances of retiring and of running out of money, and the percentiles of years to retirement and waste, of
+     a monte_carlo.PathOutcomes, exiting if no path retires. Given the names of the withdrawal strategies it was run with,
+     prints what happens after retiring (which is all the strategies change) for each of them, along with the percentiles
+     of their lowest income.
+    """
+    percentiles = [5, 25, 50, 75, 95]
+    print(" > CHANCE OF RETIRING: {:.1%}".format(outcomes.get_retirement_probability()))
+    years_percentiles = outcomes.get_years_to_retirement_percentiles(percentiles)
+    if years_percentiles is None:
+        print("You can't retire with the current parameters on any %s!" % path_name)
+        sys.exit(1)
+    if strategy_names is None:
+        print(" > CHANCE OF RUNNING OUT OF MONEY AFTER RETIRING: {:.1%}".format(outcomes.get_ruin_probability()))
+    print(" > YEARS TO RETIREMENT: " + ", ".join("p%s %s" % (percentile, int(years)) for percentile, years in zip(percentiles, years_percentiles)))
+    if strategy_names is None:
+        print_retirement_outcomes(outcomes, path_name, percentiles)
+        return
+    for name, strategy_outcomes in zip(strategy_names, outcomes.get_strategy_outcomes()):
+        print(" > WITHDRAWAL STRATEGY %s:" % name)
+        print("   > CHANCE OF RUNNING OUT OF MONEY AFTER RETIRING: {:.1%}".format(strategy_outcomes.get_ruin_probability()))
+        lowest_income_percentiles = strategy_outcomes.get_lowest_income_percentiles(percentiles)
+        print("   > LOWEST INCOME (share of planned income in the worst year): " + ", ".join("p%s %s" % (percentile, '{:.0%}'.format(income)) for percentile, income in zip(percentiles, lowest_income_percentiles)))
+        print_retirement_outcomes(strategy_outcomes, path_name, percentiles, "  ")
+
+def print_retirement_outcomes(outcomes, path_name, percentiles, indent=""):
+    """
+    Prints the waste percentiles of a monte_carlo.PathOutcomes, if any path retires without running out of money
+    """
+    waste_percentiles = outcomes.get_waste_percentiles(percentiles)
+    if waste_percentiles is not None:
+        print(indent + " > WASTE (dollars at death, for %ss that don't run out): " % path_name + ", ".join("p%s %s" % (percentile, '{:,}'.format(int(waste))) for percentile, waste in zip(percentiles, waste_percentiles)))
+
+# =============== Main Code ====================================
+def print_table(retirement_calculator, num_periods, periods_per_year, profiler=None):
     serieses = [
         retirement_calculator.get_series_data(Series.ACCOUNT_VALUE),
         retirement_calculator.get_series_data(Series.ACTUAL_WITHDRAWALS),
@@ -138,27 +483,175 @@ if show_table:
         retirement_calculator.get_series_data(Series.NO_RETIREMENT),
         retirement_calculator.get_series_data(Series.CONTRIBUTIONS),
     ]
+    if profiler is not None:
+        profiler.start()
 
-
-    print("NOTE: retirement withdrawal is taken out at the start of the year, i.e. immediately after the bank_statement")
+    print("NOTE: retirement withdrawal is taken out at the start of the %s, i.e. immediately after the bank_statement" % ("year" if periods_per_year == 1 else "period"))
     headers = [
         # First value is header w/o tabulate, second is tabulate header
-        ("years", "years"),
+        ("years", "years") if periods_per_year == 1 else ("period", "period"),
         ("acct", "account balance"),
         ("withdr", "ret withdrawal"),
         ("ret_min", "min balance to ret"),
         ("no_ret", "balance if never retire"),
-        ("contrib", "annual contrib"),
+        ("contrib", "annual contrib") if periods_per_year == 1 else ("contrib", "contrib / period"),
     ]
 
-    if have_tabulate:
+    try:
+        import tabulate
+    except ImportError:
+        tabulate = None
+
+    if tabulate is not None:
         data = []
-        for i in range(0, years_to_live):
+        for i in range(0, num_periods):
             data.append([str(i)] + ['{:,}'.format(int(series[i])) for series in serieses])
         print(tabulate.tabulate(data, headers=[elem[1] for elem in headers], tablefmt='presto'))
     else:
         print("   ".join([elem[0] for elem in headers]))
-        for i in range(0, years_to_live):
+        for i in range(0, num_periods):
             row = [str(i)] + [str(int(series[i])) for series in serieses]
             print("   ".join(row))
         print("\nINFO: tabulate module was not found so resorting to ugly tables; run 'pip install tabulate' to get prettier tables")
+    if profiler is not None:
+        profiler.lap('table_output')
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == SWEEP_COMMAND:
+        run_sweep(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == SERVE_COMMAND:
+        run_serve(sys.argv[2:])
+        return
+    if BATCH_FLAG in sys.argv[1:]:
+        run_batch(sys.argv[1:])
+        return
+
+    parse_start_time = time.perf_counter()
+    parse_start_blocks = sys.getallocatedblocks()
+    parsed_args = parse_simple_args(sys.argv[1:])
+    if parsed_args is None:
+        parsed_args = vars(build_parser().parse_args())
+
+    profiler = None
+    if parsed_args[PROFILE_KEY]:
+        import profiling
+        profiler = profiling.StageProfiler()
+        profiler.add('arg_parsing', time.perf_counter() - parse_start_time, sys.getallocatedblocks() - parse_start_blocks)
+    profile_output = parsed_args[PROFILE_OUTPUT_KEY]
+    cprofile = None
+    if profile_output is not None:
+        import cProfile
+        cprofile = cProfile.Profile()
+        cprofile.enable()
+
+    # Report even if the run exits early, e.g. because you can't retire
+    try:
+        run_calculator(parsed_args, profiler)
+    finally:
+        if cprofile is not None:
+            cprofile.disable()
+            cprofile.dump_stats(profile_output)
+            print("Wrote cProfile stats to %s; view them with 'python -m pstats %s'" % (profile_output, profile_output), file=sys.stderr)
+        if profiler is not None:
+            print(profiler.format_report(), file=sys.stderr)
+
+def run_calculator(parsed_args, profiler=None):
+    if profiler is not None:
+        profiler.start()
+    years_to_live = parsed_args[YEARS_TO_LIVE_KEY]
+    if years_to_live < 1:
+        print("ERROR: Invalid years to live; are you expecting to die today??")
+        sys.exit(1)
+
+    periods_per_year = parsed_args[PERIODS_PER_YEAR_KEY]
+    if periods_per_year < 1:
+        print("ERROR: Periods per year must be >= 1")
+        sys.exit(1)
+
+    net_worth_changes, contrib_changes, retirement_income_changes = parse_change_args(parsed_args, years_to_live, periods_per_year)
+    if profiler is not None:
+        profiler.lap('change_parsing')
+
+    if parsed_args[SOLVE_FOR_KEY] is not None:
+        run_solver(parsed_args, periods_per_year, net_worth_changes, contrib_changes, retirement_income_changes)
+        if profiler is not None:
+            profiler.lap('solver')
+
+    current_retirement_savings = parsed_args[CURRENT_SAVINGS_KEY]
+    annual_contribution = parsed_args[ANNUAL_CONTRIB_KEY]
+    annual_contribution_increase_rate = parsed_args[ANNUAL_CONTRIB_INCREASE_RATE_KEY]
+
+    #  NOTE: this is the growth rate you expect BEFORE retirement! In retirement, we switch to more conservative securities that only get inflation rate
+    pre_retirement_growth_rate = parsed_args[PRE_GROWTH_RATE_KEY]
+    post_retirement_growth_rate = parsed_args[POST_GROWTH_RATE_KEY]
+    inflation_rate = parsed_args[INFLATION_RATE_KEY]
+
+    desired_net_retirement_income_todays_dollars = parsed_args[NET_RETIREMENT_INCOME_KEY]
+    retirement_tax_rate = parsed_args[RETIREMENT_TAX_RATE_KEY]
+
+    show_table = parsed_args[SHOW_TABLE_KEY]
+
+    if parsed_args[BACKTEST_KEY]:
+        if periods_per_year != 1 or parsed_args[MONTE_CARLO_PATHS_KEY] is not None:
+            print("ERROR: --backtest can't be combined with --periods-per-year or --monte-carlo; use --rows-per-year for monthly history")
+            sys.exit(1)
+        if profiler is not None:
+            profiler.start()
+        run_backtest(parsed_args, net_worth_changes, contrib_changes, retirement_income_changes)
+        if profiler is not None:
+            profiler.lap('backtest')
+        return
+
+    if parsed_args[MONTE_CARLO_PATHS_KEY] is not None:
+        if periods_per_year != 1:
+            print("ERROR: --monte-carlo simulates one period per year, so can't be combined with --periods-per-year")
+            sys.exit(1)
+        if profiler is not None:
+            profiler.start()
+        run_monte_carlo(parsed_args, net_worth_changes, contrib_changes, retirement_income_changes)
+        if profiler is not None:
+            profiler.lap('monte_carlo')
+        return
+
+    retirement_calculator = RetirementAgeCalculator(
+        current_retirement_savings,
+        annual_contribution,
+        annual_contribution_increase_rate,
+        pre_retirement_growth_rate,
+        post_retirement_growth_rate,
+        inflation_rate,
+        years_to_live,
+        desired_net_retirement_income_todays_dollars,
+        retirement_tax_rate,
+        manual_contrib_changes=contrib_changes,
+        manual_net_worth_changes=net_worth_changes,
+        manual_retirement_income_changes=retirement_income_changes,
+        periods_per_year=periods_per_year,
+        profiler=profiler)
+
+    # In periods, which are only years with one period per year
+    years_to_retirement = retirement_calculator.get_earliest_retirement()
+    if years_to_retirement is None:
+        print("You can't retire with the current parameters!")
+        sys.exit(1)
+    elif periods_per_year == 1:
+        print(" > YEARS TO RETIREMENT: %s" % years_to_retirement)
+    else:
+        print(" > YEARS TO RETIREMENT: %.2f (%s periods)" % (years_to_retirement / periods_per_year, years_to_retirement))
+    print(" > WASTE: %s (dollars at death)" % '{:,}'.format(int(retirement_calculator.get_waste())))
+
+    # Double-check the user hasn't added any networth changes AFTER retirement, as we don't handle these
+    for key in net_worth_changes.keys():
+        if key > years_to_retirement:
+            print("ERROR: You've set a net worth change that happens AFTER projected retirement - this script currently can't handle this")
+            sys.exit(1)
+    for key in contrib_changes.keys():
+        if key >= years_to_retirement:
+            print("WARN: You've set a contribution change that happens on or after projected retirement - this will be ignored for retirement calculations")
+
+    if show_table:
+        print_table(retirement_calculator, years_to_live * periods_per_year, periods_per_year, profiler)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+import numpy as np
+
+from monte_carlo import PathOutcomes, RetirementPlan, simulate_paths
+
+def _annual_growth(rates, window_starts, num_years, rows_per_year):
+    """
+    Gets the (window x year) growth factors (1 + rate) compounded over each year of each window, where year i of the
+     window starting at row s spans rows [s + i * rows_per_year, s + (i + 1) * rows_per_year)
+
+    Uses prefix sums of log(1 + rate), computed once, so each entry is a single difference no matter how many rows make
+     up a year. Rates of -100% or worse have no log, so then the rows of each year are multiplied out instead.
+    """
+    year_starts = window_starts[:, None] + rows_per_year * np.arange(num_years)
+    if (rates > -1).all():
+        cumulative_log_growth = np.concatenate(([0.0], np.cumsum(np.log1p(rates))))
+        return np.exp(cumulative_log_growth[year_starts + rows_per_year] - cumulative_log_growth[year_starts])
+    return np.prod(1 + rates[year_starts[:, :, None] + np.arange(rows_per_year)], axis=2)
+
+def backtest_windows(plan, returns, inflation, post_retirement_shift=0.0, rows_per_year=1, withdrawal_strategies=None):
+    """
+    Runs the plan through every rolling window of historical returns and inflation, vectorized across windows.
+
+    Within a window the balance only compounds and gets added to (or withdrawn from), so given each window's cumulative
+     growth and inflation the whole (window x year) balance matrix follows from cumulative sums, with no loop over the
+     years. That only holds while balances can't be floored at 0, so if a window's balance would go negative before
+     retirement (from a negative net worth change) or a year wipes out the whole account, this falls back to
+     simulate_paths over the same windows. So do any withdrawal strategies other than the default fixed withdrawals,
+     whose withdrawals depend on each year's balance.
+
+    Args:
+        plan: the RetirementPlan to backtest
+        returns: array of historical market returns, one per row in chronological order
+        inflation: array of historical inflation, one per row
+        post_retirement_shift: added to each year's market return after retirement, to represent a more conservative allocation
+        rows_per_year: number of rows making up a year, e.g. 12 for monthly data; windows then start at every row
+        withdrawal_strategies: as for simulate_paths
+
+    Returns:
+        list of (years_to_retirement, ruined, waste, lowest_income) arrays with one entry per window for each withdrawal
+         strategy, as returned by simulate_paths
+    """
+    num_years = plan.years_to_live - 1
+    num_windows = min(len(returns), len(returns) - rows_per_year * num_years + 1)
+    if num_windows < 1:
+        raise ValueError("Backtesting %s years needs at least %s rows of historical returns, but there are only %s" % (plan.years_to_live, rows_per_year * num_years, len(returns)))
+    window_starts = np.arange(num_windows)
+    pre_growth = _annual_growth(returns, window_starts, num_years, rows_per_year)
+    post_growth = pre_growth + post_retirement_shift
+    inflation_growth = _annual_growth(inflation, window_starts, num_years, rows_per_year)
+
+    def next_year_rates(year):
+        return pre_growth[:, year] - 1, post_growth[:, year] - 1, inflation_growth[:, year] - 1
+    if withdrawal_strategies is not None or (post_growth <= 0).any() or (inflation_growth <= 0).any() or (pre_growth <= 0).any():
+        return simulate_paths(plan, num_windows, next_year_rates, withdrawal_strategies)
+
+    def cumulative(growth):
+        # Growth from the start of each window to the start of each year
+        return np.concatenate((np.ones((num_windows, 1)), np.cumprod(growth, axis=1)), axis=1)
+    cumulative_pre_growth = cumulative(pre_growth)
+    cumulative_post_growth = cumulative(post_growth)
+    price_level = cumulative(inflation_growth)
+
+    # Balance if you never retire: each year's contribution and net worth change, discounted back to the start of the
+    #  window, accumulate on top of the starting balance
+    starting_balance = max(0, plan.current_retirement_savings + plan.net_worth_changes[0])
+    inflows = np.concatenate(([0.0], plan.contributions[:-1] + plan.net_worth_changes[1:]))
+    no_retirement = cumulative_pre_growth * (starting_balance + np.cumsum(inflows / cumulative_pre_growth, axis=1))
+    if (no_retirement < 0).any():
+        return simulate_paths(plan, num_windows, next_year_rates, withdrawal_strategies)
+
+    can_retire = no_retirement >= plan.min_worth_todays_dollars * price_level
+    retired = can_retire.any(axis=1)
+    years_to_retirement = np.where(retired, can_retire.argmax(axis=1), -1)
+    retirement = np.where(retired, years_to_retirement, plan.years_to_live - 1)
+    window_indices = np.arange(num_windows)
+
+    # After retiring, each year's withdrawal discounted back to the start of the window comes out of the balance at
+    #  retirement; the account runs out the first year it can't cover the withdrawal
+    withdrawals = plan.withdrawals_todays_dollars * price_level
+    discounted_withdrawals = np.concatenate((np.zeros((num_windows, 1)), np.cumsum(withdrawals / cumulative_post_growth, axis=1)[:, :-1]), axis=1)
+    balance_at_retirement = no_retirement[window_indices, retirement] / cumulative_post_growth[window_indices, retirement]
+    account_value = cumulative_post_growth * (balance_at_retirement[:, None] - (discounted_withdrawals - discounted_withdrawals[window_indices, retirement][:, None]))
+    after_retirement = np.arange(plan.years_to_live) >= retirement[:, None]
+    ruined = retired & ((account_value < withdrawals) & after_retirement).any(axis=1)
+
+    waste = np.where(retired & ~ruined, account_value[:, -1] - withdrawals[:, -1], np.nan)
+    # The fraction of each year's withdrawal the balance could cover, which only drops below 1 once the account runs out
+    income = np.divide(np.clip(account_value, 0, withdrawals), withdrawals, out=np.ones(withdrawals.shape), where=withdrawals > 0)
+    lowest_income = np.where(retired, np.min(np.where(after_retirement, income, 1.0), axis=1), np.nan)
+    return [(years_to_retirement, ruined, waste, lowest_income)]
+
+class HistoricalBacktest(PathOutcomes):
+    """
+    Backtests a retirement scenario against history: runs it through every rolling window of historical market returns
+     and inflation (each window starting one row later than the last), rather than assuming constant rates
+    """
+    def __init__(self,
+            current_retirement_savings,
+            annual_contribution,
+            annual_contribution_increase_rate,
+            pre_retirement_growth_rate,
+            post_retirement_growth_rate,
+            inflation_rate,
+            years_to_live,
+            desired_net_retirement_income_todays_dollars,
+            retirement_tax_rate,
+            historical_returns,
+            manual_contrib_changes=None,
+            manual_net_worth_changes=None,
+            manual_retirement_income_changes=None,
+            rows_per_year=1,
+            withdrawal_strategies=None):
+        """
+        Takes the same arguments as RetirementAgeCalculator, with the growth and inflation rates used to work out the
+        minimum worth needed to retire (as in MonteCarloSimulation), plus:
+
+        Args:
+            historical_returns: (returns, inflation) tuple as returned by monte_carlo.load_historical_returns. Post-retirement
+                returns are the historical returns shifted by the difference between the post- and pre-retirement growth
+                rates, to represent a more conservative allocation.
+            rows_per_year: number of rows of historical_returns making up a year, e.g. 12 for monthly returns and inflation
+            withdrawal_strategies: list of withdrawal_strategies.WithdrawalStrategy to compare over the same windows
+                (default: just FixedWithdrawals). This object's own outcomes are those of the first strategy;
+                get_strategy_outcomes has them all.
+        """
+        if rows_per_year < 1:
+            raise ValueError("Rows per year must be >= 1")
+        plan = RetirementPlan(
+            current_retirement_savings,
+            annual_contribution,
+            annual_contribution_increase_rate,
+            pre_retirement_growth_rate,
+            post_retirement_growth_rate,
+            inflation_rate,
+            years_to_live,
+            desired_net_retirement_income_todays_dollars,
+            retirement_tax_rate,
+            manual_contrib_changes=manual_contrib_changes,
+            manual_net_worth_changes=manual_net_worth_changes,
+            manual_retirement_income_changes=manual_retirement_income_changes)
+        returns, inflation = historical_returns
+        self.rows_per_year = rows_per_year
+        results = backtest_windows(plan, returns, inflation, post_retirement_growth_rate - pre_retirement_growth_rate, rows_per_year, withdrawal_strategies)
+        super().__init__(*results[0])
+        self.strategy_outcomes = [PathOutcomes(*outcomes) for outcomes in results]
+
+    def get_strategy_outcomes(self):
+        """
+        Get a list with the PathOutcomes of each withdrawal strategy, in the order they were given
+        """
+        return self.strategy_outcomes
+
+    def get_success_rate(self):
+        """
+        Fraction of windows that retire and never run out of money
+        """
+        return np.count_nonzero((self.years_to_retirement >= 0) & ~self.ruined) / self.num_paths
+
+    def get_worst_years_to_retirement(self):
+        """
+        Get the (years to retirement, starting row) of the window that takes longest to retire, where the starting row is
+         the 0-based row of historical returns the window starts at and the years are None if that window never retires
+        """
+        never_retired = self.years_to_retirement < 0
+        if never_retired.any():
+            return None, int(never_retired.argmax())
+        worst_window = int(self.years_to_retirement.argmax())
+        return int(self.years_to_retirement[worst_window]), worst_window
@@ -0,0 +1,182 @@
+import math
+
+from retirement_age_calculator import ScenarioCache, find_earliest_retirement, validate_manual_changes
+
+# The inputs that can be solved for, named after the matching RetirementAgeCalculator args
+CURRENT_RETIREMENT_SAVINGS = 'current_retirement_savings'
+ANNUAL_CONTRIBUTION = 'annual_contribution'
+DESIRED_NET_RETIREMENT_INCOME = 'desired_net_retirement_income_todays_dollars'
+PRE_RETIREMENT_GROWTH_RATE = 'pre_retirement_growth_rate'
+POST_RETIREMENT_GROWTH_RATE = 'post_retirement_growth_rate'
+
+# For each solvable input, as (whether more of it lets you retire sooner, lowest value it can take, highest value worth
+#  searching up to, whether the model is affine in it)
+SOLVABLE_INPUTS = {
+    CURRENT_RETIREMENT_SAVINGS: (True, 0.0, 1e15, True),
+    ANNUAL_CONTRIBUTION: (True, 0.0, 1e15, True),
+    DESIRED_NET_RETIREMENT_INCOME: (False, 0.0, 1e15, True),
+    PRE_RETIREMENT_GROWTH_RATE: (True, -0.99, 10.0, False),
+    POST_RETIREMENT_GROWTH_RATE: (True, -0.99, 10.0, False),
+}
+
+# Relative precision of the answer
+_TOLERANCE = 1e-9
+
+class InverseSolver:
+    """
+    Inverts the retirement model, finding the value of one input (e.g. the annual contribution) that lets you retire
+     within a target number of years.
+
+    Net worth is affine in the savings and contribution, and the min worth needed to retire is affine in the retirement
+     income, so for those the gap between the two at the target year is a straight line: two evaluations find where it
+     crosses zero, and two more confirm that's the boundary. For the growth rates, or if the confirmation fails (e.g. a
+     negative net worth change zeroes out the balance, or you could retire before the target year with less), the solver
+     falls back to bisecting a bracket around the boundary.
+    """
+    def __init__(self,
+            current_retirement_savings,
+            annual_contribution,
+            annual_contribution_increase_rate,
+            pre_retirement_growth_rate,
+            post_retirement_growth_rate,
+            inflation_rate,
+            years_to_live,
+            desired_net_retirement_income_todays_dollars,
+            retirement_tax_rate,
+            manual_contrib_changes=None,
+            manual_net_worth_changes=None,
+            manual_retirement_income_changes=None,
+            periods_per_year=1):
+        """
+        Takes the same arguments as RetirementAgeCalculator; the value given for the input being solved for is used as
+         the starting point of the search
+        """
+        manual_contrib_changes = manual_contrib_changes if manual_contrib_changes is not None else {}
+        manual_net_worth_changes = manual_net_worth_changes if manual_net_worth_changes is not None else {}
+        manual_retirement_income_changes = manual_retirement_income_changes if manual_retirement_income_changes is not None else {}
+        validate_manual_changes(years_to_live, manual_contrib_changes, manual_net_worth_changes, manual_retirement_income_changes, periods_per_year)
+
+        self.inputs = {
+            CURRENT_RETIREMENT_SAVINGS: current_retirement_savings,
+            ANNUAL_CONTRIBUTION: annual_contribution,
+            'annual_contribution_increase_rate': annual_contribution_increase_rate,
+            PRE_RETIREMENT_GROWTH_RATE: pre_retirement_growth_rate,
+            POST_RETIREMENT_GROWTH_RATE: post_retirement_growth_rate,
+            'inflation_rate': inflation_rate,
+            DESIRED_NET_RETIREMENT_INCOME: desired_net_retirement_income_todays_dollars,
+            'retirement_tax_rate': retirement_tax_rate,
+        }
+        self.years_to_live = years_to_live
+        self.periods_per_year = periods_per_year
+        self.manual_contrib_changes = manual_contrib_changes
+        self.manual_net_worth_changes = manual_net_worth_changes
+        self.manual_retirement_income_changes = manual_retirement_income_changes
+        # Only the functions that depend on the input being solved for get rebuilt at each evaluation
+        self.cache = ScenarioCache(max_size=64)
+
+    def solve(self, input_name, target_years_to_retirement):
+        """
+        Finds the smallest value of the given input (or, for the retirement income, the largest) that lets you retire
+         within target_years_to_retirement years (or periods, with more than one period per year)
+
+        Args:
+            input_name: one of the SOLVABLE_INPUTS
+            target_years_to_retirement: latest year you want to be able to retire in
+
+        Returns:
+            (value, number of evaluations), where value is None if no value within the input's range lets you retire in
+             time, or math.inf if any retirement income would
+        """
+        if input_name not in SOLVABLE_INPUTS:
+            raise ValueError("Can't solve for '%s'; must be one of %s" % (input_name, ", ".join(SOLVABLE_INPUTS)))
+        num_periods = self.years_to_live * self.periods_per_year
+        if target_years_to_retirement < 0 or target_years_to_retirement >= num_periods:
+            raise ValueError("Invalid target year '%s'; must be in range [0,%s)" % (target_years_to_retirement, num_periods))
+        more_is_better, lower_bound, upper_bound, is_affine = SOLVABLE_INPUTS[input_name]
+
+        evaluations = 0
+        def can_retire_by(value):
+            nonlocal evaluations
+            evaluations = evaluations + 1
+            no_retirement_function, min_worth_function = self._get_functions(input_name, value)
+            years_to_retirement, _ = find_earliest_retirement(no_retirement_function, min_worth_function)
+            return years_to_retirement is not None and years_to_retirement <= target_years_to_retirement
+
+        def gap(value):
+            nonlocal evaluations
+            evaluations = evaluations + 1
+            no_retirement_function, min_worth_function = self._get_functions(input_name, value)
+            return no_retirement_function.apply(target_years_to_retirement) - min_worth_function.apply(target_years_to_retirement)
+
+        start = min(max(lower_bound, self.inputs[input_name]), upper_bound)
+        if is_affine:
+            # Where the line through two points of the gap crosses zero
+            other = start + max(1.0, abs(start))
+            start_gap = gap(start)
+            other_gap = gap(other)
+            if start_gap != other_gap:
+                estimate = start - start_gap * (other - start) / (other_gap - start_gap)
+                tolerance = _TOLERANCE * max(1.0, abs(estimate))
+                if more_is_better:
+                    if estimate - tolerance <= lower_bound:
+                        if can_retire_by(lower_bound):
+                            return lower_bound, evaluations
+                    elif can_retire_by(estimate + tolerance) and not can_retire_by(estimate - tolerance):
+                        return estimate + tolerance, evaluations
+                elif estimate - tolerance >= lower_bound and can_retire_by(estimate - tolerance) and not can_retire_by(estimate + tolerance):
+                    return estimate - tolerance, evaluations
+
+        # Bracket the boundary between values that do and don't let you retire in time, widening from the starting point
+        if more_is_better:
+            if can_retire_by(lower_bound):
+                return lower_bound, evaluations
+            bad = lower_bound
+            good = start
+            while not can_retire_by(good):
+                if good >= upper_bound:
+                    return None, evaluations
+                bad = good
+                good = min(upper_bound, good + max(1.0, abs(good - lower_bound)))
+        else:
+            if not can_retire_by(lower_bound):
+                return None, evaluations
+            good = lower_bound
+            bad = start
+            while can_retire_by(bad):
+                if bad >= upper_bound:
+                    return math.inf, evaluations
+                good = bad
+                bad = min(upper_bound, bad + max(1.0, abs(bad - lower_bound)))
+
+        while abs(good - bad) > _TOLERANCE * max(1.0, abs(good)):
+            middle = (good + bad) / 2
+            if can_retire_by(middle):
+                good = middle
+            else:
+                bad = middle
+        return good, evaluations
+
+    def _get_functions(self, input_name, value):
+        """
+        Gets the (net worth, min worth) functions with the given input replaced by value
+        """
+        inputs = dict(self.inputs)
+        inputs[input_name] = value
+        min_worth_function = self.cache.get_min_worth_function(
+            self.years_to_live,
+            inputs[DESIRED_NET_RETIREMENT_INCOME],
+            inputs['retirement_tax_rate'],
+            inputs['inflation_rate'],
+            self.manual_retirement_income_changes,
+            inputs[POST_RETIREMENT_GROWTH_RATE],
+            self.periods_per_year)
+        no_retirement_function = self.cache.get_no_retirement_function(
+            self.years_to_live,
+            self.manual_net_worth_changes,
+            inputs[CURRENT_RETIREMENT_SAVINGS],
+            inputs[PRE_RETIREMENT_GROWTH_RATE],
+            self.manual_contrib_changes,
+            inputs[ANNUAL_CONTRIBUTION],
+            inputs['annual_contribution_increase_rate'],
+            self.periods_per_year)
+        return no_retirement_function, min_worth_function
@@ -0,0 +1,307 @@
+import csv
+
+import numpy as np
+
+from retirement_age_calculator import ContributionFunction, RetirementWithdrawalsFunction, RetirementMinWorthFunction, validate_manual_changes
+from withdrawal_strategies import FixedWithdrawals
+
+NORMAL_DISTRIBUTION = 'normal'
+LOGNORMAL_DISTRIBUTION = 'lognormal'
+DISTRIBUTIONS = (NORMAL_DISTRIBUTION, LOGNORMAL_DISTRIBUTION)
+
+RETURN_COLUMN = 'return'
+INFLATION_COLUMN = 'inflation'
+
+def load_historical_returns(filepath):
+    """
+    Loads a CSV of historical market returns and inflation, one row per year in chronological order, with a 'return' and
+     an 'inflation' column in the form 0.XX (any other columns are ignored)
+
+    Returns:
+        (returns, inflation) arrays
+    """
+    returns = []
+    inflation = []
+    with open(filepath, newline='') as historical_file:
+        for row_num, row in enumerate(csv.DictReader(historical_file), start=2):
+            try:
+                returns.append(float(row[RETURN_COLUMN]))
+                inflation.append(float(row[INFLATION_COLUMN]))
+            except (KeyError, TypeError, ValueError):
+                raise ValueError("Invalid row %s in historical returns file '%s'; expected numeric '%s' and '%s' columns" % (row_num, filepath, RETURN_COLUMN, INFLATION_COLUMN))
+    if len(returns) == 0:
+        raise ValueError("Historical returns file '%s' has no rows" % filepath)
+    return np.array(returns), np.array(inflation)
+
+class RetirementPlan:
+    """
+    The deterministic parts of a retirement scenario (contributions, withdrawals in today's dollars, and the minimum
+     worth needed to retire) that every simulated path shares
+    """
+    def __init__(self,
+            current_retirement_savings,
+            annual_contribution,
+            annual_contribution_increase_rate,
+            pre_retirement_growth_rate,
+            post_retirement_growth_rate,
+            inflation_rate,
+            years_to_live,
+            desired_net_retirement_income_todays_dollars,
+            retirement_tax_rate,
+            manual_contrib_changes=None,
+            manual_net_worth_changes=None,
+            manual_retirement_income_changes=None):
+        manual_contrib_changes = manual_contrib_changes if manual_contrib_changes is not None else {}
+        manual_net_worth_changes = manual_net_worth_changes if manual_net_worth_changes is not None else {}
+        manual_retirement_income_changes = manual_retirement_income_changes if manual_retirement_income_changes is not None else {}
+        validate_manual_changes(years_to_live, manual_contrib_changes, manual_net_worth_changes, manual_retirement_income_changes)
+
+        self.years_to_live = years_to_live
+        self.current_retirement_savings = current_retirement_savings
+        self.contributions = np.asarray(ContributionFunction(years_to_live, manual_contrib_changes, annual_contribution, annual_contribution_increase_rate).data())
+        self.net_worth_changes = np.zeros(years_to_live)
+        for years_out, change in manual_net_worth_changes.items():
+            self.net_worth_changes[years_out] = change
+
+        # With zero inflation, this is the gross withdrawal in today's dollars
+        self.withdrawals_todays_dollars = np.asarray(RetirementWithdrawalsFunction(years_to_live, desired_net_retirement_income_todays_dollars, retirement_tax_rate, 0.0, manual_retirement_income_changes).data())
+
+        # The minimum worth needed to retire, in today's dollars, assuming the expected rates hold from then on
+        withdrawals_function = RetirementWithdrawalsFunction(years_to_live, desired_net_retirement_income_todays_dollars, retirement_tax_rate, inflation_rate, manual_retirement_income_changes)
+        min_worth = np.asarray(RetirementMinWorthFunction(years_to_live, withdrawals_function, post_retirement_growth_rate).data())
+        self.min_worth_todays_dollars = min_worth / (1.0 + inflation_rate) ** np.arange(years_to_live)
+
+def simulate_paths(plan, num_paths, next_year_rates, withdrawal_strategies=None):
+    """
+    Runs the plan over many market paths at once, vectorized across paths.
+
+    Each path retires in the first year its balance reaches the minimum worth needed to retire (scaled by the inflation
+     actually seen so far), and then withdraws at the start of every year whatever each withdrawal strategy decides. Every
+     strategy runs over the same paths in the same pass, as one more row of the balance array, so comparing strategies
+     costs little more than running one.
+
+    Args:
+        plan: the RetirementPlan to simulate
+        num_paths: number of paths
+        next_year_rates: function called with each year i in [0, years_to_live - 1) that returns a tuple of
+            (pre-retirement return, post-retirement return, inflation) arrays, each with one entry per path, applying
+            between year i and year i + 1
+        withdrawal_strategies: list of withdrawal_strategies.WithdrawalStrategy to run after retirement (default: just
+            FixedWithdrawals, i.e. the inflation-adjusted retirement income every year)
+
+    Returns:
+        list with a (years_to_retirement, ruined, waste, lowest_income) tuple of arrays for each withdrawal strategy,
+         where years_to_retirement is -1 for paths that never retire, ruined is True for paths that retired but couldn't
+         fund a later year's withdrawal, waste is the money left at death (NaN for paths that never retired or were
+         ruined), and lowest_income is the smallest fraction of the planned retirement income actually withdrawn in any
+         year after retiring (NaN for paths that never retired)
+    """
+    withdrawal_strategies = withdrawal_strategies if withdrawal_strategies is not None else [FixedWithdrawals()]
+    num_strategies = len(withdrawal_strategies)
+    for strategy in withdrawal_strategies:
+        strategy.reset(num_paths)
+
+    years_to_retirement = np.full(num_paths, -1)
+    ruined = np.zeros((num_strategies, num_paths), dtype=bool)
+    lowest_income = np.full((num_strategies, num_paths), np.inf)
+    price_level = np.ones(num_paths)
+    # One row per strategy; the rows only differ after retirement
+    balance = np.full((num_strategies, num_paths), max(0, plan.current_retirement_savings + plan.net_worth_changes[0]))
+    withdrawal = np.zeros((num_strategies, num_paths))
+    post_return = None
+    inflation = None
+    for i in range(0, plan.years_to_live):
+        retired = years_to_retirement >= 0
+        if i > 0:
+            pre_return, post_return, inflation = next_year_rates(i - 1)
+            price_level *= 1.0 + inflation
+            # Every strategy's row holds the same balance until retiring, so this only needs the first
+            before_retirement = balance[0] * (1 + pre_return) + plan.contributions[i - 1] + plan.net_worth_changes[i]
+            after_retirement = (balance - withdrawal) * (1 + post_return)
+            balance = np.maximum(0, np.where(retired, after_retirement, before_retirement))
+
+        newly_retired = ~retired & (balance[0] >= plan.min_worth_todays_dollars[i] * price_level)
+        years_to_retirement[newly_retired] = i
+        retired |= newly_retired
+
+        planned_withdrawal = plan.withdrawals_todays_dollars[i] * price_level
+        for idx, strategy in enumerate(withdrawal_strategies):
+            withdrawal[idx] = strategy.get_withdrawals(plan.years_to_live - i, balance[idx], planned_withdrawal, newly_retired, post_return, inflation)
+        ruined |= retired & (balance < withdrawal)
+        income = np.divide(np.minimum(withdrawal, balance), planned_withdrawal, out=np.full(withdrawal.shape, np.inf), where=planned_withdrawal > 0)
+        np.minimum(lowest_income, income, out=lowest_income, where=retired)
+
+    waste = np.where(retired & ~ruined, balance - withdrawal, np.nan)
+    lowest_income = np.where(retired, np.where(np.isinf(lowest_income), 1.0, lowest_income), np.nan)
+    return [(years_to_retirement, ruined[idx], waste[idx], lowest_income[idx]) for idx in range(0, num_strategies)]
+
+class PathOutcomes:
+    """
+    Summarizes the outcomes of running a plan over many market paths, as returned by simulate_paths
+    """
+    def __init__(self, years_to_retirement, ruined, waste, lowest_income):
+        self.num_paths = len(years_to_retirement)
+        self.years_to_retirement = years_to_retirement
+        self.ruined = ruined
+        self.waste = waste
+        self.lowest_income = lowest_income
+
+    def get_years_to_retirement(self):
+        """
+        Get an integer array with the number of years until each path retires, or -1 for paths that never retire
+        """
+        return self.years_to_retirement
+
+    def get_retirement_probability(self):
+        """
+        Fraction of paths that get to retire at all
+        """
+        return np.count_nonzero(self.years_to_retirement >= 0) / self.num_paths
+
+    def get_ruin_probability(self):
+        """
+        Fraction of the paths that retire which then run out of money before dying, or None if no path retires
+        """
+        num_retired = np.count_nonzero(self.years_to_retirement >= 0)
+        if num_retired == 0:
+            return None
+        return np.count_nonzero(self.ruined) / num_retired
+
+    def get_years_to_retirement_percentiles(self, percentiles):
+        """
+        Percentiles of the years to retirement across the paths that retire, or None if no path retires
+        """
+        retired_years = self.years_to_retirement[self.years_to_retirement >= 0]
+        if len(retired_years) == 0:
+            return None
+        return np.percentile(retired_years, percentiles)
+
+    def get_waste_percentiles(self, percentiles):
+        """
+        Percentiles of the dollars left at death across the paths that retire without running out of money, or None if
+         there are no such paths
+        """
+        successful_waste = self.waste[~np.isnan(self.waste)]
+        if len(successful_waste) == 0:
+            return None
+        return np.percentile(successful_waste, percentiles)
+
+    def get_lowest_income_percentiles(self, percentiles):
+        """
+        Percentiles, across the paths that retire, of the smallest fraction of the planned retirement income withdrawn in
+         any year (e.g. 0.8 if the worst year only paid out 80% of it), or None if no path retires
+        """
+        retired_lowest_income = self.lowest_income[~np.isnan(self.lowest_income)]
+        if len(retired_lowest_income) == 0:
+            return None
+        return np.percentile(retired_lowest_income, percentiles)
+
+class MonteCarloSimulation(PathOutcomes):
+    """
+    Simulates a retirement scenario over many randomly-drawn paths of market returns and inflation
+    """
+    def __init__(self,
+            current_retirement_savings,
+            annual_contribution,
+            annual_contribution_increase_rate,
+            pre_retirement_growth_rate,
+            post_retirement_growth_rate,
+            inflation_rate,
+            years_to_live,
+            desired_net_retirement_income_todays_dollars,
+            retirement_tax_rate,
+            num_paths,
+            manual_contrib_changes=None,
+            manual_net_worth_changes=None,
+            manual_retirement_income_changes=None,
+            return_volatility=0.15,
+            post_retirement_return_volatility=None,
+            inflation_volatility=0.01,
+            distribution=NORMAL_DISTRIBUTION,
+            historical_returns=None,
+            seed=None,
+            withdrawal_strategies=None):
+        """
+        Takes the same arguments as RetirementAgeCalculator, with the growth and inflation rates used as the means of
+        each year's draws, plus:
+
+        Args:
+            num_paths: number of paths to simulate
+            return_volatility: standard deviation of yearly pre-retirement returns, as double (0.XX)
+            post_retirement_return_volatility: standard deviation of yearly post-retirement returns, as double (0.XX);
+                defaults to return_volatility. Pre- and post-retirement returns share the same market shock each year.
+            inflation_volatility: standard deviation of yearly inflation, as double (0.XX)
+            distribution: 'normal' to draw yearly returns and inflation directly from a normal distribution, or 'lognormal'
+                to draw the yearly growth factors (1 + rate) from a lognormal distribution with the same mean and
+                standard deviation
+            historical_returns: if not None, a (returns, inflation) tuple as returned by load_historical_returns; each
+                year is then bootstrapped from a randomly-chosen historical year instead of drawn from the distribution.
+                Post-retirement returns are the historical returns shifted by the difference between the post- and
+                pre-retirement growth rates, to represent a more conservative allocation.
+            seed: seed for the random number generator, so runs can be reproduced
+            withdrawal_strategies: list of withdrawal_strategies.WithdrawalStrategy to compare over the same paths (default:
+                just FixedWithdrawals). This object's own outcomes are those of the first strategy; get_strategy_outcomes
+                has them all.
+        """
+        if num_paths < 1:
+            raise ValueError("Number of Monte Carlo paths must be >= 1")
+        if distribution not in DISTRIBUTIONS:
+            raise ValueError("Invalid distribution '%s'; must be one of %s" % (distribution, ", ".join(DISTRIBUTIONS)))
+        post_retirement_return_volatility = post_retirement_return_volatility if post_retirement_return_volatility is not None else return_volatility
+
+        plan = RetirementPlan(
+            current_retirement_savings,
+            annual_contribution,
+            annual_contribution_increase_rate,
+            pre_retirement_growth_rate,
+            post_retirement_growth_rate,
+            inflation_rate,
+            years_to_live,
+            desired_net_retirement_income_todays_dollars,
+            retirement_tax_rate,
+            manual_contrib_changes=manual_contrib_changes,
+            manual_net_worth_changes=manual_net_worth_changes,
+            manual_retirement_income_changes=manual_retirement_income_changes)
+        rng = np.random.default_rng(seed)
+
+        if historical_returns is not None:
+            historical_market_returns, historical_inflation = historical_returns
+            post_retirement_shift = post_retirement_growth_rate - pre_retirement_growth_rate
+            def next_year_rates(year):
+                historical_years = rng.integers(0, len(historical_market_returns), num_paths)
+                market_return = historical_market_returns[historical_years]
+                return market_return, market_return + post_retirement_shift, historical_inflation[historical_years]
+        elif distribution == NORMAL_DISTRIBUTION:
+            def next_year_rates(year):
+                market_shock = rng.standard_normal(num_paths)
+                inflation = inflation_rate + inflation_volatility * rng.standard_normal(num_paths)
+                return (pre_retirement_growth_rate + return_volatility * market_shock,
+                    post_retirement_growth_rate + post_retirement_return_volatility * market_shock,
+                    inflation)
+        else:
+            pre_mean, pre_stdev = _lognormal_params(pre_retirement_growth_rate, return_volatility)
+            post_mean, post_stdev = _lognormal_params(post_retirement_growth_rate, post_retirement_return_volatility)
+            inflation_mean, inflation_stdev = _lognormal_params(inflation_rate, inflation_volatility)
+            def next_year_rates(year):
+                market_shock = rng.standard_normal(num_paths)
+                inflation = np.expm1(inflation_mean + inflation_stdev * rng.standard_normal(num_paths))
+                return (np.expm1(pre_mean + pre_stdev * market_shock),
+                    np.expm1(post_mean + post_stdev * market_shock),
+                    inflation)
+
+        results = simulate_paths(plan, num_paths, next_year_rates, withdrawal_strategies)
+        super().__init__(*results[0])
+        self.strategy_outcomes = [PathOutcomes(*outcomes) for outcomes in results]
+
+    def get_strategy_outcomes(self):
+        """
+        Get a list with the PathOutcomes of each withdrawal strategy, in the order they were given
+        """
+        return self.strategy_outcomes
+
+def _lognormal_params(mean_rate, stdev):
+    """
+    Gets the (mu, sigma) of the normal distribution whose exponential has mean (1 + mean_rate) and the given standard deviation
+    """
+    sigma_squared = np.log1p((stdev / (1.0 + mean_rate)) ** 2)
+    return np.log1p(mean_rate) - sigma_squared / 2, np.sqrt(sigma_squared)
@@ -0,0 +1,129 @@
+import csv
+import math
+import multiprocessing
+
+from batch_runner import ERROR_KEY
+from retirement_age_calculator import ScenarioCache
+from scenario import SCENARIO_KEYS, YEARS_TO_RETIREMENT_KEY, WASTE_KEY, build_calculator
+
+SWEEP_COLUMNS = SCENARIO_KEYS + [YEARS_TO_RETIREMENT_KEY, WASTE_KEY, ERROR_KEY]
+
+def parse_axis(value_str, value_type):
+    """
+    Parses the values to sweep for one parameter, which may be a single value ("0.05"), a comma-separated list of values
+     ("0.04,0.05,0.06"), or an inclusive start:stop:step range ("100000:1000000:50000"), which ends at the last step that
+     doesn't go past stop
+    """
+    if ':' not in value_str:
+        return [value_type(elem) for elem in value_str.split(',')]
+
+    range_parts = value_str.split(':')
+    if len(range_parts) != 3:
+        raise ValueError("Invalid range '%s'; must be in the form start:stop:step" % value_str)
+    start, stop, step = [value_type(part) for part in range_parts]
+    if step <= 0 or stop < start:
+        raise ValueError("Invalid range '%s'; step must be positive and stop must be >= start" % value_str)
+    # Floor so the range never goes past stop, with a little slack so float ranges that land on stop (e.g. 0.1:0.3:0.1,
+    #  where the quotient comes out as 1.9999999999999998) still include it
+    num_values = int(math.floor((stop - start) / step + 1e-9)) + 1
+    # Rounding keeps float ranges from accumulating noise like 0.060000000000000005
+    return [value_type(round(start + i * step, 12)) for i in range(0, num_values)]
+
+# Set in each worker process by _init_worker, so they only get sent once rather than with every chunk
+_axes = None
+_changes = None
+_cache = None
+
+def _init_worker(axes, changes, cache_size):
+    global _axes, _changes, _cache
+    _axes = axes
+    _changes = changes
+    _cache = ScenarioCache(max_size=cache_size)
+
+def _evaluate_chunk(index_range):
+    """
+    Evaluates the grid points with flat indices in [start, stop), in the same order as itertools.product over the axes
+    """
+    start, stop = index_range
+    net_worth_changes, contrib_changes, retirement_income_changes = _changes
+    rows = []
+    for flat_index in range(start, stop):
+        # Decode the flat index into one index per axis, with the last axis varying fastest
+        values = [None] * len(_axes)
+        remainder = flat_index
+        for axis_idx in range(len(_axes) - 1, -1, -1):
+            remainder, value_idx = divmod(remainder, len(_axes[axis_idx]))
+            values[axis_idx] = _axes[axis_idx][value_idx]
+
+        # An invalid combination (e.g. a tax rate of 1) gets a row with its error rather than stopping the sweep
+        try:
+            calculator = build_calculator(dict(zip(SCENARIO_KEYS, values)), net_worth_changes, contrib_changes, retirement_income_changes, cache=_cache)
+        except (ValueError, ArithmeticError) as e:
+            rows.append(values + [None, None, str(e)])
+            continue
+        rows.append(values + [calculator.get_earliest_retirement(), calculator.get_waste(), None])
+    return rows
+
+def sweep(axes, net_worth_changes, contrib_changes, retirement_income_changes, workers=1, chunk_size=None, cache_size=1024):
+    """
+    Evaluates every combination of the given parameter values, yielding one row (matching SWEEP_COLUMNS, with None for
+     years to retirement and waste when the scenario can't retire, and an error message for invalid combinations) per
+     combination in itertools.product order
+
+    The grid is split into chunks of consecutive combinations which are spread across a pool of worker processes, and rows
+     are yielded as soon as their chunk is done so memory use doesn't grow with the size of the grid. Each worker keeps
+     its own ScenarioCache, so combinations that share e.g. retirement income settings reuse each other's work.
+
+    Args:
+        axes: list with the values to sweep for each scenario field, in SCENARIO_KEYS order
+        net_worth_changes, contrib_changes, retirement_income_changes: manual changes applied to every combination
+        workers: number of worker processes; 1 evaluates everything in this process
+        chunk_size: number of combinations per chunk (defaults to a size that gives each worker several chunks)
+        cache_size: max entries in each worker's ScenarioCache
+    """
+    num_points = 1
+    for axis in axes:
+        num_points = num_points * len(axis)
+    if chunk_size is None:
+        chunk_size = max(1, min(1000, num_points // (workers * 8)))
+    chunks = ((start, min(start + chunk_size, num_points)) for start in range(0, num_points, chunk_size))
+    initargs = (axes, (net_worth_changes, contrib_changes, retirement_income_changes), cache_size)
+
+    if workers == 1:
+        _init_worker(*initargs)
+        for chunk in chunks:
+            yield from _evaluate_chunk(chunk)
+        return
+
+    with multiprocessing.Pool(workers, initializer=_init_worker, initargs=initargs) as pool:
+        for rows in pool.imap(_evaluate_chunk, chunks):
+            yield from rows
+
+def write_csv(rows, output_file):
+    """
+    Streams sweep rows to the given file object as CSV, with a header row
+    """
+    writer = csv.writer(output_file)
+    writer.writerow(SWEEP_COLUMNS)
+    for row in rows:
+        writer.writerow(row)
+
+def write_parquet(rows, filepath, rows_per_group=100000):
+    """
+    Streams sweep rows to a Parquet file, one row group at a time (requires pyarrow)
+    """
+    import pyarrow
+    import pyarrow.parquet
+
+    schema = pyarrow.schema(
+        [(key, pyarrow.float64()) for key in SCENARIO_KEYS] +
+        [(YEARS_TO_RETIREMENT_KEY, pyarrow.int64()), (WASTE_KEY, pyarrow.float64()), (ERROR_KEY, pyarrow.string())])
+    with pyarrow.parquet.ParquetWriter(filepath, schema) as writer:
+        group = []
+        for row in rows:
+            group.append(row)
+            if len(group) == rows_per_group:
+                writer.write_table(pyarrow.Table.from_pylist([dict(zip(SWEEP_COLUMNS, row)) for row in group], schema=schema))
+                group = []
+        if group:
+            writer.write_table(pyarrow.Table.from_pylist([dict(zip(SWEEP_COLUMNS, row)) for row in group], schema=schema))
@@ -0,0 +1,72 @@
+import contextlib
+import sys
+import time
+
+class StageProfiler:
+    """
+    Records the wall time and net number of allocated memory blocks (from sys.getallocatedblocks) spent in each named
+     stage of a calculation, accumulating across repeated stages.
+
+    Stages are recorded either as laps, where each lap(name) call charges everything since the last start() or lap() to
+     that stage, or with the stage(name) context manager. Pass one as the profiler of a RetirementAgeCalculator to get a
+     breakdown of how long each of its functions took to build.
+    """
+    def __init__(self):
+        self.stages = {}
+        self.start()
+
+    def start(self):
+        """
+        Marks the start of the next stage
+        """
+        self.mark_time = time.perf_counter()
+        self.mark_blocks = sys.getallocatedblocks()
+
+    def lap(self, name):
+        """
+        Charges the time and allocations since the last start() or lap() to the given stage, and starts the next one
+        """
+        now = time.perf_counter()
+        blocks = sys.getallocatedblocks()
+        self.add(name, now - self.mark_time, blocks - self.mark_blocks)
+        self.mark_time = now
+        self.mark_blocks = blocks
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        Context manager charging everything inside it to the given stage
+        """
+        self.start()
+        try:
+            yield
+        finally:
+            self.lap(name)
+
+    def add(self, name, seconds, allocated_blocks):
+        """
+        Adds a measurement taken elsewhere (e.g. before the profiler existed) to the given stage
+        """
+        stage = self.stages.setdefault(name, {'seconds': 0.0, 'allocated_blocks': 0, 'calls': 0})
+        stage['seconds'] = stage['seconds'] + seconds
+        stage['allocated_blocks'] = stage['allocated_blocks'] + allocated_blocks
+        stage['calls'] = stage['calls'] + 1
+
+    def get_stages(self):
+        """
+        Get a dictionary of {stage name: {'seconds': X, 'allocated_blocks': Y, 'calls': Z}}, in the order the stages first ran
+        """
+        return self.stages
+
+    def format_report(self):
+        """
+        Get a plain-text table of the stages, with the share of the total time each took
+        """
+        total_seconds = sum(stage['seconds'] for stage in self.stages.values())
+        name_width = max([len('stage')] + [len(name) for name in self.stages])
+        lines = ["%-*s  %10s  %6s  %6s  %12s" % (name_width, 'stage', 'time (ms)', '%', 'calls', 'alloc blocks')]
+        for name, stage in self.stages.items():
+            share = 100.0 * stage['seconds'] / total_seconds if total_seconds > 0 else 0.0
+            lines.append("%-*s  %10.3f  %6.1f  %6s  %12s" % (name_width, name, stage['seconds'] * 1e3, share, stage['calls'], stage['allocated_blocks']))
+        lines.append("%-*s  %10.3f" % (name_width, 'total', total_seconds * 1e3))
+        return "\n".join(lines)
@@ -1,154 +1,481 @@
+from array import array
+import bisect
+import functools
+import itertools
+import math
+import operator
 from enum import Enum, auto
 
-# TODO TODO TODO TODO TODO TODO TODO TODO TODO TODO TODO TODO TODO 
-# This whole class models data as arrays, but
-#  it could (and probably should) be modeled as mathematical functions
-# TODO TODO TODO TODO TODO TODO TODO TODO TODO TODO TODO TODO TODO 
+# Every function below is indexed by period in [0, num_periods), where num_periods = years_to_live * periods_per_year. With
+#  the default of one period per year a period is just a year (which is what the comments assume); with e.g. 12 periods per
+#  year, amounts are per month and rates are compounded monthly so that they still add up to the given annual rates.
+
+def _check_year(years_in_future, num_periods):
+    if years_in_future < 0 or years_in_future >= num_periods:
+        raise IndexError("Year '%s' is out of range [0,%s)" % (years_in_future, num_periods))
+
+def _period_rate(annual_rate, periods_per_year):
+    """
+    Converts an annual rate into the per-period rate that compounds to it over a year
+    """
+    if periods_per_year == 1:
+        return annual_rate
+    if annual_rate <= -1:
+        raise ValueError("Invalid rate '%s'; must be > -1 when there's more than one period per year" % annual_rate)
+    return math.expm1(math.log1p(annual_rate) / periods_per_year)
+
+def _geometric_sum(ratio_minus_one, num_terms):
+    """
+    Sum of (1 + ratio_minus_one) ** k for k in [0, num_terms), computed without cancellation error when the ratio is close to 1
+    """
+    if ratio_minus_one == 0:
+        return num_terms
+    if ratio_minus_one <= -1:
+        # log1p is undefined for a ratio <= 0, but then the ratio is nowhere near 1 so there's no cancellation to avoid
+        return ((1 + ratio_minus_one) ** num_terms - 1) / ratio_minus_one
+    return math.expm1(num_terms * math.log1p(ratio_minus_one)) / ratio_minus_one
+
+def _geometric_series(first, ratio, num_terms):
+    """
+    Iterator over first * ratio ** k for k in [0, num_terms), computed with a running product (in C, via accumulate) rather
+     than a power per term
+    """
+    return itertools.islice(itertools.accumulate(itertools.repeat(ratio), operator.mul, initial=first), num_terms)
+
+def _read_only(values):
+    """
+    Wraps an array('d') in a read-only memoryview, so callers can index it and hand it to anything that takes a buffer
+     (e.g. numpy.asarray) without copying, but can't modify the series a function (possibly shared via a ScenarioCache) holds
+    """
+    return memoryview(values).toreadonly()
+
+def _materialize(function):
+    """
+    Fills the array('d') a piecewise function's data() returns, using the function's _fill_data, which builds each
+     closed-form segment with running products and sums straight into the array rather than calling apply() per period.
+     The functions never change once built, so this only happens once per function.
+    """
+    if function._data is None:
+        function._data = function._fill_data()
+    return _read_only(function._data)
 
 class ContributionFunction:
     """
     Function that returns the yearly contribution amount for any given year in the [0, years_to_live),
      taking into account contrib increases and changes.
     """
-    def __init__(self, years_to_live, manual_contrib_changes, initial_contrib_amount, initial_contrib_rate):
-        self.contribs = []
-        current_base_contrib = initial_contrib_amount
-        current_contrib_rate = initial_contrib_rate
-        years_since_last_change = 0
-        for i in range(0, years_to_live):
-            if i in manual_contrib_changes:
-                current_base_contrib, current_contrib_rate = manual_contrib_changes[i]
-                years_since_last_change = 0
-            self.contribs.append(current_base_contrib * (1 + current_contrib_rate) ** years_since_last_change)
-            years_since_last_change = years_since_last_change + 1
+    __slots__ = ('years_to_live', 'num_periods', 'segment_starts', 'segments', '_data')
+
+    def __init__(self, years_to_live, manual_contrib_changes, initial_contrib_amount, initial_contrib_rate, periods_per_year=1):
+        # Between changes, contributions are a geometric series: base_contrib * (1 + contrib_rate) ** years_since_last_change
+        self.years_to_live = years_to_live
+        self.num_periods = years_to_live * periods_per_year
+        changes = dict(manual_contrib_changes)
+        changes.setdefault(0, (initial_contrib_amount, initial_contrib_rate))
+        self.segment_starts = sorted(changes.keys())
+        # Each period contributes its share of the annual amount, growing at the per-period equivalent of the annual rate
+        self.segments = []
+        for start in self.segment_starts:
+            annual_contrib, annual_contrib_rate = changes[start]
+            self.segments.append((annual_contrib / periods_per_year, _period_rate(annual_contrib_rate, periods_per_year)))
+        self._data = None
 
     def apply(self, years_in_future):
-        return self.contribs[years_in_future]
+        _check_year(years_in_future, self.num_periods)
+        segment_idx = bisect.bisect_right(self.segment_starts, years_in_future) - 1
+        base_contrib, contrib_rate = self.segments[segment_idx]
+        return base_contrib * (1 + contrib_rate) ** (years_in_future - self.segment_starts[segment_idx])
+
+    def _fill_data(self):
+        values = array('d')
+        segment_ends = self.segment_starts[1:] + [self.num_periods]
+        for segment_start, segment_end, (base_contrib, contrib_rate) in zip(self.segment_starts, segment_ends, self.segments):
+            # Changes every year are common enough that single-year segments skip setting up the iterators
+            if segment_end - segment_start == 1:
+                values.append(base_contrib)
+                continue
+            values.extend(_geometric_series(base_contrib, 1 + contrib_rate, segment_end - segment_start))
+        return values
 
     def data(self):
-        return self.contribs.copy()
+        return _materialize(self)
 
 class NoRetirementNetWorthFunction:
     """
     Function that returns net worth for a given year in range [0, years_to_live), accounting for net worth and
      contribution changes.
     """
-    def __init__(self, years_to_live, manual_net_worth_changes, current_retirement_savings, pre_retirement_growth_rate, contribution_function):
-        # TODO make this a nice math formula
+    __slots__ = ('years_to_live', 'num_periods', 'manual_net_worth_changes', 'pre_retirement_growth_rate', 'period_growth_rate',
+        'contribution_function', 'net_worth', 'segment_starts', 'net_worth_at_segment_starts', '_data')
+
+    def __init__(self, years_to_live, manual_net_worth_changes, current_retirement_savings, pre_retirement_growth_rate, contribution_function, periods_per_year=1):
         # We assume:
         # 1. This money is withdrawn at the start of the year, with the 0th entry being how much you'd need if you were to retire RIGHT NOW
         # 2. The amount you'd withdraw to last you this year doesn't have inflation applied (it will only increase the amount of next year)
         # E.g. if I have 2 years to live, this array will look like [gross_retirement_income, gross_retirement_income * (1 + inflation)]
-        self.net_worth = []
-        for i in range(0, years_to_live):
-            value_to_append = None
-            if i == 0:
-                value_to_append = current_retirement_savings
-            else:
-                # Growth from your balance, and then add your annual contribution afterwards (this is conservative)
-                value_to_append = self.net_worth[i-1] * (1 + pre_retirement_growth_rate) + contribution_function.apply(i-1)
-            value_with_net_worth_change = max(0, value_to_append + manual_net_worth_changes.get(i, 0))
-            self.net_worth.append(value_with_net_worth_change)
+        self.years_to_live = years_to_live
+        self.num_periods = years_to_live * periods_per_year
+        self.manual_net_worth_changes = manual_net_worth_changes
+        self.pre_retirement_growth_rate = pre_retirement_growth_rate
+        self.period_growth_rate = _period_rate(pre_retirement_growth_rate, periods_per_year)
+        self.contribution_function = contribution_function
+        self._data = None
+
+        # Net worth can only hit the 0 floor mid-segment if contributions or growth are negative, in which case we fall back to
+        #  computing every year
+        self.net_worth = None
+        if self.period_growth_rate <= -1 or any(base_contrib < 0 or contrib_rate <= -1 for base_contrib, contrib_rate in contribution_function.segments):
+            self.net_worth = array('d')
+            for i in range(0, self.num_periods):
+                value_to_append = None
+                if i == 0:
+                    value_to_append = current_retirement_savings
+                else:
+                    # Growth from your balance, and then add your annual contribution afterwards (this is conservative)
+                    value_to_append = self.net_worth[i-1] * (1 + self.period_growth_rate) + contribution_function.apply(i-1)
+                value_with_net_worth_change = max(0, value_to_append + manual_net_worth_changes.get(i, 0))
+                self.net_worth.append(value_with_net_worth_change)
+            return
+
+        # Otherwise, between net worth and contribution changes net worth is the growth of the balance at the start of the
+        #  segment plus the growth of each contribution since then, which is a geometric series
+        self.segment_starts = sorted(set(contribution_function.segment_starts) | set(manual_net_worth_changes.keys()))
+        self.net_worth_at_segment_starts = [max(0, current_retirement_savings + manual_net_worth_changes.get(0, 0))]
+        for segment_idx in range(1, len(self.segment_starts)):
+            segment_start = self.segment_starts[segment_idx]
+            value_before_change = self._apply_in_segment(segment_idx - 1, segment_start)
+            self.net_worth_at_segment_starts.append(max(0, value_before_change + manual_net_worth_changes.get(segment_start, 0)))
+
+    def _apply_in_segment(self, segment_idx, years_in_future):
+        segment_start = self.segment_starts[segment_idx]
+        years_since_segment_start = years_in_future - segment_start
+        value = self.net_worth_at_segment_starts[segment_idx]
+        if years_since_segment_start == 0:
+            return value
+
+        contrib_segment_idx = bisect.bisect_right(self.contribution_function.segment_starts, segment_start) - 1
+        _, contrib_rate = self.contribution_function.segments[contrib_segment_idx]
+        growth = 1 + self.period_growth_rate
+        # Growth from your balance, and then add each annual contribution after that year's growth (this is conservative)
+        contributions_value = self.contribution_function.apply(segment_start) * growth ** (years_since_segment_start - 1) * _geometric_sum(
+            (contrib_rate - self.period_growth_rate) / growth,
+            years_since_segment_start)
+        return value * growth ** years_since_segment_start + contributions_value
 
     def apply(self, years_in_future):
-        return self.net_worth[years_in_future]
+        if self.net_worth is not None:
+            return self.net_worth[years_in_future]
+        _check_year(years_in_future, self.num_periods)
+        return self._apply_in_segment(bisect.bisect_right(self.segment_starts, years_in_future) - 1, years_in_future)
+
+    def _fill_data(self):
+        # k years into a segment, net worth is growth ** k * (value + contribution / growth * (the sum of the first k terms
+        #  of the geometric series with ratio (1 + contrib_rate) / growth)), which is _apply_in_segment rearranged
+        values = array('d')
+        growth = 1 + self.period_growth_rate
+        segment_ends = self.segment_starts[1:] + [self.num_periods]
+        for segment_idx, (segment_start, segment_end) in enumerate(zip(self.segment_starts, segment_ends)):
+            num_periods = segment_end - segment_start
+            if num_periods == 1:
+                values.append(self.net_worth_at_segment_starts[segment_idx])
+                continue
+            contrib_segment_idx = bisect.bisect_right(self.contribution_function.segment_starts, segment_start) - 1
+            _, contrib_rate = self.contribution_function.segments[contrib_segment_idx]
+            discounted_contributions = _geometric_series(self.contribution_function.apply(segment_start) / growth, (1 + contrib_rate) / growth, num_periods - 1)
+            values.extend(map(
+                operator.mul,
+                itertools.accumulate(discounted_contributions, initial=self.net_worth_at_segment_starts[segment_idx]),
+                _geometric_series(1.0, growth, num_periods)))
+        return values
 
     def data(self):
-        return self.net_worth.copy()
+        if self.net_worth is not None:
+            return _read_only(self.net_worth)
+        return _materialize(self)
 
 class RetirementWithdrawalsFunction:
     """
     Describes, for each year in [0, years_to_live), the inflation-adjusted absolute withdrawal amount required to meet the desired net retirement income in today's dollars
     """
-    def __init__(self, years_to_live, net_retirement_income_todays_dollars, retirement_tax_rate, inflation_rate, manual_retirement_income_changes):
-        net_income = net_retirement_income_todays_dollars
-        self.withdrawals = []
-        for i in range(0, years_to_live):
-            if i in manual_retirement_income_changes:
-                net_income = manual_retirement_income_changes[i]
-            gross_income = net_income / (1.0 - retirement_tax_rate)
-            # We subract one year from the exponentiation because inflation will only kick in one year from today
-            self.withdrawals.append(gross_income * (1.0 + inflation_rate) ** i)
+    __slots__ = ('years_to_live', 'num_periods', 'inflation_rate', 'period_inflation_rate', 'segment_starts', 'gross_incomes', '_data')
+
+    def __init__(self, years_to_live, net_retirement_income_todays_dollars, retirement_tax_rate, inflation_rate, manual_retirement_income_changes, periods_per_year=1):
+        # Between changes, withdrawals are a geometric series: gross_income * (1 + inflation_rate) ** years_in_future
+        self.years_to_live = years_to_live
+        self.num_periods = years_to_live * periods_per_year
+        self.inflation_rate = inflation_rate
+        self.period_inflation_rate = _period_rate(inflation_rate, periods_per_year)
+        net_incomes = dict(manual_retirement_income_changes)
+        net_incomes.setdefault(0, net_retirement_income_todays_dollars)
+        self.segment_starts = sorted(net_incomes.keys())
+        # Each period withdraws its share of the annual income
+        self.gross_incomes = [net_incomes[start] / (1.0 - retirement_tax_rate) / periods_per_year for start in self.segment_starts]
+        self._data = None
 
     def apply(self, years_in_future):
-        return self.withdrawals[years_in_future]
+        _check_year(years_in_future, self.num_periods)
+        gross_income = self.gross_incomes[bisect.bisect_right(self.segment_starts, years_in_future) - 1]
+        # We subract one year from the exponentiation because inflation will only kick in one year from today
+        return gross_income * (1.0 + self.period_inflation_rate) ** years_in_future
+
+    def _fill_data(self):
+        values = array('d')
+        inflation = 1.0 + self.period_inflation_rate
+        segment_ends = self.segment_starts[1:] + [self.num_periods]
+        for segment_start, segment_end, gross_income in zip(self.segment_starts, segment_ends, self.gross_incomes):
+            if segment_end - segment_start == 1:
+                values.append(gross_income * inflation ** segment_start)
+                continue
+            values.extend(_geometric_series(gross_income * inflation ** segment_start, inflation, segment_end - segment_start))
+        return values
 
     def data(self):
-        return self.withdrawals.copy()
+        return _materialize(self)
 
 class RetirementMinWorthFunction:
     """
     Function to describe the minimum worth needed at every year in [0,years_to_live) to not run out of money before dying
     """
-    def __init__(self, years_to_live, withdrawal_function, post_retirement_growth_rate):
-        # This is a super stupid, but super clear, way to do this
-        min_worth_for_last_x_year = []
-        for i in range(0, years_to_live):
-            withdrawal = withdrawal_function.apply((years_to_live - 1) - i)
-            value_to_append = None
-            if i == 0:
-                value_to_append = withdrawal
-            else:
-                # Our bank account can be a little lower because we'll get in-year growth
-                remaining_balance_needed = min_worth_for_last_x_year[i - 1] / (1 + post_retirement_growth_rate)
-                value_to_append = withdrawal + remaining_balance_needed
-            min_worth_for_last_x_year.append(value_to_append)
+    __slots__ = ('years_to_live', 'num_periods', 'withdrawal_function', 'post_retirement_growth_rate', 'period_growth_rate',
+        'discounted_inflation_rate', 'segment_ends', 'min_worth_at_segment_ends', '_data')
+
+    def __init__(self, years_to_live, withdrawal_function, post_retirement_growth_rate, periods_per_year=1):
+        # The min worth at year i is the present value of every withdrawal from year i onwards, discounted by post-retirement
+        #  growth (because our bank account can be a little lower thanks to in-year growth). Within a withdrawal segment
+        #  ending at year `end` this is a geometric series plus the discounted min worth at `end`:
+        #    min_worth(i) = gross_income * (1 + inflation) ** i * sum((1 + x) ** k for k in [0, end - i)) + min_worth(end) / (1 + growth) ** (end - i)
+        #  where 1 + x = (1 + inflation) / (1 + growth)
+        self.years_to_live = years_to_live
+        self.num_periods = years_to_live * periods_per_year
+        self.withdrawal_function = withdrawal_function
+        self.post_retirement_growth_rate = post_retirement_growth_rate
+        self.period_growth_rate = _period_rate(post_retirement_growth_rate, periods_per_year)
+        self.discounted_inflation_rate = (withdrawal_function.period_inflation_rate - self.period_growth_rate) / (1 + self.period_growth_rate)
+        self.segment_ends = withdrawal_function.segment_starts[1:] + [self.num_periods]
+        self._data = None
 
-        # Necessary to reverse so this makes sense
-        self.min_worth = list(reversed(min_worth_for_last_x_year))
+        # Min worth at the end of each segment, filled in backwards from the last segment (whose end is after we die)
+        self.min_worth_at_segment_ends = [0.0] * len(self.segment_ends)
+        for segment_idx in range(len(self.segment_ends) - 1, 0, -1):
+            self.min_worth_at_segment_ends[segment_idx - 1] = self._apply_in_segment(segment_idx, withdrawal_function.segment_starts[segment_idx])
+
+    def _apply_in_segment(self, segment_idx, years_in_future):
+        years_to_segment_end = self.segment_ends[segment_idx] - years_in_future
+        withdrawal = self.withdrawal_function.gross_incomes[segment_idx] * (1.0 + self.withdrawal_function.period_inflation_rate) ** years_in_future
+        remaining_withdrawals = withdrawal * _geometric_sum(self.discounted_inflation_rate, years_to_segment_end)
+        remaining_balance_needed = self.min_worth_at_segment_ends[segment_idx] / (1 + self.period_growth_rate) ** years_to_segment_end
+        return remaining_withdrawals + remaining_balance_needed
 
     def apply(self, years_in_future):
-        return self.min_worth[years_in_future]
+        _check_year(years_in_future, self.num_periods)
+        return self._apply_in_segment(bisect.bisect_right(self.withdrawal_function.segment_starts, years_in_future) - 1, years_in_future)
+
+    def _fill_data(self):
+        # Fills the series backwards, since with j years left in a segment the min worth is that year's withdrawal times
+        #  the sum of the first j terms of the geometric series with ratio 1 + x, plus min_worth(end) / growth ** j
+        withdrawals = self.withdrawal_function.data()
+        growth = 1 + self.period_growth_rate
+        values = array('d')
+        for segment_idx in range(len(self.segment_ends) - 1, -1, -1):
+            segment_start = self.withdrawal_function.segment_starts[segment_idx]
+            num_terms = self.segment_ends[segment_idx] - segment_start
+            min_worth_at_segment_end = self.min_worth_at_segment_ends[segment_idx]
+            if num_terms == 1:
+                values.append(withdrawals[segment_start] + min_worth_at_segment_end / growth)
+                continue
+            remaining_withdrawals = map(
+                operator.mul,
+                reversed(withdrawals[segment_start:self.segment_ends[segment_idx]]),
+                itertools.accumulate(_geometric_series(1.0, 1 + self.discounted_inflation_rate, num_terms)))
+            if min_worth_at_segment_end == 0:
+                values.extend(remaining_withdrawals)
+            else:
+                values.extend(map(operator.add, remaining_withdrawals, _geometric_series(min_worth_at_segment_end / growth, 1 / growth, num_terms)))
+        values.reverse()
+        return values
 
     def data(self):
-        return self.min_worth.copy()
+        return _materialize(self)
+
+def _has_well_behaved_min_worth(min_worth_function):
+    """
+    Whether withdrawals are never negative and post-retirement growth is > -1, in which case the min worth is never
+     negative and goes from one year to the next by subtracting that year's withdrawal and then growing
+    """
+    withdrawal_function = min_worth_function.withdrawal_function
+    return (
+        min_worth_function.period_growth_rate > -1
+        and all(gross_income >= 0 for gross_income in withdrawal_function.gross_incomes)
+        and withdrawal_function.period_inflation_rate > -1)
 
 class AccountValueFunction:
     """
     Function representing the actual account value over time, with
      retirement factored in.
     """
-    def __init__(self, years_to_live, retirement, no_retirement_func, post_retirement_growth_rate, withdrawal_func):
+    __slots__ = ('num_periods', 'retirement', 'no_retirement_func', 'min_worth_func', 'surplus', 'account_value', '_data')
+
+    def __init__(self, retirement, no_retirement_func, min_worth_func):
+        self.num_periods = no_retirement_func.num_periods
+        self.retirement = retirement
+        self.no_retirement_func = no_retirement_func
+        self.min_worth_func = min_worth_func
         self.account_value = None
-        if retirement is not None:
-            # Because we're a little cautious in that we'll only say you can retire when your bank account is >= the amount you'd need for the rest of your life, re-calculate to get exact values of your bank account after you retire
-            self.account_value = []
-            for i in range(0, years_to_live):
-                if i <= retirement:
-                    value_to_append = no_retirement_func.apply(i)
-                # After first retirement year
-                else:
-                    # To be conservative, we assume you take out your retirement income at the start of the year (i.e. no market growth on it)
-                    last_year_value = self.account_value[i - 1]
-                    last_year_withdrawal = withdrawal_func.apply(i - 1)
-                    value_to_append = max(
-                        0,
-                        (last_year_value - last_year_withdrawal) * (1 + post_retirement_growth_rate)
-                    )
-                self.account_value.append(value_to_append)
+        self._data = None
+        if retirement is None:
+            return
+
+        # Because we're a little cautious in that we'll only say you can retire when your bank account is >= the amount you'd
+        #  need for the rest of your life, you retire with a surplus over the min worth. After retiring, the account value
+        #  and the min worth both lose the same withdrawal each year and then grow at the same rate, so the surplus just grows.
+        self.surplus = no_retirement_func.apply(retirement) - min_worth_func.apply(retirement)
+        if _has_well_behaved_min_worth(min_worth_func):
+            return
+
+        # Otherwise the account can hit the 0 floor, so fall back to computing every year
+        withdrawal_func = min_worth_func.withdrawal_function
+        self.account_value = array('d')
+        for i in range(0, self.num_periods):
+            if i <= retirement:
+                value_to_append = no_retirement_func.apply(i)
+            # After first retirement year
+            else:
+                # To be conservative, we assume you take out your retirement income at the start of the year (i.e. no market growth on it)
+                last_year_value = self.account_value[i - 1]
+                last_year_withdrawal = withdrawal_func.apply(i - 1)
+                value_to_append = max(
+                    0,
+                    (last_year_value - last_year_withdrawal) * (1 + min_worth_func.period_growth_rate)
+                )
+            self.account_value.append(value_to_append)
 
     def apply(self, years_in_future):
-        return self.account_value[years_in_future]
+        """
+        Account value at the given year, or None if you never get to retire
+        """
+        if self.retirement is None:
+            return None
+        if self.account_value is not None:
+            return self.account_value[years_in_future]
+        if years_in_future <= self.retirement:
+            return self.no_retirement_func.apply(years_in_future)
+        years_retired = years_in_future - self.retirement
+        return self.min_worth_func.apply(years_in_future) + self.surplus * (1 + self.min_worth_func.period_growth_rate) ** years_retired
+
+    def _fill_data(self):
+        values = array('d')
+        values.frombytes(self.no_retirement_func.data()[:self.retirement + 1].cast('B'))
+        growth = 1 + self.min_worth_func.period_growth_rate
+        years_retired = self.num_periods - 1 - self.retirement
+        values.extend(map(operator.add, self.min_worth_func.data()[self.retirement + 1:], _geometric_series(self.surplus * growth, growth, years_retired)))
+        return values
 
     def data(self):
-        return self.account_value.copy()
+        """
+        Read-only view of the account value each year, or None if you never get to retire
+        """
+        if self.retirement is None:
+            return None
+        if self.account_value is not None:
+            return _read_only(self.account_value)
+        return _materialize(self)
 
 class ActualWithdrawalsFunction:
-    def __init__(self, years_to_live, retirement, withdrawals_func):
-        self.withdrawals = None
-        if retirement is not None:
-            self.withdrawals = []
-            for i in range(0, years_to_live):
-                value_to_append = 0 if i < retirement else withdrawals_func.apply(i)
-                self.withdrawals.append(value_to_append)
+    __slots__ = ('num_periods', 'retirement', 'withdrawals_func', '_data')
+
+    def __init__(self, retirement, withdrawals_func):
+        self.num_periods = withdrawals_func.num_periods
+        self.retirement = retirement
+        self.withdrawals_func = withdrawals_func
+        self._data = None
 
     def apply(self, years_in_future):
-        return self.withdrawals[years_in_future]
+        """
+        Withdrawal actually taken at the given year, or None if you never get to retire
+        """
+        if self.retirement is None:
+            return None
+        return 0.0 if years_in_future < self.retirement else self.withdrawals_func.apply(years_in_future)
+
+    def _fill_data(self):
+        values = array('d', [0.0]) * self.retirement
+        values.frombytes(self.withdrawals_func.data()[self.retirement:].cast('B'))
+        return values
 
     def data(self):
-        return self.withdrawals.copy()
+        """
+        Read-only view of the withdrawal actually taken each year, or None if you never get to retire
+        """
+        if self.retirement is None:
+            return None
+        return _materialize(self)
 
 
+def find_earliest_retirement(no_retirement_function, min_worth_function):
+    """
+    Finds the first year where net worth (if you never retired) reaches the min worth needed to retire.
+
+    If you're able to retire in year i, you're also able to retire in year i + 1 so long as pre-retirement growth is at
+     least post-retirement growth, contributions and withdrawals are non-negative, and there's no negative net worth
+     change at year i + 1 (the extra year of contributions and growth on your balance more than covers the year of
+     withdrawals). When this holds, we bisect each stretch of years between negative net worth changes; otherwise we fall
+     back to checking every year.
+
+    Returns:
+        (years to retirement or None if not possible, number of years evaluated)
+    """
+    num_periods = no_retirement_function.num_periods
+    evaluations = 0
+    def can_retire(years_in_future):
+        nonlocal evaluations
+        evaluations = evaluations + 1
+        return no_retirement_function.apply(years_in_future) >= min_worth_function.apply(years_in_future)
+
+    is_monotonic = (
+        no_retirement_function.period_growth_rate >= min_worth_function.period_growth_rate
+        and _has_well_behaved_min_worth(min_worth_function)
+        and all(base_contrib >= 0 and contrib_rate > -1 for base_contrib, contrib_rate in no_retirement_function.contribution_function.segments))
+    if not is_monotonic:
+        for i in range(0, num_periods):
+            if can_retire(i):
+                return i, evaluations
+        return None, evaluations
+
+    stretch_starts = [0] + sorted(year for year, change in no_retirement_function.manual_net_worth_changes.items() if change < 0 and year > 0)
+    stretch_ends = stretch_starts[1:] + [num_periods]
+    for stretch_start, stretch_end in zip(stretch_starts, stretch_ends):
+        if not can_retire(stretch_end - 1):
+            continue
+        # Bisect for the first year we can retire in [low, high], knowing we can retire in year high
+        low = stretch_start
+        high = stretch_end - 1
+        while low < high:
+            middle = (low + high) // 2
+            if can_retire(middle):
+                high = middle
+            else:
+                low = middle + 1
+        return high, evaluations
+    return None, evaluations
+
+def compute_waste(years_to_retirement, no_retirement_function, min_worth_function):
+    """
+    Computes the waste (dollars you'd die with) without building the account value series, or None if you never retire.
+
+    Once retired, both the account value and the min worth lose the same withdrawal each year and then grow at the same
+     post-retirement rate, so the surplus you retire with just grows at that rate until you die. That only holds while the
+     account can't hit the 0 floor, so otherwise this falls back to AccountValueFunction, as RetirementAgeCalculator does.
+    """
+    if years_to_retirement is None:
+        return None
+    last_year = no_retirement_function.num_periods - 1
+    if not _has_well_behaved_min_worth(min_worth_function):
+        account_value_function = AccountValueFunction(years_to_retirement, no_retirement_function, min_worth_function)
+        return account_value_function.apply(last_year) - min_worth_function.withdrawal_function.apply(last_year)
+    surplus = no_retirement_function.apply(years_to_retirement) - min_worth_function.apply(years_to_retirement)
+    years_retired = last_year - years_to_retirement
+    return surplus * (1 + min_worth_function.period_growth_rate) ** years_retired
+
 class Series(Enum):
     # Represents hypothetical withdrwaw
     ALL_WITHDRAWALS = auto()
@@ -162,6 +489,167 @@ class Series(Enum):
     # Represents the actual withdrawals, with pre-retirement withdrawals at 0
     ACTUAL_WITHDRAWALS = auto()
 
+def _build_series_block(get_series_data, num_periods):
+    """
+    Copies every series into one contiguous read-only (series x year) memoryview of doubles, with a row per Series in
+     definition order and NaN rows for series that don't exist (because you never get to retire)
+    """
+    block = array('d')
+    for series in Series:
+        series_data = get_series_data(series)
+        if series_data is None:
+            block.extend(array('d', [math.nan]) * num_periods)
+        else:
+            block.frombytes(series_data.cast('B'))
+    return _read_only(block).cast('B').cast('d', (len(Series), num_periods))
+
+def validate_manual_changes(years_to_live, manual_contrib_changes, manual_net_worth_changes, manual_retirement_income_changes, periods_per_year=1):
+    """
+    Raises a ValueError if years_to_live or periods_per_year is invalid or any of the manual change dictionaries contains a
+     period outside [0, years_to_live * periods_per_year)
+    """
+    if periods_per_year < 1:
+        raise ValueError("Periods per year must be >= 1")
+    num_periods = years_to_live * periods_per_year
+    for years_out in manual_contrib_changes.keys():
+        if years_out < 0 or years_out >= num_periods:
+            raise ValueError("Invalid contrib change year '%s'; must be in range [0,%s)" % (years_out, num_periods))
+    for years_out in manual_net_worth_changes.keys():
+        if years_out < 0 or years_out >= num_periods:
+            raise ValueError("Invalid net worth change year '%s'; must be in range [0,%s)" % (years_out, num_periods))
+    for years_out in manual_retirement_income_changes.keys():
+        if years_out < 0 or years_out >= num_periods:
+            raise ValueError("Invalid retirement income change year '%s'; must be in range [0,%s)" % (years_out, num_periods))
+    if years_to_live < 1:
+        raise ValueError("Years to live must be >= 1")
+
+def _canonical_number(value):
+    # So that e.g. 5, 5.0, and -0.0 vs 0.0 hit the same cache entry
+    return float(value) + 0.0
+
+def _canonical_changes(manual_changes):
+    """
+    Converts a manual change dictionary into a hashable, order-independent key
+    """
+    canonical_changes = []
+    for years_out, change in manual_changes.items():
+        if isinstance(change, tuple):
+            change = tuple(_canonical_number(elem) for elem in change)
+        else:
+            change = _canonical_number(change)
+        canonical_changes.append((int(years_out), change))
+    return tuple(sorted(canonical_changes))
+
+class ScenarioCache:
+    """
+    Memoizes the functions RetirementAgeCalculator is built from, keyed on the (normalized) inputs each one depends on, so
+     that scenarios sharing inputs share work. E.g. a sweep that only varies savings rebuilds just the net worth function,
+     reusing the withdrawal, min worth, and contribution functions.
+
+    Each function type gets its own LRU cache holding up to max_size entries. The cached functions are shared between
+     calculators, so they must never be mutated.
+    """
+    def __init__(self, max_size=1024):
+        self._withdrawals_cache = functools.lru_cache(maxsize=max_size)(self._build_withdrawals_function)
+        self._min_worth_cache = functools.lru_cache(maxsize=max_size)(self._build_min_worth_function)
+        self._contribution_cache = functools.lru_cache(maxsize=max_size)(self._build_contribution_function)
+        self._no_retirement_cache = functools.lru_cache(maxsize=max_size)(self._build_no_retirement_function)
+        # (hits, misses) of the lookups the cache makes itself when building min worth and net worth functions, which
+        #  get_stats reports separately from callers' lookups
+        self._internal_lookups = {}
+
+    def get_withdrawals_function(self, years_to_live, net_retirement_income_todays_dollars, retirement_tax_rate, inflation_rate, manual_retirement_income_changes, periods_per_year=1):
+        return self._withdrawals_cache(*self._withdrawals_key(years_to_live, net_retirement_income_todays_dollars, retirement_tax_rate, inflation_rate, manual_retirement_income_changes, periods_per_year))
+
+    def get_min_worth_function(self, years_to_live, net_retirement_income_todays_dollars, retirement_tax_rate, inflation_rate, manual_retirement_income_changes, post_retirement_growth_rate, periods_per_year=1):
+        withdrawals_key = self._withdrawals_key(years_to_live, net_retirement_income_todays_dollars, retirement_tax_rate, inflation_rate, manual_retirement_income_changes, periods_per_year)
+        return self._min_worth_cache(withdrawals_key, _canonical_number(post_retirement_growth_rate))
+
+    def get_contribution_function(self, years_to_live, manual_contrib_changes, initial_contrib_amount, initial_contrib_rate, periods_per_year=1):
+        return self._contribution_cache(*self._contribution_key(years_to_live, manual_contrib_changes, initial_contrib_amount, initial_contrib_rate, periods_per_year))
+
+    def get_no_retirement_function(self, years_to_live, manual_net_worth_changes, current_retirement_savings, pre_retirement_growth_rate, manual_contrib_changes, initial_contrib_amount, initial_contrib_rate, periods_per_year=1):
+        return self._no_retirement_cache(
+            _canonical_changes(manual_net_worth_changes),
+            _canonical_number(current_retirement_savings),
+            _canonical_number(pre_retirement_growth_rate),
+            self._contribution_key(years_to_live, manual_contrib_changes, initial_contrib_amount, initial_contrib_rate, periods_per_year))
+
+    def get_stats(self):
+        """
+        Get a dictionary of {function type: {'hits': X, 'misses': Y, 'internal_hits': X', 'internal_misses': Y', 'size': Z}}
+         describing how well each cache is doing, where hits and misses count callers' lookups and internal_hits and
+         internal_misses count the lookups of withdrawal and contribution functions the cache makes itself while building
+         min worth and net worth functions
+        """
+        stats = {}
+        for name, cache in (
+                ('withdrawals', self._withdrawals_cache),
+                ('min_worth', self._min_worth_cache),
+                ('contributions', self._contribution_cache),
+                ('no_retirement', self._no_retirement_cache)):
+            info = cache.cache_info()
+            internal_hits, internal_misses = self._internal_lookups.get(name, (0, 0))
+            stats[name] = {
+                'hits': info.hits - internal_hits,
+                'misses': info.misses - internal_misses,
+                'internal_hits': internal_hits,
+                'internal_misses': internal_misses,
+                'size': info.currsize,
+            }
+        return stats
+
+    def clear(self):
+        for cache in (self._withdrawals_cache, self._min_worth_cache, self._contribution_cache, self._no_retirement_cache):
+            cache.cache_clear()
+        self._internal_lookups = {}
+
+    def _internal_lookup(self, name, cache, key):
+        """
+        Looks up a function the cache needs to build another one, recording the hit or miss as internal
+        """
+        misses_before = cache.cache_info().misses
+        function = cache(*key)
+        internal_hits, internal_misses = self._internal_lookups.get(name, (0, 0))
+        if cache.cache_info().misses > misses_before:
+            self._internal_lookups[name] = (internal_hits, internal_misses + 1)
+        else:
+            self._internal_lookups[name] = (internal_hits + 1, internal_misses)
+        return function
+
+    @staticmethod
+    def _withdrawals_key(years_to_live, net_retirement_income_todays_dollars, retirement_tax_rate, inflation_rate, manual_retirement_income_changes, periods_per_year):
+        return (
+            int(years_to_live),
+            int(periods_per_year),
+            _canonical_number(net_retirement_income_todays_dollars),
+            _canonical_number(retirement_tax_rate),
+            _canonical_number(inflation_rate),
+            _canonical_changes(manual_retirement_income_changes))
+
+    @staticmethod
+    def _contribution_key(years_to_live, manual_contrib_changes, initial_contrib_amount, initial_contrib_rate, periods_per_year):
+        return (
+            int(years_to_live),
+            int(periods_per_year),
+            _canonical_changes(manual_contrib_changes),
+            _canonical_number(initial_contrib_amount),
+            _canonical_number(initial_contrib_rate))
+
+    def _build_withdrawals_function(self, years_to_live, periods_per_year, net_retirement_income_todays_dollars, retirement_tax_rate, inflation_rate, manual_retirement_income_changes):
+        return RetirementWithdrawalsFunction(years_to_live, net_retirement_income_todays_dollars, retirement_tax_rate, inflation_rate, dict(manual_retirement_income_changes), periods_per_year)
+
+    def _build_min_worth_function(self, withdrawals_key, post_retirement_growth_rate):
+        years_to_live, periods_per_year = withdrawals_key[:2]
+        return RetirementMinWorthFunction(years_to_live, self._internal_lookup('withdrawals', self._withdrawals_cache, withdrawals_key), post_retirement_growth_rate, periods_per_year)
+
+    def _build_contribution_function(self, years_to_live, periods_per_year, manual_contrib_changes, initial_contrib_amount, initial_contrib_rate):
+        return ContributionFunction(years_to_live, dict(manual_contrib_changes), initial_contrib_amount, initial_contrib_rate, periods_per_year)
+
+    def _build_no_retirement_function(self, manual_net_worth_changes, current_retirement_savings, pre_retirement_growth_rate, contribution_key):
+        years_to_live, periods_per_year = contribution_key[:2]
+        return NoRetirementNetWorthFunction(years_to_live, dict(manual_net_worth_changes), current_retirement_savings, pre_retirement_growth_rate, self._internal_lookup('contributions', self._contribution_cache, contribution_key), periods_per_year)
+
 class RetirementAgeCalculator:
     """
     Main class, used to calculate the earliest age of retirement given the various inputs
@@ -178,7 +666,10 @@ class RetirementAgeCalculator:
             retirement_tax_rate,
             manual_contrib_changes=None,
             manual_net_worth_changes=None,
-            manual_retirement_income_changes=None):
+            manual_retirement_income_changes=None,
+            periods_per_year=1,
+            cache=None,
+            profiler=None):
         # TODO actually handle net worth changes at any point in time
         """
         Pregenerates a retirement model based off the given inputs, allowing you to query various characteristics of the model
@@ -207,46 +698,72 @@ class RetirementAgeCalculator:
             manual_retirement_income_changes: dicionary indicating changes to net retirement income in the future, in the form:
                 <num years in future of change>: <new retirement income>
                 e.g. {2: 50000}
+            periods_per_year: number of periods to step the model in each year (e.g. 12 for monthly). With more than one,
+                the manual change dictionaries are keyed by period rather than year, the series hold one per-period
+                amount for each of the years_to_live * periods_per_year periods, and years to retirement is in periods.
+            cache: optional ScenarioCache to reuse the underlying functions from previous scenarios with the same inputs
+            profiler: optional profiling.StageProfiler to record how long each stage of building the model (and later,
+                getting series data) takes
         """
+        self.profiler = profiler
+        if profiler is not None:
+            profiler.start()
         manual_contrib_changes = manual_contrib_changes if manual_contrib_changes is not None else {}
         manual_net_worth_changes = manual_net_worth_changes if manual_net_worth_changes is not None else {}
         manual_retirement_income_changes = manual_retirement_income_changes if manual_retirement_income_changes is not None else {}
+        validate_manual_changes(years_to_live, manual_contrib_changes, manual_net_worth_changes, manual_retirement_income_changes, periods_per_year)
+        if profiler is not None:
+            profiler.lap('validation')
 
-        for years_out in manual_contrib_changes.keys():
-            if years_out < 0 or years_out >= years_to_live:
-                raise ValueError("Invalid contrib change year '%s'; must be in range [0,%s)" % years_out, years_to_live)
-        for years_out in manual_net_worth_changes.keys():
-            if years_out < 0 or years_out >= years_to_live:
-                raise ValueError("Invalid net worth change year '%s'; must be in range [0,%s)" % years_out, years_to_live)
-        for years_out in manual_retirement_income_changes.keys():
-            if years_out < 0 or years_out >= years_to_live:
-                raise ValueError("Invalid retirement income change year '%s'; must be in range [0,%s)" % years_out, years_to_live)
-        if years_to_live < 1:
-            raise ValueError("Years to live must be >= 1")
-
-        all_withdrawals_function = RetirementWithdrawalsFunction(years_to_live, desired_net_retirement_income_todays_dollars, retirement_tax_rate, inflation_rate, manual_retirement_income_changes)
-        min_worth_function = RetirementMinWorthFunction(years_to_live, all_withdrawals_function, post_retirement_growth_rate)
-
-        contribution_function = ContributionFunction(
-            years_to_live,
-            manual_contrib_changes,
-            annual_contribution,
-            annual_contribution_increase_rate)
-        no_retirement_function = NoRetirementNetWorthFunction(years_to_live, manual_net_worth_changes, current_retirement_savings, pre_retirement_growth_rate, contribution_function)
+        if cache is not None:
+            all_withdrawals_function = cache.get_withdrawals_function(years_to_live, desired_net_retirement_income_todays_dollars, retirement_tax_rate, inflation_rate, manual_retirement_income_changes, periods_per_year)
+            if profiler is not None:
+                profiler.lap('withdrawals')
+            min_worth_function = cache.get_min_worth_function(years_to_live, desired_net_retirement_income_todays_dollars, retirement_tax_rate, inflation_rate, manual_retirement_income_changes, post_retirement_growth_rate, periods_per_year)
+            if profiler is not None:
+                profiler.lap('min_worth')
+            contribution_function = cache.get_contribution_function(years_to_live, manual_contrib_changes, annual_contribution, annual_contribution_increase_rate, periods_per_year)
+            if profiler is not None:
+                profiler.lap('contributions')
+            no_retirement_function = cache.get_no_retirement_function(years_to_live, manual_net_worth_changes, current_retirement_savings, pre_retirement_growth_rate, manual_contrib_changes, annual_contribution, annual_contribution_increase_rate, periods_per_year)
+            if profiler is not None:
+                profiler.lap('no_retirement')
+        else:
+            all_withdrawals_function = RetirementWithdrawalsFunction(years_to_live, desired_net_retirement_income_todays_dollars, retirement_tax_rate, inflation_rate, manual_retirement_income_changes, periods_per_year)
+            if profiler is not None:
+                profiler.lap('withdrawals')
+            min_worth_function = RetirementMinWorthFunction(years_to_live, all_withdrawals_function, post_retirement_growth_rate, periods_per_year)
+            if profiler is not None:
+                profiler.lap('min_worth')
+
+            contribution_function = ContributionFunction(
+                years_to_live,
+                manual_contrib_changes,
+                annual_contribution,
+                annual_contribution_increase_rate,
+                periods_per_year)
+            if profiler is not None:
+                profiler.lap('contributions')
+            no_retirement_function = NoRetirementNetWorthFunction(years_to_live, manual_net_worth_changes, current_retirement_savings, pre_retirement_growth_rate, contribution_function, periods_per_year)
+            if profiler is not None:
+                profiler.lap('no_retirement')
 
         # Contigent-on-retirement-solution
-        self.years_to_retirement = None
-        for i in range(0, years_to_live):
-            if no_retirement_function.apply(i) >= min_worth_function.apply(i):
-                self.years_to_retirement = i
-                break
-        actual_withdrawals_function = ActualWithdrawalsFunction(years_to_live, self.years_to_retirement, all_withdrawals_function)
-        account_value_function = AccountValueFunction(years_to_live, self.years_to_retirement, no_retirement_function, post_retirement_growth_rate, all_withdrawals_function)
+        self.years_to_retirement, self.search_evaluations = find_earliest_retirement(no_retirement_function, min_worth_function)
+        if profiler is not None:
+            profiler.lap('retirement_search')
+        actual_withdrawals_function = ActualWithdrawalsFunction(self.years_to_retirement, all_withdrawals_function)
+        account_value_function = AccountValueFunction(self.years_to_retirement, no_retirement_function, min_worth_function)
+        if profiler is not None:
+            profiler.lap('account_value')
 
+        self.num_periods = years_to_live * periods_per_year
         self.waste = None
         if self.years_to_retirement is not None:
-            last_year = years_to_live - 1
+            last_year = self.num_periods - 1
             self.waste = account_value_function.apply(last_year) - actual_withdrawals_function.apply(last_year)
+        if profiler is not None:
+            profiler.lap('waste')
 
         self.underlying_funcs = {
             Series.ALL_WITHDRAWALS: all_withdrawals_function,
@@ -256,10 +773,12 @@ class RetirementAgeCalculator:
             Series.ACCOUNT_VALUE: account_value_function,
             Series.ACTUAL_WITHDRAWALS: actual_withdrawals_function,
         }
+        self.series_block = None
 
     def get_earliest_retirement(self):
         """
-        Get the smallest number of years after which you'll be able to retire, or None if not possible
+        Get the smallest number of years (or periods, with more than one period per year) after which you'll be able to
+         retire, or None if not possible
         """
         return self.years_to_retirement
 
@@ -271,5 +790,298 @@ class RetirementAgeCalculator:
         """
         return self.waste
 
+    def get_search_evaluations(self):
+        """
+        Number of years the earliest retirement search had to evaluate net worth and min worth for
+        """
+        return self.search_evaluations
+
+    def get_series_data(self, series):
+        """
+        Get a read-only memoryview of the given series' value for each period in [0, years_to_live * periods_per_year), or
+         None for the account value and actual withdrawals if you never get to retire
+        """
+        if self.profiler is None:
+            return self.underlying_funcs[series].data()
+        self.profiler.start()
+        series_data = self.underlying_funcs[series].data()
+        self.profiler.lap('series_data')
+        return series_data
+
+    def get_series_block(self):
+        """
+        Get every series as one contiguous read-only (series x year) memoryview of doubles, with row series.value - 1
+         holding each Series, so it can be handed to e.g. numpy.asarray or a columnar writer without converting each
+         element. The account value and actual withdrawal rows are NaN if you never get to retire.
+        """
+        if self.series_block is None:
+            self.series_block = _build_series_block(self.get_series_data, self.num_periods)
+        return self.series_block
+
+    @staticmethod
+    def batch(current_retirement_savings,
+            annual_contribution,
+            annual_contribution_increase_rate,
+            pre_retirement_growth_rate,
+            post_retirement_growth_rate,
+            inflation_rate,
+            years_to_live,
+            desired_net_retirement_income_todays_dollars,
+            retirement_tax_rate,
+            manual_contrib_changes=None,
+            manual_net_worth_changes=None,
+            manual_retirement_income_changes=None):
+        """
+        Evaluates many scenarios at once using NumPy (which must be installed), returning a BatchRetirementAgeCalculator.
+
+        Every argument except years_to_live may be a scalar or an array with one entry per scenario; the manual change
+        arguments may be a single dictionary shared by every scenario or a sequence with one dictionary per scenario.
+        See batch_calculator.BatchRetirementAgeCalculator for details.
+        """
+        from batch_calculator import BatchRetirementAgeCalculator
+        return BatchRetirementAgeCalculator(
+            current_retirement_savings,
+            annual_contribution,
+            annual_contribution_increase_rate,
+            pre_retirement_growth_rate,
+            post_retirement_growth_rate,
+            inflation_rate,
+            years_to_live,
+            desired_net_retirement_income_todays_dollars,
+            retirement_tax_rate,
+            manual_contrib_changes=manual_contrib_changes,
+            manual_net_worth_changes=manual_net_worth_changes,
+            manual_retirement_income_changes=manual_retirement_income_changes)
+
+class RetirementModel:
+    """
+    Mutable version of RetirementAgeCalculator for interactive use (e.g. dragging sliders in a UI). Editing an input only
+     rebuilds the functions that depend on it, and the retirement year, waste, and series are re-derived lazily the next
+     time they're queried.
+
+    Because the contribution, net worth, withdrawal, and min worth functions are piecewise closed-form, rebuilding one costs
+     time proportional to the number of manual changes rather than to years_to_live.
+    """
+    def __init__(self,
+            current_retirement_savings,
+            annual_contribution,
+            annual_contribution_increase_rate,
+            pre_retirement_growth_rate,
+            post_retirement_growth_rate,
+            inflation_rate,
+            years_to_live,
+            desired_net_retirement_income_todays_dollars,
+            retirement_tax_rate,
+            manual_contrib_changes=None,
+            manual_net_worth_changes=None,
+            manual_retirement_income_changes=None,
+            periods_per_year=1):
+        """
+        Takes the same arguments as RetirementAgeCalculator
+        """
+        manual_contrib_changes = dict(manual_contrib_changes) if manual_contrib_changes is not None else {}
+        manual_net_worth_changes = dict(manual_net_worth_changes) if manual_net_worth_changes is not None else {}
+        manual_retirement_income_changes = dict(manual_retirement_income_changes) if manual_retirement_income_changes is not None else {}
+        validate_manual_changes(years_to_live, manual_contrib_changes, manual_net_worth_changes, manual_retirement_income_changes, periods_per_year)
+
+        self.years_to_live = years_to_live
+        self.periods_per_year = periods_per_year
+        self.num_periods = years_to_live * periods_per_year
+        self.current_retirement_savings = current_retirement_savings
+        self.annual_contribution = annual_contribution
+        self.annual_contribution_increase_rate = annual_contribution_increase_rate
+        self.pre_retirement_growth_rate = pre_retirement_growth_rate
+        self.post_retirement_growth_rate = post_retirement_growth_rate
+        self.inflation_rate = inflation_rate
+        self.desired_net_retirement_income_todays_dollars = desired_net_retirement_income_todays_dollars
+        self.retirement_tax_rate = retirement_tax_rate
+        # The functions keep references to these, so edits replace the dictionaries rather than mutating them
+        self.manual_contrib_changes = manual_contrib_changes
+        self.manual_net_worth_changes = manual_net_worth_changes
+        self.manual_retirement_income_changes = manual_retirement_income_changes
+
+        self.all_withdrawals_function = None
+        self.min_worth_function = None
+        self.contribution_function = None
+        self.no_retirement_function = None
+        self._invalidate_retirement()
+
+    # ============================== Edits ==============================
+    def set_current_retirement_savings(self, current_retirement_savings):
+        self.current_retirement_savings = current_retirement_savings
+        self._invalidate_net_worth()
+
+    def set_annual_contribution(self, annual_contribution):
+        self.annual_contribution = annual_contribution
+        self._invalidate_contributions()
+
+    def set_annual_contribution_increase_rate(self, annual_contribution_increase_rate):
+        self.annual_contribution_increase_rate = annual_contribution_increase_rate
+        self._invalidate_contributions()
+
+    def set_pre_retirement_growth_rate(self, pre_retirement_growth_rate):
+        self.pre_retirement_growth_rate = pre_retirement_growth_rate
+        self._invalidate_net_worth()
+
+    def set_post_retirement_growth_rate(self, post_retirement_growth_rate):
+        self.post_retirement_growth_rate = post_retirement_growth_rate
+        self._invalidate_min_worth()
+
+    def set_inflation_rate(self, inflation_rate):
+        self.inflation_rate = inflation_rate
+        self._invalidate_withdrawals()
+
+    def set_desired_net_retirement_income_todays_dollars(self, desired_net_retirement_income_todays_dollars):
+        self.desired_net_retirement_income_todays_dollars = desired_net_retirement_income_todays_dollars
+        self._invalidate_withdrawals()
+
+    def set_retirement_tax_rate(self, retirement_tax_rate):
+        self.retirement_tax_rate = retirement_tax_rate
+        self._invalidate_withdrawals()
+
+    def set_contrib_change(self, years_out, contrib, contrib_rate):
+        """
+        Adds or replaces the contribution change at the given year
+        """
+        self._check_change_year(years_out, "contrib")
+        self.manual_contrib_changes = {**self.manual_contrib_changes, years_out: (contrib, contrib_rate)}
+        self._invalidate_contributions()
+
+    def remove_contrib_change(self, years_out):
+        self.manual_contrib_changes = {year: change for year, change in self.manual_contrib_changes.items() if year != years_out}
+        self._invalidate_contributions()
+
+    def set_net_worth_change(self, years_out, change):
+        """
+        Adds or replaces the one-off net worth change at the given year
+        """
+        self._check_change_year(years_out, "net worth")
+        self.manual_net_worth_changes = {**self.manual_net_worth_changes, years_out: change}
+        self._invalidate_net_worth()
+
+    def remove_net_worth_change(self, years_out):
+        self.manual_net_worth_changes = {year: change for year, change in self.manual_net_worth_changes.items() if year != years_out}
+        self._invalidate_net_worth()
+
+    def set_retirement_income_change(self, years_out, net_income):
+        """
+        Adds or replaces the retirement income change at the given year
+        """
+        self._check_change_year(years_out, "retirement income")
+        self.manual_retirement_income_changes = {**self.manual_retirement_income_changes, years_out: net_income}
+        self._invalidate_withdrawals()
+
+    def remove_retirement_income_change(self, years_out):
+        self.manual_retirement_income_changes = {year: change for year, change in self.manual_retirement_income_changes.items() if year != years_out}
+        self._invalidate_withdrawals()
+
+    def _check_change_year(self, years_out, description):
+        if years_out < 0 or years_out >= self.num_periods:
+            raise ValueError("Invalid %s change year '%s'; must be in range [0,%s)" % (description, years_out, self.num_periods))
+
+    # Each invalidation also invalidates everything downstream of it
+    def _invalidate_withdrawals(self):
+        self.all_withdrawals_function = None
+        self._invalidate_min_worth()
+
+    def _invalidate_min_worth(self):
+        self.min_worth_function = None
+        self._invalidate_retirement()
+
+    def _invalidate_contributions(self):
+        self.contribution_function = None
+        self._invalidate_net_worth()
+
+    def _invalidate_net_worth(self):
+        self.no_retirement_function = None
+        self._invalidate_retirement()
+
+    def _invalidate_retirement(self):
+        self.is_retirement_computed = False
+        self.years_to_retirement = None
+        self.search_evaluations = None
+        self.waste = None
+        self.account_value_function = None
+        self.actual_withdrawals_function = None
+        self.series_block = None
+
+    # ============================== Lazy derivation ==============================
+    def _get_all_withdrawals_function(self):
+        if self.all_withdrawals_function is None:
+            self.all_withdrawals_function = RetirementWithdrawalsFunction(self.years_to_live, self.desired_net_retirement_income_todays_dollars, self.retirement_tax_rate, self.inflation_rate, self.manual_retirement_income_changes, self.periods_per_year)
+        return self.all_withdrawals_function
+
+    def _get_min_worth_function(self):
+        if self.min_worth_function is None:
+            self.min_worth_function = RetirementMinWorthFunction(self.years_to_live, self._get_all_withdrawals_function(), self.post_retirement_growth_rate, self.periods_per_year)
+        return self.min_worth_function
+
+    def _get_contribution_function(self):
+        if self.contribution_function is None:
+            self.contribution_function = ContributionFunction(self.years_to_live, self.manual_contrib_changes, self.annual_contribution, self.annual_contribution_increase_rate, self.periods_per_year)
+        return self.contribution_function
+
+    def _get_no_retirement_function(self):
+        if self.no_retirement_function is None:
+            self.no_retirement_function = NoRetirementNetWorthFunction(self.years_to_live, self.manual_net_worth_changes, self.current_retirement_savings, self.pre_retirement_growth_rate, self._get_contribution_function(), self.periods_per_year)
+        return self.no_retirement_function
+
+    def _compute_retirement(self):
+        if not self.is_retirement_computed:
+            no_retirement_function = self._get_no_retirement_function()
+            min_worth_function = self._get_min_worth_function()
+            self.years_to_retirement, self.search_evaluations = find_earliest_retirement(no_retirement_function, min_worth_function)
+            self.waste = compute_waste(self.years_to_retirement, no_retirement_function, min_worth_function)
+            self.is_retirement_computed = True
+
+    # ============================== Queries ==============================
+    def get_earliest_retirement(self):
+        """
+        Get the smallest number of years after which you'll be able to retire, or None if not possible
+        """
+        self._compute_retirement()
+        return self.years_to_retirement
+
+    def get_waste(self):
+        """
+        Dollars you'd die with (or None if you never get to retire)
+        """
+        self._compute_retirement()
+        return self.waste
+
+    def get_search_evaluations(self):
+        """
+        Number of years the earliest retirement search had to evaluate net worth and min worth for
+        """
+        self._compute_retirement()
+        return self.search_evaluations
+
     def get_series_data(self, series):
-        return self.underlying_funcs[series].data()
+        if series == Series.ALL_WITHDRAWALS:
+            return self._get_all_withdrawals_function().data()
+        if series == Series.MIN_RETIREMENT_WORTH:
+            return self._get_min_worth_function().data()
+        if series == Series.CONTRIBUTIONS:
+            return self._get_contribution_function().data()
+        if series == Series.NO_RETIREMENT:
+            return self._get_no_retirement_function().data()
+
+        self._compute_retirement()
+        if series == Series.ACCOUNT_VALUE:
+            if self.account_value_function is None:
+                self.account_value_function = AccountValueFunction(self.years_to_retirement, self.no_retirement_function, self.min_worth_function)
+            return self.account_value_function.data()
+        if series == Series.ACTUAL_WITHDRAWALS:
+            if self.actual_withdrawals_function is None:
+                self.actual_withdrawals_function = ActualWithdrawalsFunction(self.years_to_retirement, self._get_all_withdrawals_function())
+            return self.actual_withdrawals_function.data()
+        raise ValueError("Unknown series '%s'" % series)
+
+    def get_series_block(self):
+        """
+        Get every series as one contiguous read-only (series x year) memoryview of doubles; see
+         RetirementAgeCalculator.get_series_block
+        """
+        if self.series_block is None:
+            self.series_block = _build_series_block(self.get_series_data, self.num_periods)
+        return self.series_block
@@ -0,0 +1,206 @@
+from retirement_age_calculator import RetirementAgeCalculator, Series
+
+# Names of the scenario fields, shared by the CLI args and the batch/sweep input and output columns
+CURRENT_SAVINGS_KEY = 'current_savings'
+ANNUAL_CONTRIB_KEY = 'annual_contribution'
+ANNUAL_CONTRIB_INCREASE_RATE_KEY = 'annual_contrib_increase_rate'
+PRE_GROWTH_RATE_KEY = 'pre_growth_rate'
+POST_GROWTH_RATE_KEY = 'post_growth_rate'
+INFLATION_RATE_KEY = 'inflation_rate'
+YEARS_TO_LIVE_KEY = 'years_to_live'
+NET_RETIREMENT_INCOME_KEY = 'net_retirement_income'
+RETIREMENT_TAX_RATE_KEY = 'retirement_tax_rate'
+
+NET_WORTH_CHANGE_KEY = 'net_worth_change'
+CONTRIB_CHANGE_KEY = 'contrib_change'
+RETIREMENT_INCOME_CHANGE_KEY = 'retirement_income_change'
+
+# Names of the result fields
+YEARS_TO_RETIREMENT_KEY = 'years_to_retirement'
+WASTE_KEY = 'waste'
+SERIES_KEY = 'series'
+
+# The fields every scenario needs, in the order of the CLI's positional args, as (key, type, help)
+SCENARIO_FIELDS = [
+    (CURRENT_SAVINGS_KEY, int, 'Current retirement savings right now, in dollars'),
+    (ANNUAL_CONTRIB_KEY, int, 'Annual contribution, in dollars'),
+    (ANNUAL_CONTRIB_INCREASE_RATE_KEY, float, 'Annual contribution, in dollars'),
+    (PRE_GROWTH_RATE_KEY, float, 'Market growth rate before retirement, in the form 0.XX'),
+    (POST_GROWTH_RATE_KEY, float, 'Market growth rate during retirement, in the form 0.XX'),
+    (INFLATION_RATE_KEY, float, 'Inflation rate, in the form 0.XX'),
+    (YEARS_TO_LIVE_KEY, int, "How many more years you estimate you'll live"),
+    (NET_RETIREMENT_INCOME_KEY, int, "Desired net income in retirement, in *today's* dollars"),
+    (RETIREMENT_TAX_RATE_KEY, float, 'Estimated tax rate in retirement, in the form 0.XX'),
+]
+SCENARIO_KEYS = [key for key, _, _ in SCENARIO_FIELDS]
+
+def add_change_arguments(parser):
+    """
+    Adds the -w, -c, and -i manual change options to the given argparse parser
+    """
+    parser.add_argument('-w', '--change-worth', dest=NET_WORTH_CHANGE_KEY, action='append', nargs=2, metavar=('years_out','value'), default=[], help='Indicate a one-off change in net worth at the start of year X (useful to represent a big cash in/outflux - e.g. selling equity). This option can be specified multiple times.')
+    parser.add_argument('-c', '--change-contrib', dest=CONTRIB_CHANGE_KEY, action='append', nargs=3, metavar=('years_out','contrib', 'contrib_rate'), default=[], help='Indicate a change in annual contribution amount/rate at the start of year X (useful to represent changing life situation - e.g. a new job). This option can be specified multiple times.')
+    parser.add_argument('-i', '--change-retirement-income', dest=RETIREMENT_INCOME_CHANGE_KEY, action='append', nargs=2, metavar=('years_out','net_income'), default=[], help="Indicate a change in annual net retirement income, denominated in today's dollars,  at the start of year X (useful to represent changing life situation - e.g. children moving out of home). This option can be specified multiple times.")
+
+def _parse_whole_number(raw_value, description):
+    """
+    Converts a raw value (a string, e.g. from the CLI or a CSV row, or a number, e.g. from JSON) to an int, raising a
+     ValueError if it isn't a whole number. int() on its own would take a JSON true as 1 and truncate a JSON 1234.99 to 1234,
+     where the same values in a CSV row are rejected.
+
+    Args:
+        raw_value: value to convert
+        description: what the value is, for the error message (e.g. "net worth change")
+    """
+    try:
+        value = int(raw_value)
+    except (TypeError, ValueError, OverflowError):
+        value = None
+    if value is None or isinstance(raw_value, bool) or (value != raw_value and not isinstance(raw_value, str)):
+        raise ValueError("Invalid %s '%s'; must be a whole number" % (description, raw_value))
+    return value
+
+def parse_period(years_out_str, description, years_to_live, periods_per_year):
+    """
+    Converts a number of years out (which may be fractional, e.g. 2.5 with 12 periods per year) into the matching period,
+     raising a ValueError if it's out of range or doesn't fall on a period
+    """
+    if isinstance(years_out_str, bool):
+        raise ValueError("Invalid %s year '%s'; must be a number" % (description, years_out_str))
+    years_out = float(years_out_str)
+    if years_out < 0 or years_out >= years_to_live:
+        raise ValueError("Invalid %s year '%s'; must be between [0,%s)" % (description, years_out_str, years_to_live))
+    period = round(years_out * periods_per_year)
+    if abs(period - years_out * periods_per_year) > 1e-9:
+        raise ValueError("Invalid %s year '%s'; must be a whole number of periods (%s per year)" % (description, years_out_str, periods_per_year))
+    return period
+
+def parse_changes(net_worth_change_entries, contrib_change_entries, retirement_income_change_entries, years_to_live, periods_per_year=1):
+    """
+    Converts the raw -w, -c, and -i entries (lists of string or numeric tuples) into the manual change dictionaries
+     RetirementAgeCalculator takes, keyed by period, raising a ValueError if any are malformed, duplicated, or out of range
+
+    Returns:
+        (net worth changes, contrib changes, retirement income changes)
+    """
+    # Validate no duplicates, for sanity
+    net_worth_changes = {}
+    for years_out_str, change_str in net_worth_change_entries:
+        period = parse_period(years_out_str, "net worth change", years_to_live, periods_per_year)
+        change = _parse_whole_number(change_str, "net worth change")
+        if period in net_worth_changes:
+            raise ValueError("Two net worth changes defined with the same year '%s'" % years_out_str)
+        net_worth_changes[period] = change
+
+    contrib_changes = {}
+    for years_out_str, contrib_str, contrib_rate_str in contrib_change_entries:
+        period = parse_period(years_out_str, "contrib change", years_to_live, periods_per_year)
+        contrib = _parse_whole_number(contrib_str, "contrib change")
+        if isinstance(contrib_rate_str, bool):
+            raise ValueError("Invalid contrib change rate '%s'; must be a number" % contrib_rate_str)
+        contrib_rate = float(contrib_rate_str)
+        if period in contrib_changes:
+            raise ValueError("Two contrib changes defined with the same year '%s'" % years_out_str)
+        contrib_changes[period] = (contrib, contrib_rate)
+
+    retirement_income_changes = {}
+    for years_out_str, net_income_str in retirement_income_change_entries:
+        period = parse_period(years_out_str, "retirement income change", years_to_live, periods_per_year)
+        net_income = _parse_whole_number(net_income_str, "retirement income change")
+        if period in retirement_income_changes:
+            raise ValueError("Two retirement income changes defined with the same year '%s'" % years_out_str)
+        retirement_income_changes[period] = net_income
+
+    return net_worth_changes, contrib_changes, retirement_income_changes
+
+def build_calculator(values, net_worth_changes, contrib_changes, retirement_income_changes, cache=None):
+    """
+    Builds a RetirementAgeCalculator from a dictionary of {scenario field key: value} and the parsed manual changes
+    """
+    return RetirementAgeCalculator(
+        values[CURRENT_SAVINGS_KEY],
+        values[ANNUAL_CONTRIB_KEY],
+        values[ANNUAL_CONTRIB_INCREASE_RATE_KEY],
+        values[PRE_GROWTH_RATE_KEY],
+        values[POST_GROWTH_RATE_KEY],
+        values[INFLATION_RATE_KEY],
+        values[YEARS_TO_LIVE_KEY],
+        values[NET_RETIREMENT_INCOME_KEY],
+        values[RETIREMENT_TAX_RATE_KEY],
+        manual_contrib_changes=contrib_changes,
+        manual_net_worth_changes=net_worth_changes,
+        manual_retirement_income_changes=retirement_income_changes,
+        cache=cache)
+
+def _parse_change_entries(raw_entries, num_values, key):
+    """
+    Gets the entries for one type of manual change, given either as a list of lists (e.g. from JSON: [[5, 10000]]) or as a
+     string of ';'-separated entries with whitespace-separated values, like the CLI flags (e.g. from CSV: "5 10000; 8 -2000")
+    """
+    if raw_entries is None or raw_entries == '':
+        return []
+    if isinstance(raw_entries, str):
+        raw_entries = [entry.split() for entry in raw_entries.split(';') if entry.strip()]
+    entries = []
+    for entry in raw_entries:
+        if not isinstance(entry, (list, tuple)) or len(entry) != num_values:
+            raise ValueError("Invalid %s entry '%s'; expected %s values" % (key, entry, num_values))
+        entries.append(entry)
+    return entries
+
+def parse_scenario(fields):
+    """
+    Converts a dictionary of raw scenario fields (e.g. a JSON object or CSV row) keyed by SCENARIO_KEYS, plus optional
+     NET_WORTH_CHANGE_KEY, CONTRIB_CHANGE_KEY, and RETIREMENT_INCOME_CHANGE_KEY entries, into the inputs for build_calculator,
+     raising a ValueError if anything is missing or invalid
+
+    Returns:
+        (values, net worth changes, contrib changes, retirement income changes)
+    """
+    values = {}
+    for key, value_type, _ in SCENARIO_FIELDS:
+        raw_value = fields.get(key)
+        if raw_value is None or raw_value == '':
+            raise ValueError("Missing field '%s'" % key)
+        # A JSON true would otherwise be taken as 1, which a CSV row can't say
+        if isinstance(raw_value, bool):
+            raise ValueError("Invalid value '%s' for field '%s'" % (raw_value, key))
+        try:
+            values[key] = _parse_whole_number(raw_value, key) if value_type is int else value_type(raw_value)
+        except (TypeError, ValueError):
+            raise ValueError("Invalid value '%s' for field '%s'" % (raw_value, key))
+    if values[YEARS_TO_LIVE_KEY] < 1:
+        raise ValueError("Invalid years to live; are you expecting to die today??")
+
+    try:
+        net_worth_changes, contrib_changes, retirement_income_changes = parse_changes(
+            _parse_change_entries(fields.get(NET_WORTH_CHANGE_KEY), 2, NET_WORTH_CHANGE_KEY),
+            _parse_change_entries(fields.get(CONTRIB_CHANGE_KEY), 3, CONTRIB_CHANGE_KEY),
+            _parse_change_entries(fields.get(RETIREMENT_INCOME_CHANGE_KEY), 2, RETIREMENT_INCOME_CHANGE_KEY),
+            values[YEARS_TO_LIVE_KEY])
+    except TypeError as e:
+        raise ValueError(str(e))
+    return values, net_worth_changes, contrib_changes, retirement_income_changes
+
+def evaluate_scenario(fields, include_series=False, cache=None):
+    """
+    Parses and evaluates a scenario given as raw fields (see parse_scenario), raising a ValueError if it's invalid
+
+    Returns:
+        dictionary with YEARS_TO_RETIREMENT_KEY and WASTE_KEY (None if you can't retire), plus SERIES_KEY mapping each
+         lowercase Series name to its data if include_series is set
+    """
+    calculator = build_calculator(*parse_scenario(fields), cache=cache)
+    years_to_retirement = calculator.get_earliest_retirement()
+    result = {
+        YEARS_TO_RETIREMENT_KEY: years_to_retirement,
+        WASTE_KEY: calculator.get_waste(),
+    }
+    if include_series:
+        series_data = {}
+        for series in Series:
+            # The account value and actual withdrawals only exist if you retire
+            data = calculator.get_series_data(series)
+            series_data[series.name.lower()] = data.tolist() if data is not None else None
+        result[SERIES_KEY] = series_data
+    return result
@@ -0,0 +1,463 @@
+import asyncio
+import collections
+import concurrent.futures
+import json
+import math
+import threading
+import time
+
+from batch_runner import ID_KEY, ERROR_KEY
+from retirement_age_calculator import ScenarioCache, Series
+from scenario import (
+    SCENARIO_FIELDS,
+    YEARS_TO_LIVE_KEY,
+    YEARS_TO_RETIREMENT_KEY,
+    WASTE_KEY,
+    SERIES_KEY,
+    build_calculator,
+    parse_scenario,
+)
+
+try:
+    import numpy
+    import batch_calculator
+except ImportError:
+    batch_calculator = None
+
+# The server only ever listens on the loopback interface
+HOST = '127.0.0.1'
+
+EVALUATE_PATH = '/evaluate'
+METRICS_PATH = '/metrics'
+
+# Optional request field asking for every series in the result
+INCLUDE_SERIES_KEY = 'include_series'
+
+# Groups of at least this many coalesced scenarios with the same years to live are evaluated in one pass of the NumPy
+#  batch engine; smaller groups are faster to evaluate one at a time
+BATCH_ENGINE_MIN_SCENARIOS = 16
+
+MAX_BODY_BYTES = 1 << 20
+MAX_HEADERS = 100
+
+# Number of recent requests the latency percentiles are computed over, and the window the recent throughput is over
+LATENCY_WINDOW_SIZE = 10000
+THROUGHPUT_WINDOW_SECONDS = 10.0
+
+_REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    411: 'Length Required',
+    413: 'Payload Too Large',
+    500: 'Internal Server Error',
+    503: 'Service Unavailable',
+}
+
+class _HttpError(Exception):
+    """
+    A malformed request that gets an error response and closes the connection
+    """
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def _result_from_calculator(calculator, include_series):
+    """
+    Same result dictionary as scenario.evaluate_scenario, from an already-built calculator
+    """
+    result = {
+        YEARS_TO_RETIREMENT_KEY: calculator.get_earliest_retirement(),
+        WASTE_KEY: calculator.get_waste(),
+    }
+    if include_series:
+        series_data = {}
+        for series in Series:
+            data = calculator.get_series_data(series)
+            series_data[series.name.lower()] = data.tolist() if data is not None else None
+        result[SERIES_KEY] = series_data
+    return result
+
+def _evaluate_with_batch_engine(scenarios):
+    """
+    Evaluates scenarios that all have the same years to live in one BatchRetirementAgeCalculator
+
+    Returns:
+        list with the result dictionary for each scenario in order, or None for scenarios whose series hit inf or
+         NaN (e.g. a 100% tax rate or -100% post-retirement growth), where the scalar calculator raises but NumPy quietly
+         carries on
+    """
+    columns = {key: [parsed[0][key] for parsed, _ in scenarios] for key, _, _ in SCENARIO_FIELDS}
+    with numpy.errstate(all='ignore'):
+        batch = batch_calculator.BatchRetirementAgeCalculator(
+            *[columns[key] if key != YEARS_TO_LIVE_KEY else scenarios[0][0][0][key] for key, _, _ in SCENARIO_FIELDS],
+            manual_contrib_changes=[parsed[2] for parsed, _ in scenarios],
+            manual_net_worth_changes=[parsed[1] for parsed, _ in scenarios],
+            manual_retirement_income_changes=[parsed[3] for parsed, _ in scenarios])
+    all_years_to_retirement = batch.get_earliest_retirement()
+    all_waste = batch.get_waste()
+    # Every series is finite for a valid scenario, except the ones that are all NaN because it never gets to retire
+    modelled = numpy.logical_and.reduce([numpy.isfinite(batch.get_series_data(series)).all(axis=1) for series in (
+        Series.ALL_WITHDRAWALS, Series.MIN_RETIREMENT_WORTH, Series.CONTRIBUTIONS, Series.NO_RETIREMENT)])
+    modelled &= (all_years_to_retirement < 0) | numpy.isfinite(all_waste)
+
+    results = []
+    for idx, (_, include_series) in enumerate(scenarios):
+        if not modelled[idx]:
+            results.append(None)
+            continue
+        years_to_retirement = int(all_years_to_retirement[idx])
+        years_to_retirement = years_to_retirement if years_to_retirement >= 0 else None
+        result = {
+            YEARS_TO_RETIREMENT_KEY: years_to_retirement,
+            WASTE_KEY: float(all_waste[idx]) if years_to_retirement is not None else None,
+        }
+        if include_series:
+            series_data = {}
+            for series in Series:
+                # The account value and actual withdrawals only exist if you retire
+                if years_to_retirement is None and series in (Series.ACCOUNT_VALUE, Series.ACTUAL_WITHDRAWALS):
+                    series_data[series.name.lower()] = None
+                else:
+                    series_data[series.name.lower()] = batch.get_series_data(series)[idx].tolist()
+            result[SERIES_KEY] = series_data
+        results.append(result)
+    return results
+
+def evaluate_scenarios(scenarios, cache=None):
+    """
+    Evaluates many already-parsed scenarios at once. Scenarios with the same years to live are grouped into one pass of
+     the NumPy batch engine when there are enough of them and NumPy is installed; the rest are evaluated one at a time
+     with a shared cache.
+
+    Args:
+        scenarios: list of (parse_scenario result, whether to include every series in the result)
+        cache: ScenarioCache for the scenarios evaluated one at a time (a new one is created if None)
+
+    Returns:
+        list with, for each scenario in order, the result dictionary scenario.evaluate_scenario would return, or the
+         ValueError or ArithmeticError evaluating it raised
+    """
+    cache = cache if cache is not None else ScenarioCache()
+    results = [None] * len(scenarios)
+    groups = {}
+    for idx, (parsed, _) in enumerate(scenarios):
+        groups.setdefault(parsed[0][YEARS_TO_LIVE_KEY], []).append(idx)
+
+    for indices in groups.values():
+        if batch_calculator is not None and len(indices) >= BATCH_ENGINE_MIN_SCENARIOS:
+            try:
+                for idx, result in zip(indices, _evaluate_with_batch_engine([scenarios[idx] for idx in indices])):
+                    results[idx] = result
+                # Anything the engine couldn't model goes through the calculator so it gets the same error it would alone
+                indices = [idx for idx in indices if results[idx] is None]
+            except (ValueError, ArithmeticError):
+                # Find out which scenarios are invalid by evaluating them one at a time
+                pass
+        for idx in indices:
+            parsed, include_series = scenarios[idx]
+            try:
+                results[idx] = _result_from_calculator(build_calculator(*parsed, cache=cache), include_series)
+            except (ValueError, ArithmeticError) as e:
+                results[idx] = e
+    return results
+
+def _percentile(sorted_values, percentile):
+    """
+    Nearest-rank percentile of an already-sorted list
+    """
+    rank = max(1, int(math.ceil(percentile / 100.0 * len(sorted_values))))
+    return sorted_values[rank - 1]
+
+class ServerMetrics:
+    """
+    Counts requests, batches, and rejections, and keeps the latencies of the most recent requests, for the metrics endpoint
+    """
+    def __init__(self):
+        self.start_time = time.monotonic()
+        self.requests = 0
+        self.errors = 0
+        self.rejected = 0
+        self.batches = 0
+        self.batched_scenarios = 0
+        self.largest_batch = 0
+        # (time finished, latency in seconds) of the most recent evaluations
+        self.recent = collections.deque(maxlen=LATENCY_WINDOW_SIZE)
+
+    def record_request(self, latency, is_error):
+        self.requests = self.requests + 1
+        if is_error:
+            self.errors = self.errors + 1
+        self.recent.append((time.monotonic(), latency))
+
+    def record_rejection(self):
+        self.rejected = self.rejected + 1
+
+    def record_batch(self, size):
+        self.batches = self.batches + 1
+        self.batched_scenarios = self.batched_scenarios + size
+        self.largest_batch = max(self.largest_batch, size)
+
+    def get_snapshot(self, in_flight, queued):
+        """
+        Get a JSON-serializable dictionary of the metrics, with latencies in milliseconds
+        """
+        now = time.monotonic()
+        uptime = now - self.start_time
+        latencies = sorted(latency for _, latency in self.recent)
+        recent_requests = sum(1 for finished, _ in self.recent if finished >= now - THROUGHPUT_WINDOW_SECONDS)
+        snapshot = {
+            'uptime_seconds': uptime,
+            'requests': self.requests,
+            'errors': self.errors,
+            'rejected': self.rejected,
+            'in_flight': in_flight,
+            'queued': queued,
+            'batches': self.batches,
+            'mean_batch_size': self.batched_scenarios / self.batches if self.batches > 0 else None,
+            'largest_batch': self.largest_batch,
+            'throughput_per_second': self.requests / uptime if uptime > 0 else None,
+            'recent_throughput_per_second': recent_requests / min(uptime, THROUGHPUT_WINDOW_SECONDS) if uptime > 0 else None,
+            'latency_ms': None,
+        }
+        if latencies:
+            snapshot['latency_ms'] = {
+                'p50': _percentile(latencies, 50) * 1e3,
+                'p90': _percentile(latencies, 90) * 1e3,
+                'p99': _percentile(latencies, 99) * 1e3,
+                'max': latencies[-1] * 1e3,
+            }
+        return snapshot
+
+class ScenarioServer:
+    """
+    HTTP service evaluating scenarios POSTed as JSON to /evaluate (with the same fields as batch mode), listening only on
+     localhost.
+
+    Requests arriving within batch_window seconds of each other are coalesced into one call to evaluate_scenarios, run on
+     a pool of worker threads so the event loop keeps accepting requests meanwhile. At most max_pending requests are
+     accepted at a time; any more get a 503 straight away rather than queueing without bound. GET /metrics reports
+     request counts, batch sizes, throughput, and latency percentiles.
+    """
+    def __init__(self, port=8080, batch_window=0.002, max_batch_size=256, max_pending=1024, workers=1):
+        """
+        Args:
+            port: port to listen on, or 0 to pick a free one
+            batch_window: seconds to wait after the first request of a batch for more to arrive
+            max_batch_size: number of requests that triggers evaluating a batch right away
+            max_pending: number of requests accepted but not yet answered beyond which new ones are rejected
+            workers: number of batches that can be evaluated at once
+        """
+        if batch_window < 0:
+            raise ValueError("Batch window must be >= 0")
+        if max_batch_size < 1:
+            raise ValueError("Max batch size must be >= 1")
+        if max_pending < 1:
+            raise ValueError("Max pending requests must be >= 1")
+        if workers < 1:
+            raise ValueError("Number of workers must be >= 1")
+        self.port = port
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.max_pending = max_pending
+        self.workers = workers
+        self.metrics = ServerMetrics()
+        self.pending = 0
+        self.queue = []
+        self.flush_handle = None
+        self.batch_tasks = set()
+        self.executor = None
+        self.server = None
+        # ScenarioCache isn't thread-safe, so each worker thread gets its own
+        self.thread_state = threading.local()
+
+    async def start(self):
+        """
+        Starts listening, setting port to the one actually listened on
+        """
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers)
+        self.server = await asyncio.start_server(self._handle_connection, HOST, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        """
+        Serves until cancelled, starting first if start() hasn't been called
+        """
+        if self.server is None:
+            await self.start()
+        try:
+            async with self.server:
+                await self.server.serve_forever()
+        finally:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+        self.executor.shutdown(wait=True)
+
+    # =============== Batching ====================================
+    async def evaluate(self, parsed, include_series):
+        """
+        Queues an already-parsed scenario for the next batch and waits for its result
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.queue.append(((parsed, include_series), future))
+        if len(self.queue) >= self.max_batch_size:
+            self._flush()
+        elif self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_later(self.batch_window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        batch = self.queue
+        self.queue = []
+        task = asyncio.ensure_future(self._run_batch(batch))
+        # The event loop only keeps weak references to tasks
+        self.batch_tasks.add(task)
+        task.add_done_callback(self.batch_tasks.discard)
+
+    async def _run_batch(self, batch):
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(self.executor, self._evaluate_in_worker, [scenario for scenario, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.metrics.record_batch(len(batch))
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def _evaluate_in_worker(self, scenarios):
+        cache = getattr(self.thread_state, 'cache', None)
+        if cache is None:
+            cache = ScenarioCache()
+            self.thread_state.cache = cache
+        return evaluate_scenarios(scenarios, cache=cache)
+
+    # =============== HTTP ====================================
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await _read_request(reader)
+                except _HttpError as e:
+                    writer.write(_format_response(e.status, {ERROR_KEY: str(e)}, keep_alive=False))
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+                method, path, body, keep_alive = request
+                status, response, headers = await self._handle_request(method, path, body)
+                writer.write(_format_response(status, response, keep_alive, headers))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        # ValueError is what the reader raises for a line longer than its limit
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _handle_request(self, method, path, body):
+        """
+        Get the (status, JSON-serializable response, extra headers) for a request
+        """
+        if path == METRICS_PATH:
+            if method != 'GET':
+                return 405, {ERROR_KEY: "Use GET for %s" % METRICS_PATH}, {'Allow': 'GET'}
+            return 200, self.metrics.get_snapshot(self.pending, len(self.queue)), {}
+        if path != EVALUATE_PATH:
+            return 404, {ERROR_KEY: "Unknown path '%s'; use POST %s or GET %s" % (path, EVALUATE_PATH, METRICS_PATH)}, {}
+        if method != 'POST':
+            return 405, {ERROR_KEY: "Use POST for %s" % EVALUATE_PATH}, {'Allow': 'POST'}
+
+        if self.pending >= self.max_pending:
+            self.metrics.record_rejection()
+            return 503, {ERROR_KEY: "Server is busy; try again later"}, {'Retry-After': '1'}
+        self.pending = self.pending + 1
+        start_time = time.monotonic()
+        status = 200
+        try:
+            result = {}
+            try:
+                fields = json.loads(body)
+                if not isinstance(fields, dict):
+                    raise ValueError("Expected a JSON object")
+                if fields.get(ID_KEY) not in (None, ''):
+                    result[ID_KEY] = fields[ID_KEY]
+                evaluated = await self.evaluate(parse_scenario(fields), bool(fields.get(INCLUDE_SERIES_KEY, False)))
+                if isinstance(evaluated, Exception):
+                    raise evaluated
+                result.update(evaluated)
+            except (ValueError, ArithmeticError) as e:
+                status = 400
+                result[ERROR_KEY] = str(e)
+            except Exception as e:
+                status = 500
+                result[ERROR_KEY] = "Internal error: %s" % e
+            return status, result, {}
+        finally:
+            self.pending = self.pending - 1
+            self.metrics.record_request(time.monotonic() - start_time, status != 200)
+
+async def _read_request(reader):
+    """
+    Reads one HTTP/1.x request
+
+    Returns:
+        (method, path, body bytes, whether to keep the connection alive), or None if the client closed the connection
+    """
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    parts = request_line.decode('latin-1').split()
+    if len(parts) != 3 or not parts[2].startswith('HTTP/1.'):
+        raise _HttpError(400, "Malformed request line")
+    method, target, version = parts
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        if len(headers) >= MAX_HEADERS:
+            raise _HttpError(400, "Too many headers")
+        name, separator, value = line.decode('latin-1').partition(':')
+        if not separator:
+            raise _HttpError(400, "Malformed header")
+        headers[name.strip().lower()] = value.strip()
+
+    if 'chunked' in headers.get('transfer-encoding', '').lower():
+        raise _HttpError(411, "Chunked requests aren't supported; send a Content-Length")
+    try:
+        content_length = int(headers.get('content-length', '0'))
+    except ValueError:
+        raise _HttpError(400, "Invalid Content-Length")
+    if content_length < 0:
+        raise _HttpError(400, "Invalid Content-Length")
+    if content_length > MAX_BODY_BYTES:
+        raise _HttpError(413, "Request body must be at most %s bytes" % MAX_BODY_BYTES)
+    body = await reader.readexactly(content_length) if content_length > 0 else b''
+
+    connection = headers.get('connection', '').lower()
+    keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+    return method, target.split('?', 1)[0], body, keep_alive
+
+def _format_response(status, response, keep_alive, headers=None):
+    body = json.dumps(response).encode('utf-8')
+    lines = [
+        "HTTP/1.1 %s %s" % (status, _REASONS[status]),
+        "Content-Type: application/json",
+        "Content-Length: %s" % len(body),
+        "Connection: %s" % ('keep-alive' if keep_alive else 'close'),
+    ]
+    for name, value in (headers or {}).items():
+        lines.append("%s: %s" % (name, value))
+    return ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1') + body
@@ -0,0 +1,177 @@
+import numpy as np
+
+FIXED_STRATEGY = 'fixed'
+CONSTANT_PERCENTAGE_STRATEGY = 'constant-percentage'
+VPW_STRATEGY = 'vpw'
+GUARDRAILS_STRATEGY = 'guardrails'
+FLOOR_AND_CEILING_STRATEGY = 'floor-and-ceiling'
+
+def _safe_divide(numerator, denominator):
+    """
+    Elementwise numerator / denominator, with 0 wherever the denominator isn't positive
+    """
+    return np.divide(numerator, denominator, out=np.zeros(np.broadcast(numerator, denominator).shape), where=denominator > 0)
+
+class WithdrawalStrategy:
+    """
+    Decides how much to withdraw at the start of each year after retiring, for many paths at once.
+
+    Subclasses implement get_withdrawals, which gets called once a year with arrays holding every path's state and must
+     return an array with every path's withdrawal, and reset if they keep any per-path state between years.
+    """
+    def reset(self, num_paths):
+        """
+        Called before simulating a new set of num_paths paths
+        """
+        pass
+
+    def get_withdrawals(self, years_left, balance, planned_withdrawal, newly_retired, last_return, last_inflation):
+        """
+        Args:
+            years_left: number of years left to withdraw for, including this one
+            balance: array with each path's balance at the start of the year, before withdrawing
+            planned_withdrawal: array with each path's planned gross retirement income for the year, adjusted for the
+                inflation seen so far
+            newly_retired: boolean array of the paths retiring this year
+            last_return: array with each path's post-retirement return over the previous year, or None in the first year
+            last_inflation: array with each path's inflation over the previous year, or None in the first year
+
+        Returns:
+            array with each path's withdrawal for the year; only used for paths that have retired
+        """
+        raise NotImplementedError()
+
+class FixedWithdrawals(WithdrawalStrategy):
+    """
+    Withdraws the planned retirement income every year, adjusted for inflation, no matter how the market does
+    """
+    def get_withdrawals(self, years_left, balance, planned_withdrawal, newly_retired, last_return, last_inflation):
+        return planned_withdrawal
+
+class ConstantPercentageWithdrawals(WithdrawalStrategy):
+    """
+    Withdraws the same percentage of the balance every year, so income rises and falls with the market but the money
+     never runs out
+    """
+    def __init__(self, rate=None):
+        """
+        Args:
+            rate: fraction of the balance to withdraw each year, as double (0.XX), or None to use the rate that gives the
+                planned retirement income in the year each path retires
+        """
+        if rate is not None and not 0 <= rate <= 1:
+            raise ValueError("Withdrawal rate must be between 0 and 1")
+        self.rate = rate
+        self.rates = None
+
+    def reset(self, num_paths):
+        self.rates = np.full(num_paths, self.rate if self.rate is not None else 0.0)
+
+    def get_withdrawals(self, years_left, balance, planned_withdrawal, newly_retired, last_return, last_inflation):
+        if self.rate is None:
+            self.rates = np.where(newly_retired, _safe_divide(planned_withdrawal, balance), self.rates)
+        return self.rates * balance
+
+class FloorAndCeilingWithdrawals(ConstantPercentageWithdrawals):
+    """
+    Withdraws a constant percentage of the balance, but never less than a floor or more than a ceiling relative to the
+     planned retirement income
+    """
+    def __init__(self, rate=None, floor=0.9, ceiling=1.2):
+        """
+        Args:
+            rate: as for ConstantPercentageWithdrawals
+            floor: least to withdraw in a year, as a fraction of the planned retirement income
+            ceiling: most to withdraw in a year, as a fraction of the planned retirement income
+        """
+        super().__init__(rate)
+        if floor < 0 or ceiling < floor:
+            raise ValueError("Withdrawal floor must be >= 0 and no more than the ceiling")
+        self.floor = floor
+        self.ceiling = ceiling
+
+    def get_withdrawals(self, years_left, balance, planned_withdrawal, newly_retired, last_return, last_inflation):
+        withdrawals = super().get_withdrawals(years_left, balance, planned_withdrawal, newly_retired, last_return, last_inflation)
+        return np.clip(withdrawals, self.floor * planned_withdrawal, self.ceiling * planned_withdrawal)
+
+class VariablePercentageWithdrawals(WithdrawalStrategy):
+    """
+    Variable percentage withdrawal (VPW): each year, withdraws the payment that would run the balance down to nothing
+     over the years left if it grew at the expected return, so the percentage withdrawn rises with age
+    """
+    def __init__(self, expected_return=0.03):
+        """
+        Args:
+            expected_return: return the balance is assumed to get over the years left, as double (0.XX)
+        """
+        if expected_return <= -1:
+            raise ValueError("Expected return must be > -1")
+        self.expected_return = expected_return
+
+    def get_withdrawals(self, years_left, balance, planned_withdrawal, newly_retired, last_return, last_inflation):
+        if self.expected_return == 0:
+            return balance / years_left
+        # Payment at the start of each of the years left, as a fraction of the balance (an annuity due); the last year's
+        #  is the whole balance, so it gets capped there in case rounding leaves it a hair over
+        discount = (1 + self.expected_return) ** -years_left
+        return np.minimum(balance, balance * self.expected_return / ((1 - discount) * (1 + self.expected_return)))
+
+class GuardrailsWithdrawals(WithdrawalStrategy):
+    """
+    Guyton-Klinger guardrails: starts by withdrawing the planned retirement income and raises it with inflation, except
+     after a losing year when the withdrawal rate is above where it started. Whenever the withdrawal rate drifts more
+     than the guardrail above its starting rate the withdrawal gets cut (unless there are only a few years left), and
+     whenever it drifts more than the guardrail below it gets raised.
+    """
+    def __init__(self, guardrail=0.2, adjustment=0.1, preservation_cutoff_years=15):
+        """
+        Args:
+            guardrail: how far the withdrawal rate can drift from its starting rate before the withdrawal gets adjusted,
+                as a fraction of the starting rate
+            adjustment: fraction to cut or raise the withdrawal by when it hits a guardrail
+            preservation_cutoff_years: withdrawals aren't cut with this many years or fewer left
+        """
+        if guardrail < 0 or not 0 <= adjustment < 1:
+            raise ValueError("Guardrail must be >= 0 and adjustment must be between 0 and 1")
+        self.guardrail = guardrail
+        self.adjustment = adjustment
+        self.preservation_cutoff_years = preservation_cutoff_years
+        self.withdrawals = None
+        self.initial_rates = None
+
+    def reset(self, num_paths):
+        self.withdrawals = np.zeros(num_paths)
+        self.initial_rates = np.zeros(num_paths)
+
+    def get_withdrawals(self, years_left, balance, planned_withdrawal, newly_retired, last_return, last_inflation):
+        withdrawals = self.withdrawals
+        if last_inflation is not None:
+            # Skip the inflation raise after a losing year if the withdrawal rate is already above where it started
+            skip_raise = (last_return < 0) & (_safe_divide(withdrawals, balance) > self.initial_rates)
+            withdrawals = np.where(skip_raise, withdrawals, withdrawals * (1 + last_inflation))
+        rates = np.divide(withdrawals, balance, out=np.full(len(balance), np.inf), where=balance > 0)
+        if years_left > self.preservation_cutoff_years:
+            withdrawals = np.where(rates > self.initial_rates * (1 + self.guardrail), withdrawals * (1 - self.adjustment), withdrawals)
+        withdrawals = np.where(rates < self.initial_rates * (1 - self.guardrail), withdrawals * (1 + self.adjustment), withdrawals)
+
+        withdrawals = np.where(newly_retired, planned_withdrawal, withdrawals)
+        self.initial_rates = np.where(newly_retired, _safe_divide(planned_withdrawal, balance), self.initial_rates)
+        self.withdrawals = withdrawals
+        return withdrawals
+
+# The built-in strategies by name, each with its default settings
+STRATEGIES = {
+    FIXED_STRATEGY: FixedWithdrawals,
+    CONSTANT_PERCENTAGE_STRATEGY: ConstantPercentageWithdrawals,
+    VPW_STRATEGY: VariablePercentageWithdrawals,
+    GUARDRAILS_STRATEGY: GuardrailsWithdrawals,
+    FLOOR_AND_CEILING_STRATEGY: FloorAndCeilingWithdrawals,
+}
+
+def build_strategy(name):
+    """
+    Get a new instance of the built-in strategy with the given name, with its default settings
+    """
+    if name not in STRATEGIES:
+        raise ValueError("Invalid withdrawal strategy '%s'; must be one of %s" % (name, ", ".join(STRATEGIES)))
+    return STRATEGIES[name]()